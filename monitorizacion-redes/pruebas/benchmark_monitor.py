@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Benchmarks del monitor: parseo, agregación, tick de estadísticas y API
+
+Genera flujos sintéticos (campos de tshark, JSON y pcap) y mide sobre un
+WiresharkMonitor nuevo por prueba, sin tshark ni interfaces reales:
+
+    python3 benchmark_monitor.py --packets 200000 --output base.json
+    python3 benchmark_monitor.py --compare base.json --threshold 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+with contextlib.redirect_stdout(sys.stderr):
+    import wireshark_server_fix2 as server
+from fake_tshark import fields_stream, pcap_stream, synthetic_packets, tshark_json
+
+# Métricas donde un valor más alto es mejor (el resto: más bajo es mejor)
+HIGHER_IS_BETTER = ('packets_per_second',)
+
+
+class FakeProcess:
+    """Imita el Popen de tshark/dumpcap leyendo de un flujo en memoria o un pipe"""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.stderr = io.BytesIO()
+
+    def poll(self):
+        return 0
+
+    def terminate(self):
+        pass
+
+    def wait(self, timeout=None):
+        return 0
+
+
+def paced_reader(data, rate, packets, chunk_size=65536):
+    """Devuelve un pipe que recibe `data` a `rate` paquetes/s (aprox., por bloques)"""
+    read_fd, write_fd = os.pipe()
+
+    def writer():
+        with os.fdopen(write_fd, 'wb') as pipe:
+            bytes_per_second = len(data) / packets * rate
+            started = time.perf_counter()
+            for offset in range(0, len(data), chunk_size):
+                pipe.write(data[offset:offset + chunk_size])
+                delay = (offset + chunk_size) / bytes_per_second - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    threading.Thread(target=writer, daemon=True).start()
+    return os.fdopen(read_fd, 'rb')
+
+
+def new_monitor(args):
+    """Monitor nuevo, con el historial dentro del directorio temporal de run()"""
+    monitor = server.WiresharkMonitor(connection_capacity=args.capacity)
+    monitor.history = server.HistoryStore(os.path.join(tempfile.mkdtemp(dir=args.history_dir), 'history.bin'))
+    monitor.is_monitoring = True
+    return monitor
+
+
+def run_reader(monitor, reader, stream, backend, workers=0):
+    """Ejecuta un lector del monitor sobre `stream` y devuelve los segundos que tardó"""
+    capture = server.CaptureSession('bench', backend)
+    capture.process = FakeProcess(stream)
+    merger = None
+    if workers:
+        capture.pipeline = server.ShardedPipeline(workers, directions=monitor.directions)
+        capture.pipeline.start()
+        merger = threading.Thread(target=monitor._merge_partials, args=(capture,))
+        merger.start()
+    started = time.perf_counter()
+    reader(capture)
+    if merger:
+        merger.join()
+    return time.perf_counter() - started
+
+
+def bench_fields(packets, args, workers=0):
+    data = fields_stream(packets)
+    stream = paced_reader(data, args.rate, len(packets)) if args.rate else io.BytesIO(data)
+    monitor = new_monitor(args)
+    reader = monitor._process_packets_sharded if workers else monitor._process_packets_fields
+    elapsed = run_reader(monitor, reader, stream, 'fields', workers)
+    return {'packets': monitor.rates.total_packets, 'seconds': elapsed,
+            'packets_per_second': monitor.rates.total_packets / elapsed}
+
+
+def bench_pcap(packets, args):
+    data = pcap_stream(packets)
+    stream = paced_reader(data, args.rate, len(packets)) if args.rate else io.BytesIO(data)
+    monitor = new_monitor(args)
+    elapsed = run_reader(monitor, monitor._process_packets_pcap, stream, 'pcap')
+    return {'packets': monitor.rates.total_packets, 'seconds': elapsed,
+            'packets_per_second': monitor.rates.total_packets / elapsed}
+
+
+def bench_json(packets, args):
+    """Lector JSON completo sobre un array con formato como el de tshark -T json"""
+    data = ('[\n' + ',\n'.join(map(tshark_json, packets[:args.json_packets])) + '\n]\n').encode()
+    monitor = new_monitor(args)
+    elapsed = run_reader(monitor, monitor._process_packets, io.BytesIO(data), 'json')
+    return {'packets': monitor.rates.total_packets, 'seconds': elapsed,
+            'packets_per_second': monitor.rates.total_packets / elapsed}
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+    }
+
+
+def loaded_monitor(packets, args):
+    """Monitor con los paquetes ya procesados (para medir tick y API)"""
+    monitor = new_monitor(args)
+    batch, _ = server.parse_fields_batch(fields_stream(packets).split(b'\n', 1)[1].rstrip(b'\n'))
+    monitor.clock = lambda: batch.timestamps[-1]
+    monitor._process_batch(batch)
+    return monitor
+
+
+def bench_stats_tick(packets, args):
+    """Costo de un tick de _calculate_stats (_update_stats + snapshot)"""
+    monitor = loaded_monitor(packets, args)
+    now = monitor.clock()
+    samples = []
+    for i in range(args.ticks):
+        started = time.perf_counter()
+        monitor._update_stats(now + i)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def bench_api_stats(packets, args):
+    """Latencia de GET /api/stats con el cliente de pruebas de Flask"""
+    server.monitor = loaded_monitor(packets, args)
+    server.monitor._update_stats(server.monitor.clock())
+    client = server.app.test_client()
+    samples = []
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        response = client.get('/api/stats')
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200
+    result = percentiles(samples)
+    result['body_bytes'] = len(response.data)
+    return result
+
+
+def bench_memory(packets, args):
+    """Memoria retenida por paquete (historial, flujos, top y jerarquía)"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    monitor = loaded_monitor(packets, args)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    count = monitor.rates.total_packets
+    return {
+        'packets': count,
+        'retained_bytes': retained,
+        'bytes_per_packet': retained / count,
+        'connection_store_bytes': monitor.connections.memory_bytes(),
+        'flows': len(monitor.flows)
+    }
+
+
+BENCHMARKS = {
+    'fields': bench_fields,
+    'pcap': bench_pcap,
+    'json': bench_json,
+    'stats_tick': bench_stats_tick,
+    'api_stats': bench_api_stats,
+    'memory': bench_memory
+}
+
+
+def run(args):
+    packets = list(synthetic_packets(args.packets, args.seed, start=1700000000.0))
+    names = args.only or list(BENCHMARKS)
+    if args.workers and 'fields' in names:
+        names.insert(names.index('fields') + 1, 'fields_sharded')
+
+    results = {}
+    # Los historiales de todos los monitores se borran al terminar
+    with tempfile.TemporaryDirectory() as args.history_dir:
+        for name in names:
+            print(f"⏱️  {name}...", file=sys.stderr)
+            if name == 'fields_sharded':
+                runs = [bench_fields(packets, args, args.workers) for _ in range(args.repeat)]
+            else:
+                runs = [BENCHMARKS[name](packets, args) for _ in range(args.repeat)]
+            # Se queda la mejor corrida (menos ruido de otros procesos)
+            if 'packets_per_second' in runs[0]:
+                results[name] = max(runs, key=lambda result: result['packets_per_second'])
+            else:
+                results[name] = min(runs, key=lambda result: result.get('p50_ms', result.get('bytes_per_packet', 0)))
+
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'config': {'packets': args.packets, 'rate': args.rate, 'capacity': args.capacity,
+                   'workers': args.workers, 'seed': args.seed},
+        'results': results
+    }
+
+
+def compare(current, baseline, threshold):
+    """Imprime la diferencia con una corrida anterior; devuelve True si hay regresiones"""
+    regressions = False
+    print(f"\n📊 Comparación contra {baseline.get('timestamp')} (umbral {threshold}%)")
+    for name, metrics in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        for metric, value in metrics.items():
+            old = previous.get(metric)
+            if not isinstance(value, (int, float)) or not old or metric in ('packets', 'seconds', 'flows'):
+                continue
+            change = (value - old) / old * 100
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = '❌' if worse > threshold else '✅'
+            regressions = regressions or worse > threshold
+            print(f"   {flag} {name}.{metric}: {old:.4g} -> {value:.4g} ({change:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks del monitor de Wireshark')
+    parser.add_argument('--packets', type=int, default=200000, help='Paquetes sintéticos por prueba')
+    parser.add_argument('--json-packets', type=int, default=50000, help='Paquetes para la prueba JSON')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Paquetes/s del flujo sintético (0 = lo más rápido posible)')
+    parser.add_argument('--capacity', type=int, default=100000, help='Capacidad del historial de conexiones')
+    parser.add_argument('--workers', type=int, default=0, help='Mide también el parseo repartido en procesos')
+    parser.add_argument('--ticks', type=int, default=200, help='Ticks de estadísticas a medir')
+    parser.add_argument('--requests', type=int, default=500, help='Requests a /api/stats')
+    parser.add_argument('--repeat', type=int, default=1, help='Corridas por prueba (se toma la mejor)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Solo estas pruebas')
+    parser.add_argument('--output', help='Guarda los resultados en este archivo JSON')
+    parser.add_argument('--compare', metavar='BASE', help='Compara contra un JSON de una corrida anterior')
+    parser.add_argument('--threshold', type=float, default=10, help='Porcentaje tolerado antes de marcar regresión')
+    args = parser.parse_args()
+
+    # Los mensajes del servidor van a stderr para no mezclarse con el JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+        print(f"💾 Resultados guardados en {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Reemplazo de tshark/dumpcap para pruebas de carga sin root ni tráfico real
+
+Imita `tshark -D`, la salida de campos (-T fields) y JSON (-T json) y el pcap
+crudo de `dumpcap -w -`, con tráfico sintético a un ritmo configurable. Se
+selecciona con TSHARK_PATH/DUMPCAP_PATH (o --tshark/--dumpcap del servidor)
+o poniéndolo primero en el PATH con los nombres tshark y dumpcap:
+
+    TSHARK_PATH=./fake_tshark.py DUMPCAP_PATH=./fake_tshark.py \\
+        FAKE_TSHARK_RATE=100000 python3 wireshark_server_fix2.py
+
+Variables de entorno:
+    FAKE_TSHARK_RATE          paquetes/s (0 = lo más rápido posible), 1000 por defecto
+    FAKE_TSHARK_BURST         ráfagas "factor:seg_ráfaga:seg_normal", ej. 10:1:4
+    FAKE_TSHARK_PACKETS       termina después de N paquetes (también -c N)
+    FAKE_TSHARK_DURATION      termina después de N segundos
+    FAKE_TSHARK_INTERFACES    interfaces de -D separadas por coma
+    FAKE_TSHARK_STDERR_EVERY  escribe un aviso en stderr cada N segundos
+    FAKE_TSHARK_FAIL          falla al iniciar: permission, interface o filter
+    FAKE_TSHARK_CRASH_AFTER   termina con error después de N segundos
+    FAKE_TSHARK_JSON          tshark (array con sangría y objetos de varias líneas, como
+                              el real; por defecto) o lines (un objeto por línea)
+    FAKE_TSHARK_SEED          semilla del generador
+
+Con -d (como dumpcap) valida el filtro de captura de -f e imprime un
+programa BPF de mentira; rechaza palabras desconocidas y paréntesis sin par.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import signal
+import socket
+import struct
+import sys
+import time
+
+# Mezcla de tráfico: (peso, pila de frame.protocols, protocolo IP, puertos)
+TRAFFIC_MIX = (
+    (50, 'eth:ethertype:ip:tcp:tls', 6, (443, 8443)),
+    (30, 'eth:ethertype:ip:udp:dns', 17, (53,)),
+    (10, 'eth:ethertype:ipv6:icmpv6', 58, ()),
+    (10, 'eth:ethertype:arp', None, ())
+)
+
+# Mensajes de stderr con el formato de tshark
+FAILURES = {
+    'permission': "tshark: The capture session could not be initiated on interface '{interface}' "
+                  "(You don't have permission to capture on that device).",
+    'interface': "tshark: The capture session could not be initiated on interface '{interface}' "
+                 "(No such device exists).",
+    'filter': "tshark: \"{filter}\" is neither a field nor a protocol name."
+}
+
+# Palabras que acepta la validación de filtros de captura (dumpcap -d)
+BPF_WORDS = {
+    'host', 'net', 'mask', 'port', 'portrange', 'src', 'dst', 'gateway', 'proto', 'less', 'greater',
+    'ether', 'ip', 'ip6', 'arp', 'rarp', 'tcp', 'udp', 'icmp', 'icmp6', 'vlan', 'mpls', 'broadcast',
+    'multicast', 'and', 'or', 'not', 'len', 'tcpflags', 'tcp-syn', 'tcp-ack', 'tcp-fin', 'tcp-rst'
+}
+BPF_TOKEN = re.compile(r"\s*(&&|\|\||[()!\[\]&|=<>+*/-]|[0-9a-fA-F]*:[0-9a-fA-F:.]*(?:/\d+)?|\d[\d.]*(?:/\d+)?|\w[\w-]*)")
+
+
+def synthetic_packets(count=None, seed=1, start=None, hosts=200, rate=20000):
+    """Genera tuplas (ts, tamaño, src, dst, sport, dport, pila, protocolo IP)
+
+    Sin `count` genera sin fin. Los timestamps avanzan según `rate`
+    (llegadas exponenciales) a partir de `start` (por defecto, ahora).
+    """
+    rng = random.Random(seed)
+    local = [f'10.0.{i // 250}.{i % 250 + 1}' for i in range(hosts)]
+    remote = [f'93.184.{i // 250}.{i % 250 + 1}' for i in range(hosts)]
+    local6 = [f'fe80::{i + 1:x}' for i in range(hosts)]
+    weights = [weight for weight, *_ in TRAFFIC_MIX]
+    timestamp = time.time() if start is None else start
+    generated = 0
+    while count is None or generated < count:
+        generated += 1
+        timestamp += rng.expovariate(rate)
+        _, stack, ip_proto, ports = rng.choices(TRAFFIC_MIX, weights)[0]
+        size = rng.randint(60, 1514)
+        if ip_proto is None:
+            yield timestamp, 60, '', '', None, None, stack, None
+            continue
+        if ip_proto == 58:
+            yield timestamp, size, rng.choice(local6), 'ff02::1', None, None, stack, ip_proto
+            continue
+        src, dst = rng.choice(local), rng.choice(remote)
+        sport, dport = rng.randint(1024, 65535), rng.choice(ports)
+        if rng.random() < 0.5:
+            src, dst, sport, dport = dst, src, dport, sport
+        yield timestamp, size, src, dst, sport, dport, stack, ip_proto
+
+
+DEFAULT_FIELDS = ('frame.time_epoch', 'frame.len', 'ip.src', 'ip.dst',
+                  'tcp.srcport', 'tcp.dstport', 'frame.protocols')
+
+
+def field_values(packet, fields):
+    """Valores (texto) de los campos pedidos con -e; vacío si el paquete no lo tiene"""
+    timestamp, size, src, dst, sport, dport, stack, ip_proto = packet
+    ipv6 = ':' in src
+    known = {
+        'frame.time_epoch': f'{timestamp:.9f}',
+        'frame.len': str(size),
+        'frame.protocols': stack,
+        'ip.src': '' if ipv6 else src,
+        'ip.dst': '' if ipv6 else dst,
+        'ipv6.src': src if ipv6 else '',
+        'ipv6.dst': dst if ipv6 else '',
+        'tcp.srcport': str(sport) if ip_proto == 6 else '',
+        'tcp.dstport': str(dport) if ip_proto == 6 else '',
+        'udp.srcport': str(sport) if ip_proto == 17 else '',
+        'udp.dstport': str(dport) if ip_proto == 17 else ''
+    }
+    return [known.get(field, '') for field in fields]
+
+
+def fields_stream(packets, fields=DEFAULT_FIELDS, separator='|', header=True):
+    """Salida de tshark -T fields -E header=y -E separator=| para los paquetes"""
+    lines = [separator.join(fields)] if header else []
+    lines.extend(separator.join(field_values(packet, fields)) for packet in packets)
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def json_packet(packet, fields=None):
+    """Un paquete con la forma de tshark -T json
+
+    Con -e (fields) tshark deja las capas planas con listas de valores;
+    sin -e las agrupa por protocolo.
+    """
+    if fields:
+        values = field_values(packet, fields)
+        layers = {field: [value] for field, value in zip(fields, values) if value}
+    else:
+        timestamp, size, src, dst, sport, dport, stack, ip_proto = packet
+        layers = {'frame': {'frame.time_epoch': f'{timestamp:.9f}', 'frame.len': str(size),
+                            'frame.protocols': stack}}
+        if src and ':' not in src:
+            layers['ip'] = {'ip.src': src, 'ip.dst': dst}
+        if ip_proto == 6:
+            layers['tcp'] = {'tcp.srcport': str(sport), 'tcp.dstport': str(dport)}
+    return {'_source': {'layers': layers}}
+
+
+def tshark_json(packet, fields=None):
+    """Un paquete como lo escribe tshark -T json dentro del array: con
+    sangría, un campo por línea y las claves _index/_type/_score"""
+    document = {'_index': time.strftime('packets-%Y-%m-%d', time.gmtime(packet[0])),
+                '_type': 'doc', '_score': None}
+    document.update(json_packet(packet, fields))
+    return '  ' + json.dumps(document, indent=2).replace('\n', '\n  ')
+
+
+def pcap_header(snaplen=65535, linktype=1):
+    return struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, snaplen, linktype)
+
+
+def pcap_record(packet):
+    """Registro pcap (Ethernet) de un paquete; ARP sin cabecera IP"""
+    timestamp, size, src, dst, sport, dport, stack, ip_proto = packet
+    if ip_proto is None:
+        frame = b'\xff' * 6 + b'\xaa' * 6 + b'\x08\x06' + bytes(28)
+    elif ip_proto == 58:
+        l4 = b'\x80\x00' + bytes(6)
+        ip = struct.pack('!IHBB16s16s', 0x60000000, len(l4), 58, 64,
+                         socket.inet_pton(socket.AF_INET6, src), socket.inet_pton(socket.AF_INET6, dst))
+        frame = b'\xaa' * 6 + b'\xbb' * 6 + b'\x86\xdd' + ip + l4
+    else:
+        l4 = struct.pack('!HH', sport, dport) + bytes(16 if ip_proto == 6 else 4)
+        ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(l4), 0, 0, 64, ip_proto, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+        frame = b'\xaa' * 6 + b'\xbb' * 6 + b'\x08\x00' + ip + l4
+    seconds = int(timestamp)
+    micros = min(999999, int(round((timestamp - seconds) * 1e6)))
+    return struct.pack('<IIII', seconds, micros, len(frame), max(size, len(frame))) + frame
+
+
+def pcap_stream(packets):
+    """Archivo pcap completo con los paquetes"""
+    return pcap_header() + b''.join(map(pcap_record, packets))
+
+
+def env_float(name, default=0.0):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class Pacer:
+    """Decide cuántos paquetes tocan en cada tick según el ritmo y las ráfagas
+
+    Si el lector no consume a tiempo (stdout lleno) lo atrasado más allá de
+    `backlog` segundos se cuenta como descartado, como haría el kernel.
+    """
+
+    def __init__(self, rate, burst=None, backlog=0.1):
+        self.rate = rate
+        self.factor, self.burst_on, self.burst_off = 1.0, 0.0, 0.0
+        if burst:
+            self.factor, self.burst_on, self.burst_off = (float(part) for part in burst.split(':'))
+        self.started = time.monotonic()
+        self.last = self.started
+        self.credit = 0.0
+        self.backlog = backlog
+        self.dropped = 0
+
+    def due(self):
+        """Paquetes a emitir ahora (espera un poco si todavía no toca ninguno)"""
+        if not self.rate:
+            return 4096
+        now = time.monotonic()
+        rate = self.rate
+        period = self.burst_on + self.burst_off
+        if period and (now - self.started) % period < self.burst_on:
+            rate *= self.factor
+        self.credit += (now - self.last) * rate
+        self.last = now
+        if self.credit > rate * self.backlog:
+            excess = int(self.credit - rate * self.backlog)
+            self.dropped += excess
+            self.credit -= excess
+        count = int(self.credit)
+        self.credit -= count
+        if not count:
+            time.sleep(min(0.01, 1.0 / rate))
+        return count
+
+
+def compile_filter(expression, interface):
+    """Imita `dumpcap -d`: valida el filtro de forma aproximada e imprime un programa BPF"""
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = BPF_TOKEN.match(expression, position)
+        if not match:
+            tokens = None
+            break
+        tokens.append(match.group(1))
+        position = match.end()
+    words = [token for token in tokens or () if token[0].isalpha() and ':' not in token]
+    balanced = tokens is not None and tokens.count('(') == tokens.count(')')
+    if not balanced or any(word.lower() not in BPF_WORDS for word in words):
+        print(f"dumpcap: Invalid capture filter \"{expression}\" for interface '{interface}'.\n\n"
+              "That string isn't a valid capture filter (can't parse filter expression: syntax error).\n"
+              "See the User's Guide for a description of the capture filter syntax.", file=sys.stderr)
+        return 1
+    program = ['ldh      [12]'] + [f'jeq      #0x800           jt {i + 2}\tjf {i + 3}' for i in range(len(tokens))]
+    program += ['ret      #262144', 'ret      #0']
+    for number, instruction in enumerate(program):
+        print(f"({number:03d}) {instruction}")
+    return 0
+
+
+def list_interfaces():
+    names = os.environ.get('FAKE_TSHARK_INTERFACES', 'eth0,wlan0,lo,any').split(',')
+    for number, name in enumerate(names, 1):
+        print(f"{number}. {name.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-D', action='store_true')
+    parser.add_argument('-i', action='append', default=[])
+    parser.add_argument('-T')
+    parser.add_argument('-e', action='append', default=[])
+    parser.add_argument('-E', action='append', default=[])
+    parser.add_argument('-Y', default='')
+    parser.add_argument('-f', default='')
+    parser.add_argument('-w')
+    parser.add_argument('-c', type=int)
+    parser.add_argument('-d', action='store_true')
+    args, _ = parser.parse_known_args()
+
+    if args.D:
+        list_interfaces()
+        return 0
+
+    interface = ','.join(args.i) or 'any'
+    failure = os.environ.get('FAKE_TSHARK_FAIL')
+    if args.d:
+        return compile_filter(args.f, interface)
+    if failure:
+        print(FAILURES.get(failure, failure).format(interface=interface, filter=args.Y or args.f),
+              file=sys.stderr, flush=True)
+        return 2
+
+    dumpcap = 'dumpcap' in os.path.basename(sys.argv[0]) or (args.w == '-' and not args.T)
+    options = dict(option.split('=', 1) for option in args.E if '=' in option)
+    separator = options.get('separator', '\t')
+    fields = args.e or list(DEFAULT_FIELDS)
+    json_style = os.environ.get('FAKE_TSHARK_JSON', 'tshark')
+
+    limit = args.c or int(env_float('FAKE_TSHARK_PACKETS')) or None
+    duration = env_float('FAKE_TSHARK_DURATION')
+    crash_after = env_float('FAKE_TSHARK_CRASH_AFTER')
+    stderr_every = env_float('FAKE_TSHARK_STDERR_EVERY')
+    pacer = Pacer(env_float('FAKE_TSHARK_RATE', 1000), os.environ.get('FAKE_TSHARK_BURST'))
+    packets = synthetic_packets(seed=int(env_float('FAKE_TSHARK_SEED', 1)))
+
+    emitted = 0
+    out = sys.stdout.buffer
+
+    def finish(*_):
+        # tshark informa el total por stderr al terminar
+        print(f"{emitted} packets captured", file=sys.stderr, flush=True)
+        if pacer.dropped:
+            print(f"{pacer.dropped} packets dropped from {interface}", file=sys.stderr, flush=True)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, finish)
+    signal.signal(signal.SIGINT, finish)
+    print(f"Capturing on '{interface}'", file=sys.stderr, flush=True)
+
+    if dumpcap:
+        out.write(pcap_header())
+    elif args.T == 'fields' and options.get('header') == 'y':
+        out.write((separator.join(fields) + '\n').encode())
+    elif args.T == 'json' and json_style == 'tshark':
+        out.write(b'[\n')
+    out.flush()
+
+    started = time.monotonic()
+    last_warning = started
+    previous_wall = time.time()
+    try:
+        while limit is None or emitted < limit:
+            now = time.monotonic()
+            if duration and now - started >= duration:
+                break
+            if crash_after and now - started >= crash_after:
+                print("tshark: Error while capturing packets: The network adapter on which the capture "
+                      "was being done is no longer running; the capture has stopped.", file=sys.stderr, flush=True)
+                return 1
+            if stderr_every and now - last_warning >= stderr_every:
+                last_warning = now
+                print(f"tshark: Warning: {emitted} packets so far, some may have been dropped",
+                      file=sys.stderr, flush=True)
+
+            count = pacer.due()
+            if limit is not None:
+                count = min(count, limit - emitted)
+            if not count:
+                continue
+            # Los timestamps salen del reloj real, repartidos desde el tick anterior
+            wall = time.time()
+            step = (wall - previous_wall) / count
+            batch = [(previous_wall + step * (i + 1),) + next(packets)[1:] for i in range(count)]
+            previous_wall = wall
+            if dumpcap:
+                chunk = b''.join(map(pcap_record, batch))
+            elif args.T == 'json':
+                if json_style == 'lines':
+                    chunk = ''.join(json.dumps(json_packet(packet, args.e)) + '\n' for packet in batch).encode()
+                else:
+                    chunk = ''.join(('' if emitted + i == 0 else ',\n') + tshark_json(packet, args.e)
+                                    for i, packet in enumerate(batch)).encode()
+            else:
+                chunk = fields_stream(batch, fields, separator, header=False)
+            # Se cuentan antes de escribir: la escritura bloquea si el lector se atrasa
+            emitted += count
+            out.write(chunk)
+            out.flush()
+    except BrokenPipeError:
+        return 0
+
+    if args.T == 'json' and json_style == 'tshark' and not dumpcap:
+        out.write(b'\n]\n')
+        out.flush()
+    finish()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
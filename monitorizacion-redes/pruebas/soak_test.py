@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Prueba de punta a punta del monitor contra fake_tshark.py
+
+Arranca capturas de verdad (proceso, threads lector y de errores, tick de
+estadísticas) con el reemplazo de tshark y verifica que los paquetes
+lleguen a las estadísticas y que /metrics siga siendo válido:
+
+    python3 soak_test.py
+    SOAK_SECONDS=60 FAKE_TSHARK_RATE=100000 python3 soak_test.py
+"""
+import contextlib
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import wireshark_server_fix2 as server
+
+# Una muestra del formato de exposición: nombre, etiquetas escapadas y valor
+SAMPLE_LINE = re.compile(r'[a-zA-Z_:][\w:]*(\{[a-zA-Z_]\w*="(?:[^"\\\n]|\\.)*"(?:,[a-zA-Z_]\w*="(?:[^"\\\n]|\\.)*")*\})? \S+')
+FAKE_TSHARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_tshark.py')
+SOAK_SECONDS = float(os.environ.get('SOAK_SECONDS', 2))
+
+
+def run_capture(backend, seconds=SOAK_SECONDS, **env):
+    """Captura `seconds` segundos con fake_tshark; devuelve (paquetes, errores de parseo)"""
+    server.TSHARK_PATH = server.DUMPCAP_PATH = FAKE_TSHARK
+    os.environ.setdefault('FAKE_TSHARK_RATE', '2000')
+    previous = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    with tempfile.TemporaryDirectory() as directory:
+        monitor = server.WiresharkMonitor()
+        monitor.history = server.HistoryStore(os.path.join(directory, 'history.bin'))
+        try:
+            assert monitor.start_monitoring('eth0', backend=backend), f"No arrancó la captura {backend}"
+            time.sleep(seconds)
+        finally:
+            monitor.stop_monitoring()
+            monitor.history.close()
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+    errors = monitor.json_errors.labels('eth0').value + monitor.lines_rejected.labels('eth0').value
+    return monitor.rates.total_packets, errors
+
+
+def check_backend(backend, **env):
+    packets, errors = run_capture(backend, **env)
+    assert packets > 0, f"El backend {backend} no registró paquetes"
+    assert errors == 0, f"El backend {backend} tuvo {errors} errores de decodificación"
+    print(f"📦 {' '.join([backend, *env.values()])}: {packets} paquetes")
+
+
+def test_fields_backend():
+    check_backend('fields')
+
+
+def test_pcap_backend():
+    check_backend('pcap')
+
+
+def test_json_backend():
+    """tshark -T json escribe un único array con sangría: se tienen que contar los paquetes"""
+    check_backend('json', FAKE_TSHARK_JSON='tshark')
+
+
+def test_json_lines_backend():
+    """Un objeto por línea (sin array) también se tiene que leer"""
+    check_backend('json', FAKE_TSHARK_JSON='lines')
+
+
+def test_metrics_hostile_interface():
+    """Comillas, barras y saltos de línea en una interfaz no rompen /metrics"""
+    interface = 'eth"0\\x\ny'
+    monitor = server.WiresharkMonitor()
+    monitor.captures[interface] = server.CaptureSession(interface, 'fields')
+    monitor.lines_read.labels(interface).inc(3)
+    for openmetrics in (True, False):
+        text = monitor.metrics_text(openmetrics)
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                assert SAMPLE_LINE.fullmatch(line), f"Línea inválida en /metrics: {line!r}"
+        assert 'interface="eth\\"0\\\\x\\ny"' in text, "La interfaz no quedó escapada"
+    print(f"📈 /metrics válido con la interfaz {interface!r}")
+
+
+def main():
+    failed = 0
+    tests = [test_fields_backend, test_pcap_backend, test_json_backend, test_json_lines_backend,
+             test_metrics_hostile_interface]
+    for test in tests:
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
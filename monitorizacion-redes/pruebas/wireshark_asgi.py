@@ -0,0 +1,628 @@
+#!/usr/bin/env python3
+"""
+Modo asyncio/ASGI del monitor de Wireshark
+
+Las capturas se leen con asyncio.create_subprocess_exec (stdout y stderr),
+el tick de estadísticas es una tarea del loop y las mismas rutas /api/* se
+sirven desde una app ASGI: un cliente de /api/stream inactivo es una
+corrutina esperando su cola, no un thread.
+
+    python3 wireshark_asgi.py --port 5000                      # uvicorn/hypercorn si están instalados
+    python3 wireshark_asgi.py --server builtin --port 5000     # servidor HTTP/1.1 incluido
+    uvicorn wireshark_asgi:create_app --factory --port 5000    # o cualquier servidor ASGI
+
+uvicorn o hypercorn (opcionales) son los servidores recomendados; el
+servidor incluido es mínimo y queda para cuando no están instalados.
+
+Las rutas se resuelven con las vistas Flask de wireshark_server_fix2 a través
+de un puente WSGI que corre en el pool de threads: una vista que consulta el
+historial o espera a tshark/dumpcap no frena el loop. Solo las que devuelven
+el snapshot ya armado (stats, status) se atienden dentro del loop. El lector
+y el procesamiento comparten la tarea de cada captura: si el procesamiento se
+atrasa, el pipe se llena como con la política block (el parseo en procesos
+no está disponible en este modo).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import sys
+import time
+from http import HTTPStatus
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import wireshark_server_fix2 as server
+
+# Servidores ASGI opcionales (preferidos frente al HTTPServer incluido)
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+try:
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config as HypercornConfig
+except ImportError:
+    hypercorn_serve = None
+
+# Bytes por lectura del pipe: bloques chicos para no retener el loop
+CHUNK_SIZE = 65536
+# Paquetes JSON procesados antes de ceder el loop
+JSON_PACKETS_PER_TURN = 64
+# Rutas que solo leen el snapshot ya armado: se atienden dentro del loop (el
+# resto va al pool de threads)
+INLINE_ROUTES = ('/api/stats', '/api/status')
+# Tamaño máximo del cuerpo de un request en el servidor incluido
+MAX_BODY_BYTES = 1 << 20
+
+
+class AsyncProcess:
+    """Envuelve un asyncio.subprocess.Process con la interfaz que usa CaptureSession.stop"""
+
+    def __init__(self, process, loop, kill_after=5):
+        self.process = process
+        self.loop = loop
+        self.kill_after = kill_after
+
+    def poll(self):
+        return self.process.returncode
+
+    def terminate(self):
+        # Se puede llamar desde la vista de /api/stop o desde el pool de threads
+        self.loop.call_soon_threadsafe(self._signal, 'terminate')
+
+    def kill(self):
+        self.loop.call_soon_threadsafe(self._signal, 'kill')
+
+    def wait(self, timeout=None):
+        """No bloquea: la tarea lectora espera la salida del proceso"""
+        return self.process.returncode
+
+    def _signal(self, action):
+        if self.process.returncode is not None:
+            return
+        with contextlib.suppress(ProcessLookupError):
+            getattr(self.process, action)()
+        if action == 'terminate':
+            self.loop.call_later(self.kill_after, self._signal, 'kill')
+
+
+class AsyncWiresharkMonitor(server.WiresharkMonitor):
+    """WiresharkMonitor cuyas capturas, tick y suscriptores viven en un loop asyncio"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None  # Lo fija la app ASGI al arrancar (o en el primer request)
+        self.tasks = set()  # Capturas y tick en curso
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _spawn(self, coroutine):
+        """Programa una corrutina en el loop del monitor desde cualquier thread"""
+        task = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def shutdown(self, timeout=5):
+        """Detiene las capturas y espera a que sus tareas terminen (shutdown de lifespan)"""
+        if self.is_monitoring:
+            self.stop_monitoring()
+        pending = [asyncio.wrap_future(task) for task in list(self.tasks)]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+    def _start_stats_ticker(self):
+        self._spawn(self._tick())
+
+    async def _tick(self):
+        """Tick de estadísticas como tarea del loop (equivale a _calculate_stats)"""
+        while self.is_monitoring:
+            try:
+                started = time.perf_counter()
+                self._update_stats(self.clock())
+                self.tick_seconds.observe(time.perf_counter() - started)
+            except Exception as e:
+                print(f"❌ Error calculando estadísticas: {e}")
+            await asyncio.sleep(1)  # Actualizar cada segundo
+
+    def _start_capture(self, interface, filter_expr, backend, workers=0, queue_policy='block', capture_filter=''):
+        """Programa la captura de una interfaz como tarea del loop"""
+        print(f"🔄 Iniciando monitoreo en interfaz: {interface} (backend: {backend}, asyncio)")
+        cmd = self._build_capture_command(interface, filter_expr, backend, capture_filter=capture_filter)
+        if shutil.which(cmd[0]) is None:
+            print(f"❌ Error iniciando monitoreo en {interface}: no se encontró {cmd[0]}")
+            return False
+        if workers:
+            print(f"⚠️ El parseo en procesos no está disponible en modo asyncio")
+        print(f"🚀 Ejecutando comando: {' '.join(cmd)}")
+
+        capture = self._new_capture(interface, backend, 0, queue_policy, capture_filter)
+        self.captures[interface] = capture
+        self._spawn(self._run_capture(capture, cmd))
+        return True
+
+    async def _run_capture(self, capture, cmd):
+        """Lanza el proceso de captura y lee stdout/stderr hasta que termina"""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            print(f"❌ Error iniciando monitoreo en {capture.interface}: {e}")
+            capture.running = False
+            if self.captures.get(capture.interface) is capture:
+                self.stop_monitoring(capture.interface)
+            return
+
+        capture.process = AsyncProcess(process, self.loop)
+        if not capture.running:
+            # Se detuvo antes de que el proceso arrancara
+            capture.process.terminate()
+        errors = asyncio.ensure_future(self._read_errors(capture, process.stderr))
+        readers = {
+            'json': self._read_json_async,
+            'fields': self._read_fields_async,
+            'pcap': self._read_pcap_async
+        }
+        try:
+            await readers[capture.backend](capture, process.stdout)
+        except Exception as e:
+            print(f"❌ Error procesando paquetes [{capture.interface}]: {e}")
+        finally:
+            capture.running = False
+            if process.returncode is None:
+                capture.process.terminate()
+            # Vaciar stdout hasta EOF para que asyncio cierre los pipes
+            while await process.stdout.read(CHUNK_SIZE):
+                pass
+            await errors
+            await process.wait()
+
+    async def _read_errors(self, capture, stderr):
+        """Equivale a _check_tshark_errors: lee stderr hasta EOF"""
+        while True:
+            error_line = await stderr.readline()
+            if not error_line:
+                break
+            self._handle_error_line(capture, error_line.decode(errors='replace'))
+
+    async def _read_fields_async(self, capture, stdout):
+        packet_count = 0
+        rejected_count = 0
+        splitter = server.FieldsSplitter()
+        lines_read = self.lines_read.labels(capture.interface)
+        while self.is_monitoring and capture.running:
+            chunk = await stdout.read(CHUNK_SIZE)
+            if not chunk:
+                print("⚠️ Proceso tshark terminado")
+                break
+            block = splitter.feed(chunk)
+            if block:
+                lines_read.inc(server._count_lines(block))
+                packets, rejected = self._consume_fields_block(capture, block)
+                rejected_count += rejected
+                previous = packet_count
+                packet_count += packets
+                if packet_count // 10000 != previous // 10000:
+                    print(f"📦 Procesados {packet_count} paquetes (formato campos)")
+            # read() no cede el loop si ya había datos en el buffer
+            await asyncio.sleep(0)
+        print(f"🏁 Finalizando procesamiento (campos). Total paquetes: {packet_count}, "
+              f"líneas rechazadas: {rejected_count}")
+
+    async def _read_json_async(self, capture, stdout):
+        packet_count = 0
+        splitter = server.JsonPacketSplitter()
+        lines_read = self.lines_read.labels(capture.interface)
+        final = False
+        while not final and self.is_monitoring and capture.running:
+            chunk = await stdout.read(CHUNK_SIZE)
+            if not chunk:
+                print("⚠️ Proceso tshark terminado")
+                final = True
+            spans = self._split_json(capture, splitter, chunk, final)
+            lines_read.inc(len(spans))
+            for start in range(0, len(spans), JSON_PACKETS_PER_TURN):
+                previous = packet_count
+                packet_count += self._consume_json_packets(capture, spans[start:start + JSON_PACKETS_PER_TURN])
+                if packet_count // 1000 != previous // 1000:
+                    print(f"📦 Procesados {packet_count} paquetes (json)")
+                await asyncio.sleep(0)
+        print(f"🏁 Finalizando procesamiento. Total paquetes: {packet_count}")
+
+    async def _read_pcap_async(self, capture, stdout):
+        packet_count = 0
+        reader = server.PcapStreamReader(None)
+        lines_read = self.lines_read.labels(capture.interface)
+        # Detenida la captura se sigue leyendo hasta EOF: la ISB llega al final
+        while True:
+            chunk = await stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            reader.feed(chunk)
+            records = list(reader)
+            if not (records and self.is_monitoring and capture.running):
+                continue
+            lines_read.inc(len(records))
+            previous = packet_count
+            packet_count += self._consume_pcap_records(capture, records)
+            if packet_count // 1000 != previous // 1000:
+                print(f"📦 Procesados {packet_count} paquetes (pcap)")
+            await asyncio.sleep(0)
+        print("⚠️ Flujo pcap terminado")
+        if reader.interface_drops:
+            self._report_capture_drops(capture, sum(reader.interface_drops.values()))
+        print(f"🏁 Finalizando procesamiento (pcap). Total paquetes: {packet_count}")
+
+    def subscribe(self):
+        """Cola asyncio por cliente de /api/stream (se espera sin ocupar un thread)"""
+        events = asyncio.Queue(maxsize=1)
+        self.subscribers.add(events)
+        return events
+
+    def _publish(self, event):
+        # El replay publica desde su thread: las colas asyncio se tocan solo en el loop
+        if not self._in_loop():
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self._publish, event)
+            return
+        for events in list(self.subscribers):
+            if events.full():
+                # Cliente lento: el snapshot pendiente se reemplaza por el nuevo
+                events.get_nowait()
+            events.put_nowait(event)
+
+
+def wsgi_environ(scope, body):
+    """Arma el environ WSGI de un request HTTP de ASGI"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """Ejecuta la app WSGI y devuelve (status, headers, body) ya armados"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response['headers']]
+    return response['status'], headers, body
+
+
+class MonitorASGI:
+    """App ASGI: /api/stream nativo sobre colas asyncio, el resto con las vistas Flask"""
+
+    def __init__(self, monitor, wsgi_app, inline_routes=INLINE_ROUTES, keepalive=15):
+        self.monitor = monitor
+        self.wsgi_app = wsgi_app
+        self.inline_routes = inline_routes
+        self.keepalive = keepalive
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if self.monitor.loop is None:
+            self.monitor.loop = asyncio.get_running_loop()
+
+        if scope['path'] == '/api/stream':
+            await self._stream(receive, send)
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        environ = wsgi_environ(scope, body)
+        if scope['path'] in self.inline_routes:
+            status, headers, body = call_wsgi(self.wsgi_app, environ)
+        else:
+            loop = asyncio.get_running_loop()
+            status, headers, body = await loop.run_in_executor(None, call_wsgi, self.wsgi_app, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.monitor.loop = asyncio.get_running_loop()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.monitor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _stream(self, receive, send):
+        """Server-Sent Events: un snapshot por tick, sin thread por cliente"""
+        events = self.monitor.subscribe()
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                (b'access-control-allow-origin', b'*')
+            ]})
+            event = self.monitor.snapshot.event
+            while not disconnected.done():
+                await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+                waiting = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({waiting, disconnected}, timeout=self.keepalive,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if waiting in done:
+                    event = waiting.result()
+                else:
+                    waiting.cancel()
+                    event = ': keepalive\n\n'  # Mantener viva la conexión sin tráfico
+        except OSError:
+            pass  # El cliente cerró la conexión
+        finally:
+            disconnected.cancel()
+            self.monitor.unsubscribe(events)
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+
+class HTTPServer:
+    """Servidor HTTP/1.1 mínimo sobre asyncio.start_server para correr la app sin uvicorn
+
+    Soporta keep-alive y respuestas en streaming (chunked); no TLS, HTTP/2 ni
+    cuerpos chunked en los requests. Rechaza requests mal formados (400),
+    cabeceras de más de 64 KiB (431) y cuerpos de más de max_body bytes (413).
+    """
+
+    def __init__(self, app, host='0.0.0.0', port=5000, max_body=MAX_BODY_BYTES):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+
+    async def serve(self):
+        # Protocolo lifespan de ASGI: startup antes de escuchar, shutdown al salir
+        lifespan = asyncio.Queue()
+        completed = asyncio.Queue()
+        task = asyncio.ensure_future(self.app({'type': 'lifespan', 'asgi': {'version': '3.0'}},
+                                              lifespan.get, completed.put))
+        await lifespan.put({'type': 'lifespan.startup'})
+        await completed.get()
+        listener = await asyncio.start_server(self._handle, self.host, self.port, limit=1 << 16)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            await lifespan.put({'type': 'lifespan.shutdown'})
+            await completed.get()
+            await task
+
+    async def _handle(self, reader, writer):
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _reject(writer, status):
+        """Responde un error sin pasar por la app y cierra la conexión"""
+        status = HTTPStatus(status)
+        body = f'{status.value} {status.phrase}\n'.encode()
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                     f'content-type: text/plain; charset=utf-8\r\n'
+                     f'content-length: {len(body)}\r\nconnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+        return False
+
+    async def _handle_request(self, reader, writer):
+        """Atiende un request; devuelve True si la conexión sigue abierta (keep-alive)"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            return await self._reject(writer, 431)
+        request_line, *header_lines = head[:-4].decode('latin-1').split('\r\n')
+        parts = request_line.split(' ')
+        if len(parts) != 3 or not parts[1] or parts[2] not in ('HTTP/1.0', 'HTTP/1.1'):
+            return await self._reject(writer, 400)
+        method, target, version = parts
+        headers = []
+        for line in header_lines:
+            name, colon, value = line.partition(':')
+            if not colon or not name or name != name.strip():
+                return await self._reject(writer, 400)
+            headers.append((name.lower().encode('latin-1'), value.strip().encode('latin-1')))
+        fields = dict(headers)
+        if b'transfer-encoding' in fields:
+            return await self._reject(writer, 501)
+        length = fields.get(b'content-length', b'0')
+        if not length.isdigit():
+            return await self._reject(writer, 400)
+        length = int(length)
+        if length > self.max_body:
+            return await self._reject(writer, 413)
+        body = await reader.readexactly(length) if length else b''
+        keep_alive = version == 'HTTP/1.1' and fields.get(b'connection', b'').lower() != b'close'
+        path, _, query = target.partition('?')
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': version[5:],
+            'method': method,
+            'scheme': 'http',
+            'path': unquote(path),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'),
+            'root_path': '',
+            'headers': headers,
+            'client': writer.get_extra_info('peername')[:2],
+            'server': writer.get_extra_info('sockname')[:2]
+        }
+        received = False
+        state = {'chunked': False, 'status': 500, 'headers': []}
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # Solo /api/stream vuelve a llamar: la lectura termina cuando el cliente cierra
+            while await reader.read(1 << 16):
+                pass
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+                state['headers'] = list(message.get('headers', []))
+                return
+            data = message.get('body', b'')
+            more = message.get('more_body', False)
+            if 'sent' not in state:
+                state['sent'] = True
+                response_headers = state['headers']
+                state['chunked'] = more
+                if more:
+                    response_headers.append((b'transfer-encoding', b'chunked'))
+                else:
+                    response_headers.append((b'content-length', str(len(data)).encode()))
+                if not keep_alive:
+                    response_headers.append((b'connection', b'close'))
+                lines = [f'HTTP/1.1 {state["status"]} {HTTPStatus(state["status"]).phrase}'.encode()]
+                lines.extend(name + b': ' + value for name, value in response_headers)
+                writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+            if state['chunked']:
+                if data:
+                    writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                if not more:
+                    writer.write(b'0\r\n\r\n')
+            elif method != 'HEAD':
+                writer.write(data)
+            await writer.drain()
+
+        await self.app(scope, receive, send)
+        return keep_alive and 'sent' in state and received
+
+
+def create_app():
+    """Crea el monitor del modo asyncio y su app ASGI
+
+    Las vistas Flask usan server.monitor, así que se reemplaza por el nuevo.
+    Sirve de fábrica para servidores externos (uvicorn --factory, o
+    hypercorn 'wireshark_asgi:create_app()').
+    """
+    monitor = server.monitor = AsyncWiresharkMonitor()
+    return MonitorASGI(monitor, server.app)
+
+
+def serve(app, host, port, choice='auto'):
+    """Sirve la app con uvicorn o hypercorn si están instalados; si no, con HTTPServer"""
+    if choice == 'auto':
+        choice = 'uvicorn' if uvicorn else 'hypercorn' if hypercorn_serve else 'builtin'
+    print(f"🚀 Servidor asyncio/ASGI ({choice}) en http://{host}:{port} (mismas rutas /api/*)")
+    if choice == 'uvicorn':
+        uvicorn.run(app, host=host, port=port, lifespan='on')
+    elif choice == 'hypercorn':
+        config = HypercornConfig()
+        config.bind = [f'{host}:{port}']
+        asyncio.run(hypercorn_serve(app, config))
+    else:
+        asyncio.run(HTTPServer(app, host, port).serve())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor API REST para Wireshark (modo asyncio/ASGI)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--tshark', default=server.TSHARK_PATH, help='Ejecutable de tshark (o fake_tshark.py)')
+    parser.add_argument('--dumpcap', default=server.DUMPCAP_PATH, help='Ejecutable de dumpcap (o fake_tshark.py)')
+    parser.add_argument('--history', default=server.HISTORY_PATH, help='Archivo mmap del historial de tráfico')
+    parser.add_argument('--ring', metavar='DIR',
+                        help='Guarda los paquetes crudos en un anillo de pcaps (backend pcap)')
+    parser.add_argument('--sampling', choices=server.PacketSampler.MODES, default='off',
+                        help='Muestreo de paquetes: fijo 1 de cada N o adaptado al atraso del lector')
+    parser.add_argument('--sampling-rate', type=int, default=None,
+                        help='N del muestreo fijo (o tasa inicial del adaptativo)')
+    parser.add_argument('--server', choices=('auto', 'uvicorn', 'hypercorn', 'builtin'), default='auto',
+                        help='Servidor HTTP: auto usa uvicorn o hypercorn si están instalados')
+    args = parser.parse_args()
+    if args.server == 'uvicorn' and not uvicorn:
+        parser.error('uvicorn no está instalado (pip install uvicorn)')
+    if args.server == 'hypercorn' and not hypercorn_serve:
+        parser.error('hypercorn no está instalado (pip install hypercorn)')
+    server.TSHARK_PATH = args.tshark
+    server.DUMPCAP_PATH = args.dumpcap
+
+    app = create_app()
+    monitor = app.monitor
+    try:
+        monitor.set_sampling(args.sampling, args.sampling_rate)
+    except ValueError as e:
+        parser.error(str(e))
+    monitor.history = server.HistoryStore(args.history)
+    if args.ring:
+        monitor.ring_options = {'directory': args.ring, 'max_files': 10, 'max_file_bytes': 64 << 20}
+
+    try:
+        serve(app, args.host, args.port, args.server)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,254 +1,3284 @@
 # servidor_wireshark_api.py
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+import argparse
+import bisect
+import codecs
+import heapq
 import subprocess
+import tempfile
+import itertools
 import json
+import math
+import mmap
+import multiprocessing
+import operator
+import os
+import queue
 import threading
 import time
+import zlib
 import re
-from collections import defaultdict, deque
+import socket
+import sys
+import struct
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
 from datetime import datetime
 import psutil
 
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para la conexión desde el navegador
 
+# Formatos de salida de captura soportados por /api/start
+CAPTURE_BACKENDS = ('json', 'fields', 'pcap')
+
+# Ejecutables de captura; se pueden reemplazar (ej. por fake_tshark.py) con
+# TSHARK_PATH/DUMPCAP_PATH o con --tshark/--dumpcap
+TSHARK_PATH = os.environ.get('TSHARK_PATH', 'tshark')
+DUMPCAP_PATH = os.environ.get('DUMPCAP_PATH', 'dumpcap')
+
+class RateBuckets:
+    """Anillo de contadores por segundo para calcular tasas en tiempo constante"""
+
+    def __init__(self, slots=60):
+        self.slots = slots
+        # Segundo (epoch entero) al que corresponde cada posición del anillo
+        self.seconds = [-1] * slots
+        self.packets = [0] * slots
+        self.bytes = [0] * slots
+        # Totales acumulados desde el inicio
+        self.total_packets = 0
+        self.total_bytes = 0
+        self.last_timestamp = None
+        # Las capturas de varias interfaces suman a los mismos contadores
+        self.lock = threading.Lock()
+
+    def add(self, timestamp, size, packets=1):
+        """Suma un paquete al segundo que le corresponde (O(1))"""
+        with self.lock:
+            self._add(timestamp, size, packets)
+
+    def _add(self, timestamp, size, packets=1):
+        second = int(timestamp)
+        index = second % self.slots
+        current = self.seconds[index]
+        if current != second:
+            if current > second:
+                # Paquete más viejo que la ventana: solo cuenta en los totales
+                self.total_packets += packets
+                self.total_bytes += size
+                return
+            self.seconds[index] = second
+            self.packets[index] = 0
+            self.bytes[index] = 0
+        self.packets[index] += packets
+        self.bytes[index] += size
+        self.total_packets += packets
+        self.total_bytes += size
+        if self.last_timestamp is None or timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+
+    def add_batch(self, timestamps, sizes, weight=1):
+        """Suma un lote de paquetes agrupando por segundo cuando vienen ordenados
+
+        Con weight > 1 (muestreo) cada paquete cuenta por `weight` paquetes.
+        """
+        seconds = list(map(int, timestamps))
+        with self.lock:
+            if seconds != sorted(seconds):
+                for timestamp, size in zip(timestamps, sizes):
+                    self._add(timestamp, size * weight, weight)
+                return
+            
+            # Un add por segundo distinto: se buscan los cortes con bisect
+            start = 0
+            count = len(seconds)
+            while start < count:
+                end = bisect.bisect_right(seconds, seconds[start], start)
+                self._add(timestamps[end - 1], sum(sizes[start:end]) * weight, (end - start) * weight)
+                start = end
+
+    def window(self, seconds, now):
+        """Devuelve (paquetes, bytes) de los últimos `seconds` segundos"""
+        seconds = min(seconds, self.slots)
+        newest = int(now)
+        oldest = newest - seconds
+        packets = 0
+        total = 0
+        for second in range(newest, oldest, -1):
+            index = second % self.slots
+            if self.seconds[index] == second:
+                packets += self.packets[index]
+                total += self.bytes[index]
+        return packets, total
+
+    def rate(self, seconds, now):
+        """Devuelve (paquetes/s, bytes/s) promediados sobre la ventana"""
+        packets, total = self.window(seconds, now)
+        seconds = min(seconds, self.slots)
+        return packets / seconds, total / seconds
+
+# Tipos de enlace (linktype) soportados por el decodificador pcap
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 1
+PCAPNG_SPB = 3
+PCAPNG_ISB = 5
+PCAPNG_EPB = 6
+ISB_IFDROP = 5  # Opciones de la ISB con paquetes perdidos (interfaz y sistema operativo)
+ISB_OSDROP = 7
+
+_IPV6_EXTENSION_HEADERS = (0, 43, 44, 51, 60)
+_L4_NAMES = {6: 'tcp', 17: 'udp', 1: 'icmp', 58: 'icmpv6'}
+_L4_PROTOCOLS = {6: 'TCP', 17: 'UDP', 1: 'ICMP', 58: 'ICMP'}
+_LINK_NAMES = {
+    LINKTYPE_NULL: 'null',
+    LINKTYPE_ETHERNET: 'eth',
+    LINKTYPE_RAW: 'raw',
+    LINKTYPE_LINUX_SLL: 'sll',
+    LINKTYPE_IPV4: 'raw',
+    LINKTYPE_IPV6: 'raw',
+    LINKTYPE_LINUX_SLL2: 'sll'
+}
+
+
+class PcapStreamReader:
+    """Lee registros pcap o pcapng desde un flujo binario (dumpcap -w - o archivo)
+
+    Itera tuplas (timestamp, tamaño original, linktype, datos capturados).
+    Con stream=None los bytes se entregan con feed() y cada iteración devuelve
+    los registros completos; el resto queda para la siguiente (modo asyncio).
+    """
+
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        # read1 devuelve lo disponible sin esperar a llenar el bloque
+        self._read = getattr(stream, 'read1', stream.read) if stream is not None else lambda size: b''
+        self.buffer = b''
+        self.offset = 0
+        self.format = None
+        self.endian = '<'
+        self.divisor = 1e6
+        self.record = None
+        self.linktypes = []
+        self.resolutions = []
+        self.interface_drops = {}  # Interfaz pcapng -> paquetes perdidos según su última ISB
+
+    def _fill(self, size):
+        """Garantiza `size` bytes disponibles en el buffer (False si EOF)"""
+        while len(self.buffer) - self.offset < size:
+            chunk = self._read(max(self.chunk_size, size))
+            if not chunk:
+                return False
+            self.buffer = self.buffer[self.offset:] + chunk
+            self.offset = 0
+        return True
+
+    def buffered(self):
+        """Bytes ya leídos del flujo que todavía no se consumieron"""
+        return len(self.buffer) - self.offset
+
+    def feed(self, data):
+        """Agrega bytes recibidos por fuera del flujo (lector sin stream)"""
+        self.buffer = self.buffer[self.offset:] + data
+        self.offset = 0
+
+    def _take(self, size):
+        """Consume `size` bytes del buffer"""
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def __iter__(self):
+        if self.format is None:
+            if not self._fill(4):
+                return
+            magic = self.buffer[self.offset:self.offset + 4]
+            if struct.unpack('<I', magic)[0] == PCAPNG_SHB:
+                self.format = 'pcapng'
+            elif self._fill(24):
+                self._read_pcap_header()
+            else:
+                return
+        if self.format == 'pcapng':
+            yield from self._iter_pcapng()
+        else:
+            yield from self._iter_pcap()
+
+    def _read_pcap_header(self):
+        """Cabecera global del pcap clásico: orden de bytes, resolución y linktype"""
+        header = self._take(24)
+        magic_le = struct.unpack('<I', header[:4])[0]
+        magic_be = struct.unpack('>I', header[:4])[0]
+        if magic_le in (0xA1B2C3D4, 0xA1B23C4D):
+            self.endian, magic = '<', magic_le
+        elif magic_be in (0xA1B2C3D4, 0xA1B23C4D):
+            self.endian, magic = '>', magic_be
+        else:
+            raise ValueError(f"Formato de captura desconocido: {header[:4].hex()}")
+        self.divisor = 1e9 if magic == 0xA1B23C4D else 1e6
+        self.linktypes = [struct.unpack(self.endian + 'I', header[20:24])[0] & 0xFFFF]
+        self.record = struct.Struct(self.endian + 'IIII')
+        self.format = 'pcap'
+
+    def _iter_pcap(self):
+        """Formato pcap clásico: registros de 16 bytes + datos"""
+        record = self.record
+        divisor = self.divisor
+        linktype = self.linktypes[0]
+        while self._fill(16):
+            ts_sec, ts_frac, caplen, origlen = record.unpack_from(self.buffer, self.offset)
+            # El registro se consume entero o no se consume (se puede retomar)
+            if not self._fill(16 + caplen):
+                return
+            self.offset += 16
+            yield ts_sec + ts_frac / divisor, origlen, linktype, self._take(caplen)
+
+    def _iter_pcapng(self):
+        """Formato pcapng: bloques SHB/IDB/EPB/SPB (el resto se ignora)"""
+        while self._fill(12):
+            block_type = struct.unpack_from('<I', self.buffer, self.offset)[0]
+            if block_type == PCAPNG_SHB:
+                # El byte-order magic define el orden de bytes de la sección
+                bom = self.buffer[self.offset + 8:self.offset + 12]
+                self.endian = '<' if struct.unpack('<I', bom)[0] == 0x1A2B3C4D else '>'
+                self.linktypes = []
+                self.resolutions = []
+            block_type, block_len = struct.unpack_from(self.endian + 'II', self.buffer, self.offset)
+            if block_len < 12 or not self._fill(block_len):
+                return
+            block = self._take(block_len)
+            body = block[8:block_len - 4]
+            
+            if block_type == PCAPNG_EPB:
+                interface_id, ts_high, ts_low, caplen, origlen = struct.unpack_from(self.endian + 'IIIII', body)
+                if interface_id >= len(self.linktypes):
+                    continue
+                ticks = (ts_high << 32) | ts_low
+                yield (ticks / self.resolutions[interface_id], origlen,
+                       self.linktypes[interface_id], body[20:20 + caplen])
+            elif block_type == PCAPNG_SPB:
+                if not self.linktypes:
+                    continue
+                origlen = struct.unpack_from(self.endian + 'I', body)[0]
+                caplen = min(origlen, len(body) - 4)
+                yield time.time(), origlen, self.linktypes[0], body[4:4 + caplen]
+            elif block_type == PCAPNG_IDB:
+                linktype = struct.unpack_from(self.endian + 'H', body)[0]
+                self.linktypes.append(linktype)
+                self.resolutions.append(self._parse_tsresol(body[8:]))
+            elif block_type == PCAPNG_ISB:
+                # dumpcap escribe las estadísticas de la interfaz al cerrar la captura
+                interface_id = struct.unpack_from(self.endian + 'I', body)[0]
+                self.interface_drops[interface_id] = self._parse_isb_drops(body[12:])
+
+    def _parse_isb_drops(self, options):
+        """Suma isb_ifdrop e isb_osdrop de las opciones de una ISB"""
+        dropped = 0
+        offset = 0
+        while offset + 4 <= len(options):
+            code, length = struct.unpack_from(self.endian + 'HH', options, offset)
+            if code == 0:
+                break
+            if code in (ISB_IFDROP, ISB_OSDROP) and length == 8:
+                dropped += struct.unpack_from(self.endian + 'Q', options, offset + 4)[0]
+            offset += 4 + ((length + 3) & ~3)
+        return dropped
+
+    def _parse_tsresol(self, options):
+        """Obtiene la resolución de timestamps (if_tsresol) de una IDB"""
+        offset = 0
+        while offset + 4 <= len(options):
+            code, length = struct.unpack_from(self.endian + 'HH', options, offset)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                value = options[offset + 4]
+                return float(2 ** (value & 0x7F)) if value & 0x80 else float(10 ** value)
+            offset += 4 + ((length + 3) & ~3)
+        return 1e6
+
+
+def decode_frame(linktype, data):
+    """Decodifica las cabeceras Ethernet/IPv4/IPv6/TCP/UDP/ICMP de un frame
+
+    Devuelve (ip_src, ip_dst, src_port, dst_port, protocolo, pila de protocolos).
+    """
+    layers = [_LINK_NAMES.get(linktype, 'unknown')]
+    try:
+        # Capa de enlace: obtener ethertype y offset de la cabecera IP
+        if linktype == LINKTYPE_ETHERNET:
+            ethertype = struct.unpack_from('!H', data, 12)[0]
+            offset = 14
+            while ethertype in (0x8100, 0x88A8):
+                layers.append('vlan')
+                ethertype = struct.unpack_from('!H', data, offset + 2)[0]
+                offset += 4
+            layers.append('ethertype')
+        elif linktype == LINKTYPE_LINUX_SLL:
+            ethertype = struct.unpack_from('!H', data, 14)[0]
+            offset = 16
+            layers.append('ethertype')
+        elif linktype == LINKTYPE_LINUX_SLL2:
+            ethertype = struct.unpack_from('!H', data, 0)[0]
+            offset = 20
+            layers.append('ethertype')
+        elif linktype == LINKTYPE_NULL:
+            family = struct.unpack_from('=I', data, 0)[0]
+            ethertype = 0x0800 if family == 2 else 0x86DD
+            offset = 4
+        elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+            ethertype = 0x0800 if data[0] >> 4 == 4 else 0x86DD
+            offset = 0
+        else:
+            return None, None, None, None, 'UNKNOWN', ':'.join(layers)
+        
+        # Capa de red
+        if ethertype == 0x0800:
+            layers.append('ip')
+            header_len = (data[offset] & 0x0F) * 4
+            next_header = data[offset + 9]
+            ip_src = socket.inet_ntoa(data[offset + 12:offset + 16])
+            ip_dst = socket.inet_ntoa(data[offset + 16:offset + 20])
+            fragment = struct.unpack_from('!H', data, offset + 6)[0] & 0x1FFF
+            offset += header_len
+            if fragment:
+                # Fragmentos no iniciales: no hay cabecera de transporte
+                return ip_src, ip_dst, None, None, _L4_PROTOCOLS.get(next_header, 'UNKNOWN'), ':'.join(layers)
+        elif ethertype == 0x86DD:
+            layers.append('ipv6')
+            next_header = data[offset + 6]
+            ip_src = socket.inet_ntop(socket.AF_INET6, data[offset + 8:offset + 24])
+            ip_dst = socket.inet_ntop(socket.AF_INET6, data[offset + 24:offset + 40])
+            offset += 40
+            while next_header in _IPV6_EXTENSION_HEADERS:
+                if next_header == 44:
+                    header_len = 8
+                elif next_header == 51:
+                    header_len = (data[offset + 1] + 2) * 4
+                else:
+                    header_len = (data[offset + 1] + 1) * 8
+                next_header = data[offset]
+                offset += header_len
+        else:
+            layers.append('arp' if ethertype == 0x0806 else 'unknown')
+            return None, None, None, None, 'UNKNOWN', ':'.join(layers)
+        
+        # Capa de transporte
+        protocol = _L4_PROTOCOLS.get(next_header, 'UNKNOWN')
+        layers.append(_L4_NAMES.get(next_header, str(next_header)))
+        if next_header in (6, 17):
+            src_port, dst_port = struct.unpack_from('!HH', data, offset)
+            return ip_src, ip_dst, src_port, dst_port, protocol, ':'.join(layers)
+        return ip_src, ip_dst, None, None, protocol, ':'.join(layers)
+        
+    except (struct.error, IndexError, ValueError, OSError):
+        # Frame truncado por el snaplen o cabeceras inválidas
+        return None, None, None, None, 'UNKNOWN', ':'.join(layers)
+
+
+# Lote de paquetes en columnas, tal como lo entrega el lector por lotes
+PacketBatch = namedtuple('PacketBatch', [
+    'timestamps', 'sizes', 'src_ips', 'dst_ips', 'src_ports', 'dst_ports', 'protocols', 'stacks'
+])
+
+FIELDS_HEADER = b'frame.time_epoch'
+FIELDS_PER_LINE = 7
+
+
+# Clasificación precalculada de una pila de frame.protocols ("eth:ethertype:ip:tcp:tls")
+ProtocolStack = namedtuple('ProtocolStack', ['stack', 'layers', 'paths', 'transport'])
+
+_TRANSPORT_LAYERS = {'tcp': 'TCP', 'udp': 'UDP', 'icmp': 'ICMP', 'icmpv6': 'ICMP'}
+_PROTOCOL_STACKS = {}  # Pila (texto) -> ProtocolStack
+_PROTOCOL_STACKS_MAX = 4096
+
+
+def protocol_stack(stack):
+    """Devuelve la clasificación de una pila de protocolos (una búsqueda en caché)
+
+    El transporte es la primera capa TCP/UDP/ICMP de la pila, así un ICMP
+    que transporta una cabecera TCP sigue contando como ICMP. `paths` son
+    los prefijos de la jerarquía: eth, eth:ethertype, eth:ethertype:ip, ...
+    """
+    info = _PROTOCOL_STACKS.get(stack)
+    if info is None:
+        layers = tuple(sys.intern(layer) for layer in stack.lower().split(':') if layer)
+        transport = next((_TRANSPORT_LAYERS[layer] for layer in layers if layer in _TRANSPORT_LAYERS), 'UNKNOWN')
+        paths = tuple(sys.intern(':'.join(layers[:depth])) for depth in range(1, len(layers) + 1))
+        if len(_PROTOCOL_STACKS) >= _PROTOCOL_STACKS_MAX:
+            _PROTOCOL_STACKS.clear()
+        info = _PROTOCOL_STACKS[stack] = ProtocolStack(stack, layers, paths, transport)
+    return info
+
+
+def _classify_protocols(protocols):
+    """Determina el protocolo de transporte a partir de frame.protocols"""
+    return protocol_stack(protocols).transport
+
+
+# Conversión directa de puertos en bytes a enteros (vacío -> None)
+_PORT_VALUES = {str(port).encode(): port for port in range(65536)}
+_PORT_VALUES[b''] = None
+
+
+def _parse_ports(column):
+    """Convierte una columna de puertos con una búsqueda por valor"""
+    try:
+        return list(map(_PORT_VALUES.__getitem__, column))
+    except KeyError:
+        # Valores múltiples ("80,443") u otros casos raros
+        return [int(p) if p.isdigit() else None for p in column]
+
+
+_SEPARATORS_PER_LINE = FIELDS_PER_LINE - 1
+_count_separators = operator.methodcaller('count', b'|')
+
+
+def _convert_rows(columns, now):
+    """Convierte timestamp y tamaño fila a fila; devuelve (filas válidas, rechazadas)
+
+    Un timestamp vacío toma `now` y un tamaño no numérico queda en 0; un
+    timestamp que no es un número descarta solo esa fila.
+    """
+    rows = []
+    rejected = 0
+    for row in zip(*columns):
+        timestamp, size = row[0], row[1]
+        try:
+            timestamp = float(timestamp) if timestamp else now
+        except ValueError:
+            rejected += 1
+            continue
+        size = int(size) if size.isdigit() else 0
+        if size > 0xFFFFFFFF:
+            rejected += 1
+            continue
+        rows.append((timestamp, size) + row[2:])
+    return rows, rejected
+
+
+def parse_fields_batch(block):
+    """Convierte un bloque de líneas 'campo|campo|...' de tshark en un PacketBatch
+
+    Todo el bloque se corta con un único split y las columnas se convierten
+    en bloque (array + map) en lugar de campo a campo. Devuelve
+    (lote, líneas rechazadas); el lote es None si no hay filas válidas.
+    """
+    if b'\r' in block:
+        block = block.replace(b'\r', b'')
+    
+    lines = block.split(b'\n')
+    rejected = 0
+    if all(map(_SEPARATORS_PER_LINE.__eq__, map(_count_separators, lines))):
+        # Caso normal: todas las líneas completas, columnas por slicing
+        flat = block.replace(b'\n', b'|').split(b'|')
+        columns = [flat[i::FIELDS_PER_LINE] for i in range(FIELDS_PER_LINE)]
+    else:
+        rows = [line.split(b'|') for line in lines if line]
+        valid = [row[:FIELDS_PER_LINE] for row in rows if len(row) >= FIELDS_PER_LINE]
+        rejected = len(rows) - len(valid)
+        if not valid:
+            return None, rejected
+        columns = list(zip(*valid))
+    
+    ts_col, size_col, src_col, dst_col, sport_col, dport_col, proto_col = columns
+    try:
+        timestamps = array('d', map(float, ts_col))
+        sizes = array('L', map(int, size_col))
+    except (ValueError, OverflowError):
+        # Alguna fila con campos numéricos vacíos o inválidos: conversión fila a fila
+        rows, invalid = _convert_rows(columns, time.time())
+        rejected += invalid
+        if not rows:
+            return None, rejected
+        columns = list(zip(*rows))
+        timestamps = array('d', columns[0])
+        sizes = array('L', columns[1])
+        ts_col, size_col, src_col, dst_col, sport_col, dport_col, proto_col = columns
+    
+    # Decodificar cada columna de texto con una sola llamada
+    src_ips = b'|'.join(src_col).decode('ascii', 'replace').split('|')
+    dst_ips = b'|'.join(dst_col).decode('ascii', 'replace').split('|')
+    stacks = b'|'.join(proto_col).decode('ascii', 'replace').split('|')
+    classes = {stack: protocol_stack(stack).transport for stack in set(stacks)}
+    
+    batch = PacketBatch(
+        timestamps,
+        sizes,
+        src_ips,
+        dst_ips,
+        _parse_ports(sport_col),
+        _parse_ports(dport_col),
+        list(map(classes.__getitem__, stacks)),
+        stacks
+    )
+    return batch, rejected
+
+
+class FieldsSplitter:
+    """Corta la salida de tshark -T fields en bloques de líneas completas, sin el header
+
+    feed() recibe lo que se leyó del pipe y devuelve el bloque listo para
+    parse_fields_batch (o b'' si todavía no hay líneas completas de datos).
+    """
+
+    def __init__(self):
+        self.pending = b''
+        self.header_processed = False
+
+    def feed(self, chunk):
+        # La última línea puede estar incompleta: queda para el próximo bloque
+        data = self.pending + chunk
+        end = data.rfind(b'\n')
+        if end < 0:
+            self.pending = data
+            return b''
+        block = data[:end]
+        self.pending = data[end + 1:]
+        
+        # Saltar el header
+        if not self.header_processed:
+            index = block.find(FIELDS_HEADER)
+            if index < 0:
+                return b''
+            self.header_processed = True
+            print("📋 Header procesado, iniciando captura de datos...")
+            end = block.find(b'\n', index)
+            if end < 0:
+                return b''
+            block = block[end + 1:]
+        return block
+
+
+# Lo que separa los paquetes de tshark -T json: el array, comas y espacios
+_JSON_SEPARATORS = re.compile(r'[\s,\[\]]*')
+# Línea que abre un paquete (para resincronizar después de un error)
+_JSON_PACKET_START = re.compile(r'\n[ \t]*\{')
+
+
+class JsonPacketSplitter:
+    """Corta la salida de tshark -T json en paquetes sin decodificarlos
+
+    tshark escribe un único array con formato (cada paquete en varias
+    líneas, cerrado por una línea con `}` a la sangría de la apertura);
+    también se acepta un objeto por línea. feed() solo busca dónde termina
+    cada objeto y devuelve su texto: así el muestreo descarta paquetes
+    antes de pagar el json, y decode() decodifica los que quedan. Lo que no
+    abre un objeto se informa y se saltea hasta la próxima línea que abre
+    un paquete.
+    """
+
+    DECODER = json.JSONDecoder()
+
+    def __init__(self):
+        self.pending = ''
+        self.text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def feed(self, chunk, final=False):
+        """Devuelve (objetos como texto, errores) con lo que se completó; final=True al llegar a EOF"""
+        text = self.pending + self.text.decode(chunk, final)
+        spans = []
+        errors = []
+        position = 0
+        while True:
+            consumed = position
+            position = _JSON_SEPARATORS.match(text, position).end()
+            line_start = text.rfind('\n', 0, position) + 1
+            if position >= len(text):
+                position = max(consumed, line_start)  # La sangría puede seguir en el próximo bloque
+                break
+            line_end = text.find('\n', position)
+            if line_end < 0:
+                if not final:
+                    # Línea incompleta: se guarda desde su comienzo (la sangría hace falta)
+                    position = max(consumed, line_start)
+                    break
+                line_end = len(text)
+            if text[position] != '{':
+                errors.append(f"Se esperaba un objeto - Línea: {text[line_start:line_end].strip()[:100]}")
+                resume = _JSON_PACKET_START.search(text, position)
+                position = resume.start() + 1 if resume else len(text)
+                continue
+            if text[position + 1:line_end].strip():
+                end = line_end  # Objeto (o array compacto) en una sola línea
+            else:
+                indent = text[line_start:position]
+                if indent.strip():
+                    indent = ''  # Abre después del '[': se cierra en la columna 0
+                close = text.find('\n' + indent + '}', line_end)
+                if close < 0:
+                    if not final:
+                        position = max(consumed, line_start)
+                        break
+                    errors.append(f"Objeto sin cerrar - Línea: {text[line_start:line_end].strip()[:100]}")
+                    position = len(text)
+                    continue
+                end = close + len(indent) + 2
+            spans.append(text[position:end])
+            position = end
+        self.pending = text[position:]
+        return spans, errors
+
+    @classmethod
+    def decode(cls, spans):
+        """Decodifica los objetos cortados por feed(); devuelve (paquetes, errores)"""
+        packets = []
+        errors = []
+        raw_decode = cls.DECODER.raw_decode
+        for span in spans:
+            position = 0
+            try:
+                # Una línea puede traer más de un objeto (array compacto)
+                while position < len(span):
+                    packet, position = raw_decode(span, position)
+                    packets.append(packet)
+                    position = _JSON_SEPARATORS.match(span, position).end()
+            except json.JSONDecodeError as e:
+                errors.append(f"{e.msg} - Objeto: {span.strip()[:100]}")
+        return packets, errors
+
+
+# Códigos de protocolo guardados en la columna de un byte del historial
+PROTOCOL_NAMES = ('UNKNOWN', 'TCP', 'UDP', 'ICMP')
+PROTOCOL_CODES = {name: code for code, name in enumerate(PROTOCOL_NAMES)}
+
+_IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+
+def pack_address(ip):
+    """Empaqueta una IP (texto) en 16 bytes; IPv4 como ::ffff:a.b.c.d"""
+    if ',' in ip:
+        # tshark lista varias direcciones en paquetes encapsulados
+        ip = ip.split(',', 1)[0]
+    if ':' in ip:
+        return socket.inet_pton(socket.AF_INET6, ip)
+    return _IPV4_MAPPED_PREFIX + socket.inet_aton(ip)
+
+
+def unpack_address(packed):
+    """Convierte 16 bytes empaquetados de vuelta a texto"""
+    if packed[:12] == _IPV4_MAPPED_PREFIX:
+        return socket.inet_ntoa(packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class LocalAddressIndex:
+    """Clasifica la dirección de cada paquete según las direcciones locales
+
+    Cada IP tiene un nivel: 2 si es una dirección propia, 1 si cae en una
+    subred conectada y 0 si es externa. Un paquete es upload cuando el origen
+    tiene más nivel que el destino y download en el caso contrario; el tráfico
+    entre pares del mismo nivel (loopback, tránsito) no cuenta. Los niveles
+    quedan en un dict por IP, así el camino caliente es una búsqueda O(1).
+    """
+
+    UPLOAD = 1
+    DOWNLOAD = -1
+
+    def __init__(self, refresh_interval=30, cache_size=65536):
+        self.refresh_interval = refresh_interval
+        self.cache_size = cache_size
+        self.cache = {}  # IP (texto) -> nivel
+        self.own = set()  # Direcciones propias empaquetadas como enteros de 128 bits
+        self.networks = {}  # Largo de prefijo -> redes conectadas con ese prefijo
+        self.signature = None
+        self.checked = 0
+        self.refresh()
+
+    def refresh(self):
+        """Relee las direcciones de psutil; si cambiaron rearma el índice"""
+        self.checked = time.monotonic()
+        try:
+            addresses = psutil.net_if_addrs()
+        except Exception as e:
+            print(f"❌ Error leyendo direcciones locales: {e}")
+            return False
+        entries = sorted(
+            (address.address.split('%', 1)[0], address.netmask or '')
+            for interface_addresses in addresses.values()
+            for address in interface_addresses
+            if address.family in (socket.AF_INET, socket.AF_INET6)
+        )
+        if entries == self.signature:
+            return False
+        
+        own = set()
+        networks = defaultdict(set)
+        for address, netmask in entries:
+            try:
+                value = int.from_bytes(pack_address(address), 'big')
+                mask = int.from_bytes(pack_address(netmask), 'big') if netmask else 0
+            except (OSError, ValueError):
+                continue
+            own.add(value)
+            if not mask:
+                continue
+            if ':' in address:
+                prefix = bin(mask).count('1')
+            else:
+                # Las máscaras IPv4 se empaquetan como ::ffff:m, solo cuentan sus 32 bits
+                prefix = 96 + bin(mask & 0xffffffff).count('1')
+            networks[prefix].add(value >> (128 - prefix))
+        self.own = own
+        self.networks = dict(networks)
+        self.signature = entries
+        self.cache = {}
+        return True
+
+    def maybe_refresh(self):
+        """Refresca si pasó refresh_interval desde la última lectura"""
+        if time.monotonic() - self.checked >= self.refresh_interval:
+            self.refresh()
+
+    def _compute(self, ip):
+        try:
+            value = int.from_bytes(pack_address(ip), 'big')
+        except (OSError, ValueError, TypeError):
+            level = 0
+        else:
+            if value in self.own:
+                level = 2
+            elif any(value >> (128 - prefix) in networks for prefix, networks in self.networks.items()):
+                level = 1
+            else:
+                level = 0
+        if len(self.cache) >= self.cache_size:
+            self.cache = {}
+        self.cache[ip] = level
+        return level
+
+    def level(self, ip):
+        level = self.cache.get(ip)
+        return self._compute(ip) if level is None else level
+
+    def _levels(self, ips):
+        levels = list(map(self.cache.get, ips))
+        if None in levels:
+            compute = self._compute
+            levels = [compute(ip) if level is None else level for ip, level in zip(ips, levels)]
+        return levels
+
+    def direction(self, src_ip, dst_ip):
+        """Devuelve UPLOAD, DOWNLOAD o 0 para un paquete"""
+        difference = self.level(src_ip) - self.level(dst_ip)
+        return (difference > 0) - (difference < 0)
+
+    def split(self, timestamps, src_ips, dst_ips, sizes):
+        """Separa un lote en ((timestamps, tamaños) de upload, (timestamps, tamaños) de download)"""
+        differences = list(map(operator.sub, self._levels(src_ips), self._levels(dst_ips)))
+        upload = list(map((0).__lt__, differences))
+        download = list(map((0).__gt__, differences))
+        return (
+            (list(itertools.compress(timestamps, upload)), list(itertools.compress(sizes, upload))),
+            (list(itertools.compress(timestamps, download)), list(itertools.compress(sizes, download)))
+        )
+
+
+class ConnectionStore:
+    """Historial de conexiones en columnas tipadas sobre un anillo de tamaño fijo
+
+    Cada fila ocupa ~53 bytes (timestamp, direcciones empaquetadas, puertos,
+    código de protocolo y tamaño); los dicts solo se arman al consultar.
+    Los índices secundarios (protocolo, IP, puerto) guardan los números de
+    secuencia de cada valor en arrays crecientes. No los arma el lector de
+    paquetes: catch_up() incorpora las filas nuevas de a tramos de
+    CATCH_UP_ROWS, soltando el lock entre tramos para no frenar a extend().
+    Lo llama el tick de estadísticas, así una consulta solo indexa lo que
+    llegó desde el último tick; las secuencias pisadas por el anillo se
+    podan de a tramos de capacity/4 filas.
+    """
+
+    ROW_BYTES = 8 + 16 + 16 + 4 + 4 + 1 + 4
+    CATCH_UP_ROWS = 8192  # Filas indexadas por cada toma del lock
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.src_addrs = bytearray(16 * capacity)
+        self.dst_addrs = bytearray(16 * capacity)
+        self.src_ports = array('i', [-1]) * capacity  # -1 = sin puerto
+        self.dst_ports = array('i', [-1]) * capacity
+        self.protocols = bytearray(capacity)
+        self.sizes = array('I', bytes(4 * capacity))
+        # Filas escritas desde el inicio (la siguiente posición es written % capacity)
+        self.written = 0
+        self._packed = {}
+        self.by_protocol = defaultdict(lambda: array('q'))  # Código -> secuencias
+        self.by_ip = defaultdict(lambda: array('q'))  # Dirección empaquetada -> secuencias
+        self.by_port = defaultdict(lambda: array('q'))  # Puerto -> secuencias
+        self.indexed = 0  # Filas ya incorporadas a los índices
+        self.prune_every = max(1, capacity // 4)
+        self.lock = threading.Lock()  # Escrituras de varias capturas y consultas de la API
+        self.index_lock = threading.Lock()  # Una sola puesta al día de los índices a la vez
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def _pack(self, ip):
+        """Empaqueta una dirección usando un caché acotado de direcciones vistas"""
+        packed = self._packed.get(ip)
+        if packed is None:
+            if len(self._packed) >= 65536:
+                self._packed.clear()
+            try:
+                packed = pack_address(ip)
+            except OSError:
+                packed = bytes(16)
+            self._packed[ip] = packed
+        return packed
+
+    def append(self, timestamp, src_ip, dst_ip, src_port, dst_port, protocol, size):
+        """Agrega una fila sobrescribiendo la más vieja si el anillo está lleno"""
+        src = self._pack(src_ip)
+        dst = self._pack(dst_ip)
+        with self.lock:
+            index = self.written % self.capacity
+            offset = index * 16
+            self.timestamps[index] = timestamp
+            self.src_addrs[offset:offset + 16] = src
+            self.dst_addrs[offset:offset + 16] = dst
+            self.src_ports[index] = -1 if src_port is None else src_port
+            self.dst_ports[index] = -1 if dst_port is None else dst_port
+            self.protocols[index] = PROTOCOL_CODES.get(protocol, 0)
+            self.sizes[index] = size
+            self.written += 1
+
+    def extend(self, timestamps, src_ips, dst_ips, src_ports, dst_ports, protocols, sizes):
+        """Agrega un lote en columnas con asignaciones por tramos del anillo"""
+        if not (all(src_ips) and all(dst_ips)):
+            # Solo se guardan las filas con ambas direcciones
+            keep = [i for i in range(len(timestamps)) if src_ips[i] and dst_ips[i]]
+            timestamps = [timestamps[i] for i in keep]
+            src_ips = [src_ips[i] for i in keep]
+            dst_ips = [dst_ips[i] for i in keep]
+            src_ports = [src_ports[i] for i in keep]
+            dst_ports = [dst_ports[i] for i in keep]
+            protocols = [protocols[i] for i in keep]
+            sizes = [sizes[i] for i in keep]
+        
+        # Del lote solo sobreviven las últimas `capacity` filas
+        skip = max(0, len(timestamps) - self.capacity)
+        count = len(timestamps) - skip
+        if count <= 0:
+            return
+        
+        pack = self._pack
+        src = b''.join(map(pack, src_ips[skip:]))
+        dst = b''.join(map(pack, dst_ips[skip:]))
+        # Otra captura puede estar escribiendo: la posición se toma con el lock
+        with self.lock:
+            self.written += skip
+            done = 0
+            while done < count:
+                index = (self.written + done) % self.capacity
+                n = min(count - done, self.capacity - index)
+                rows = slice(skip + done, skip + done + n)
+                self.timestamps[index:index + n] = array('d', timestamps[rows])
+                self.src_addrs[index * 16:(index + n) * 16] = src[done * 16:(done + n) * 16]
+                self.dst_addrs[index * 16:(index + n) * 16] = dst[done * 16:(done + n) * 16]
+                self.src_ports[index:index + n] = array('i', [-1 if p is None else p for p in src_ports[rows]])
+                self.dst_ports[index:index + n] = array('i', [-1 if p is None else p for p in dst_ports[rows]])
+                self.protocols[index:index + n] = bytes(map(PROTOCOL_CODES.__getitem__, protocols[rows]))
+                self.sizes[index:index + n] = array('I', sizes[rows])
+                done += n
+            self.written += count
+
+    def row(self, sequence):
+        """Arma el dict de la fila con número de secuencia `sequence`"""
+        index = sequence % self.capacity
+        offset = index * 16
+        src_port = self.src_ports[index]
+        dst_port = self.dst_ports[index]
+        return {
+            'timestamp': self.timestamps[index],
+            'src_ip': unpack_address(bytes(self.src_addrs[offset:offset + 16])),
+            'dst_ip': unpack_address(bytes(self.dst_addrs[offset:offset + 16])),
+            'src_port': None if src_port < 0 else src_port,
+            'dst_port': None if dst_port < 0 else dst_port,
+            'protocol': PROTOCOL_NAMES[self.protocols[index]],
+            'size': self.sizes[index]
+        }
+
+    def recent(self, limit):
+        """Devuelve las últimas `limit` filas (de la más vieja a la más nueva)"""
+        end = self.written
+        start = max(0, end - min(limit, self.capacity))
+        rows = [self.row(sequence) for sequence in range(start, end)]
+        # Descartar filas pisadas por el lector mientras se armaban los dicts
+        overwritten = self.written - self.capacity - start
+        return rows[overwritten:] if overwritten > 0 else rows
+
+    @staticmethod
+    def _index_pairs(first, sources, destinations, postings, missing):
+        """Agrega cada secuencia bajo su valor de origen y de destino (una vez si coinciden)"""
+        for sequence, source, destination in zip(itertools.count(first), sources, destinations):
+            if source != missing:
+                postings[source].append(sequence)
+            if destination != source and destination != missing:
+                postings[destination].append(sequence)
+
+    def catch_up(self):
+        """Incorpora a los índices las filas escritas desde la última puesta al día
+
+        Cada tramo de CATCH_UP_ROWS filas se indexa con el lock tomado y se
+        suelta entre tramos: las escrituras esperan como mucho un tramo.
+        """
+        with self.index_lock:
+            while True:
+                with self.lock:
+                    if not self._catch_up_chunk(self.CATCH_UP_ROWS):
+                        return
+
+    def _catch_up_chunk(self, rows):
+        """Indexa hasta `rows` filas pendientes (con self.lock); devuelve False si no quedaban"""
+        end = self.written
+        oldest = max(0, end - self.capacity)
+        first = max(self.indexed, oldest)
+        if first >= end:
+            return False
+        last = min(end, first + rows)
+        while first < last:
+            index = first % self.capacity
+            n = min(last - first, self.capacity - index)
+            codes = self.protocols[index:index + n]
+            sequences = range(first, first + n)
+            # Protocolo (pocos valores): compress en C, sin bucle por fila
+            for code in set(codes):
+                self.by_protocol[code].extend(itertools.compress(sequences, map(code.__eq__, codes)))
+            src = bytes(self.src_addrs[index * 16:(index + n) * 16])
+            dst = bytes(self.dst_addrs[index * 16:(index + n) * 16])
+            self._index_pairs(first, [src[i:i + 16] for i in range(0, n * 16, 16)],
+                              [dst[i:i + 16] for i in range(0, n * 16, 16)], self.by_ip, None)
+            self._index_pairs(first, self.src_ports[index:index + n],
+                              self.dst_ports[index:index + n], self.by_port, -1)
+            first += n
+        
+        if last // self.prune_every != self.indexed // self.prune_every and oldest:
+            for postings in (self.by_protocol, self.by_ip, self.by_port):
+                for key, sequences in list(postings.items()):
+                    stale = bisect.bisect_left(sequences, oldest)
+                    if stale == len(sequences):
+                        del postings[key]
+                    elif stale:
+                        del sequences[:stale]
+        self.indexed = last
+        return True
+
+    def _sequence_after(self, timestamp, oldest):
+        """Primera secuencia con timestamp > `timestamp` (búsqueda binaria en el anillo)
+
+        El historial se escribe en orden de llegada, así que los timestamps
+        son prácticamente crecientes con la secuencia.
+        """
+        low, high = oldest, self.written
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[middle % self.capacity] > timestamp:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def query(self, limit=50, protocol=None, ip=None, port=None, start=None, end=None):
+        """Devuelve las `limit` filas más nuevas que cumplen todos los filtros
+
+        Se recorre de la más nueva hacia atrás la lista de secuencias más
+        corta entre los índices pedidos (o el anillo si no hay filtros), y
+        el resto de los filtros se verifica sobre la fila; el costo es
+        proporcional a las filas recorridas, no al tamaño del historial.
+        """
+        code = PROTOCOL_CODES[protocol] if protocol else None
+        packed = self._pack(ip) if ip else None
+        if code is not None or packed is not None or port is not None:
+            self.catch_up()
+        with self.lock:
+            candidates = []
+            if code is not None:
+                candidates.append(self.by_protocol)
+            if packed is not None:
+                candidates.append(self.by_ip)
+            if port is not None:
+                candidates.append(self.by_port)
+            if candidates:
+                # Las filas escritas después de la puesta al día no están indexadas: se corta ahí
+                candidates = [postings.get(key, ()) for postings, key in
+                              zip(candidates, [value for value in (code, packed, port) if value is not None])]
+                high = self.indexed
+            else:
+                high = self.written
+            oldest = max(0, self.written - self.capacity)
+            if end is not None:
+                high = min(high, self._sequence_after(end, oldest))
+            if candidates:
+                postings = min(candidates, key=len)
+                position = bisect.bisect_left(postings, high)
+                sequences = (postings[i] for i in range(position - 1, -1, -1))
+            else:
+                sequences = range(high - 1, oldest - 1, -1)
+            
+            rows = []
+            for sequence in sequences:
+                if sequence < oldest or len(rows) >= limit:
+                    break
+                index = sequence % self.capacity
+                if start is not None and self.timestamps[index] < start:
+                    break
+                if code is not None and self.protocols[index] != code:
+                    continue
+                if packed is not None:
+                    offset = index * 16
+                    if (self.src_addrs[offset:offset + 16] != packed
+                            and self.dst_addrs[offset:offset + 16] != packed):
+                        continue
+                if port is not None and port != self.src_ports[index] and port != self.dst_ports[index]:
+                    continue
+                rows.append(self.row(sequence))
+        rows.reverse()
+        return rows
+
+    def memory_bytes(self):
+        """Memoria ocupada por las columnas y los índices"""
+        with self.lock:
+            postings = sum(len(sequences) for index in (self.by_protocol, self.by_ip, self.by_port)
+                           for sequences in index.values())
+        return self.capacity * self.ROW_BYTES + postings * 8
+
+
+def aggregate_flows(timestamps, src_ips, dst_ips, src_ports, dst_ports, protocols, sizes):
+    """Agrupa un lote por 5-tupla: clave -> [primer ts, último ts, paquetes, bytes]"""
+    keys = list(zip(src_ips, dst_ips, src_ports, dst_ports, protocols))
+    packets = Counter(keys)
+    # dict(zip(...)) se queda con la última aparición de cada clave
+    last_seen = dict(zip(keys, timestamps))
+    first_seen = dict(zip(reversed(keys), reversed(timestamps)))
+    total = dict.fromkeys(packets, 0)
+    for key, size in zip(keys, sizes):
+        total[key] += size
+    return {
+        key: [first_seen[key], last_seen[key], count, total[key]]
+        for key, count in packets.items() if key[0] and key[1]
+    }
+
+
+def aggregate_talkers(src_ips, dst_ips, src_ports, dst_ports, protocols, sizes):
+    """Agrupa un lote en bytes por host, por puerto y por protocolo"""
+    hosts = defaultdict(int)
+    ports = defaultdict(int)
+    for src_ip, dst_ip, src_port, dst_port, size in zip(src_ips, dst_ips, src_ports, dst_ports, sizes):
+        hosts[src_ip] += size
+        hosts[dst_ip] += size
+        ports[src_port] += size
+        ports[dst_port] += size
+    hosts.pop('', None)
+    ports.pop(None, None)
+    protocol_bytes = defaultdict(int)
+    for protocol, size in zip(protocols, sizes):
+        protocol_bytes[protocol] += size
+    return hosts, ports, protocol_bytes
+
+
+class Flow:
+    """Contadores de una conversación; src/dst corresponden a quien la inició"""
+
+    __slots__ = ('first_seen', 'last_seen', 'packets', 'bytes', 'reverse_packets', 'reverse_bytes')
+
+    def __init__(self, timestamp):
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.packets = 0
+        self.bytes = 0
+        self.reverse_packets = 0
+        self.reverse_bytes = 0
+
+
+class FlowTable:
+    """Tabla de flujos por 5-tupla con expiración por inactividad y desalojo LRU
+
+    El OrderedDict se mantiene en orden de última actividad: el primer
+    elemento es siempre el flujo menos reciente.
+    """
+
+    SORT_KEYS = {
+        'bytes': lambda item: item[1].bytes + item[1].reverse_bytes,
+        'packets': lambda item: item[1].packets + item[1].reverse_packets,
+        'last_seen': lambda item: item[1].last_seen,
+        'first_seen': lambda item: item[1].first_seen,
+        'duration': lambda item: item[1].last_seen - item[1].first_seen
+    }
+    # Flow + tupla de la clave + nodo del OrderedDict (aprox.)
+    ENTRY_BYTES = sys.getsizeof(Flow(0)) + sys.getsizeof((None,) * 5) + 56
+
+    def __init__(self, max_flows=65536, idle_timeout=120):
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.flows = OrderedDict()
+        # Lectores, merger de workers y thread de estadísticas tocan la tabla a la vez
+        self.lock = threading.Lock()
+        self.evicted = 0   # Desalojados por tamaño (LRU)
+        self.expired = 0   # Desalojados por inactividad
+
+    def __len__(self):
+        return len(self.flows)
+
+    def memory_bytes(self):
+        """Memoria aproximada de la tabla (las IPs se comparten con el resto del monitor)"""
+        return sys.getsizeof(self.flows) + len(self.flows) * self.ENTRY_BYTES
+
+    def update(self, timestamp, src_ip, dst_ip, src_port, dst_port, protocol, size):
+        """Suma un paquete a su flujo (en cualquiera de los dos sentidos)"""
+        with self.lock:
+            self._add((src_ip, dst_ip, src_port, dst_port, protocol), timestamp, timestamp, 1, size)
+
+    def update_batch(self, timestamps, src_ips, dst_ips, src_ports, dst_ports, protocols, sizes):
+        """Suma un lote agregando primero por 5-tupla dentro del lote"""
+        self.merge(aggregate_flows(timestamps, src_ips, dst_ips, src_ports, dst_ports, protocols, sizes))
+
+    def merge(self, aggregated):
+        """Suma flujos ya agregados (clave -> [primer ts, último ts, paquetes, bytes])"""
+        add = self._add
+        with self.lock:
+            for key, (first_seen, last_seen, packets, size) in aggregated.items():
+                add(key, first_seen, last_seen, packets, size)
+
+    def _add(self, key, first_seen, last_seen, packets, size):
+        flows = self.flows
+        flow = flows.get(key)
+        if flow is not None:
+            flow.packets += packets
+            flow.bytes += size
+        else:
+            src_ip, dst_ip, src_port, dst_port, protocol = key
+            reverse = (dst_ip, src_ip, dst_port, src_port, protocol)
+            flow = flows.get(reverse)
+            if flow is not None:
+                key = reverse
+                flow.reverse_packets += packets
+                flow.reverse_bytes += size
+            else:
+                if len(flows) >= self.max_flows:
+                    flows.popitem(last=False)
+                    self.evicted += 1
+                flow = flows[key] = Flow(first_seen)
+                flow.packets = packets
+                flow.bytes = size
+        if last_seen > flow.last_seen:
+            flow.last_seen = last_seen
+        flows.move_to_end(key)
+
+    def expire(self, now):
+        """Elimina los flujos sin actividad en los últimos idle_timeout segundos"""
+        flows = self.flows
+        limit = now - self.idle_timeout
+        with self.lock:
+            while flows:
+                key = next(iter(flows))
+                if flows[key].last_seen >= limit:
+                    break
+                del flows[key]
+                self.expired += 1
+
+    def query(self, sort='bytes', descending=True, limit=50, offset=0, protocol=None):
+        """Devuelve (flujos ordenados de la página pedida, total de flujos filtrados)"""
+        key = self.SORT_KEYS.get(sort, self.SORT_KEYS['bytes'])
+        with self.lock:
+            items = list(self.flows.items())
+        if protocol:
+            items = [item for item in items if item[0][4] == protocol]
+        select = heapq.nlargest if descending else heapq.nsmallest
+        page = select(offset + limit, items, key=key)[offset:]
+        return [self._as_dict(flow_key, flow) for flow_key, flow in page], len(items)
+
+    def _as_dict(self, key, flow):
+        src_ip, dst_ip, src_port, dst_port, protocol = key
+        return {
+            'src_ip': src_ip,
+            'dst_ip': dst_ip,
+            'src_port': src_port,
+            'dst_port': dst_port,
+            'protocol': protocol,
+            'first_seen': flow.first_seen,
+            'last_seen': flow.last_seen,
+            'duration': flow.last_seen - flow.first_seen,
+            'packets': flow.packets + flow.reverse_packets,
+            'bytes': flow.bytes + flow.reverse_bytes,
+            'packets_sent': flow.packets,
+            'bytes_sent': flow.bytes,
+            'packets_received': flow.reverse_packets,
+            'bytes_received': flow.reverse_bytes,
+            'direction': 'bidirectional' if flow.reverse_packets else 'unidirectional'
+        }
+
+
+class SpaceSaving:
+    """Top-k aproximado (Space-Saving ponderado) con memoria fija
+
+    Guarda como máximo `capacity` claves; al llegar una nueva con la tabla
+    llena reemplaza a la de menor peso y hereda ese peso como error máximo.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.counts = {}  # clave -> [peso estimado, error]
+        self.heap = []    # (peso, clave), puede tener pesos desactualizados
+
+    def memory_bytes(self):
+        # Cada clave: lista [peso, error] y su tupla en el heap
+        return sys.getsizeof(self.counts) + sys.getsizeof(self.heap) + len(self.counts) * 128
+
+    def add(self, item, weight):
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = [weight, 0]
+            heapq.heappush(self.heap, (weight, item))
+            return
+        
+        # Buscar el mínimo real: las entradas viejas del heap se refrescan
+        heap = self.heap
+        while True:
+            count, victim = heap[0]
+            current = self.counts[victim][0]
+            if current == count:
+                break
+            heapq.heapreplace(heap, (current, victim))
+        heapq.heapreplace(heap, (count + weight, item))
+        del self.counts[victim]
+        self.counts[item] = [count + weight, count]
+
+
+class TopTalkers:
+    """Hosts, puertos y protocolos con más bytes en una ventana deslizante
+
+    La ventana se divide en `slices` tramos con su propio Space-Saving; al
+    avanzar el tiempo se descarta el tramo más viejo. Consultar cuesta
+    O(slices * capacity), sin importar el volumen de tráfico.
+    """
+
+    DIMENSIONS = ('hosts', 'ports', 'protocols')
+
+    def __init__(self, window=60, slices=6, capacity=256):
+        self.window = window
+        self.slices = slices
+        self.capacity = capacity
+        self.slice_seconds = window / slices
+        self.current = None
+        self.ring = [self._empty_slice() for _ in range(slices)]
+        # Cada interfaz suma desde su thread: dos reemplazos simultáneos en un
+        # Space-Saving dejarían en el heap claves que ya no están en la tabla
+        self.lock = threading.Lock()
+
+    def _empty_slice(self):
+        return {
+            'hosts': SpaceSaving(self.capacity),
+            'ports': SpaceSaving(self.capacity),
+            'protocols': defaultdict(int)  # pocos valores: conteo exacto
+        }
+
+    def _slice_for(self, timestamp):
+        """Devuelve el tramo del timestamp, rotando los tramos vencidos"""
+        number = int(timestamp // self.slice_seconds)
+        if self.current is None:
+            self.current = number
+        elif number > self.current:
+            # Limpiar los tramos que quedaron fuera de la ventana
+            for stale in range(max(self.current + 1, number - self.slices + 1), number + 1):
+                self.ring[stale % self.slices] = self._empty_slice()
+            self.current = number
+        elif number <= self.current - self.slices:
+            return None  # Más viejo que la ventana
+        return self.ring[number % self.slices]
+
+    def memory_bytes(self):
+        """Memoria aproximada de los tramos de la ventana"""
+        return sum(current['hosts'].memory_bytes() + current['ports'].memory_bytes()
+                   + sys.getsizeof(current['protocols']) for current in list(self.ring))
+
+    def add(self, timestamp, src_ip, dst_ip, src_port, dst_port, protocol, size):
+        with self.lock:
+            current = self._slice_for(timestamp)
+            if current is None:
+                return
+            if src_ip:
+                current['hosts'].add(src_ip, size)
+            if dst_ip:
+                current['hosts'].add(dst_ip, size)
+            if src_port is not None:
+                current['ports'].add(src_port, size)
+            if dst_port is not None:
+                current['ports'].add(dst_port, size)
+            current['protocols'][protocol] += size
+
+    def add_batch(self, timestamps, src_ips, dst_ips, src_ports, dst_ports, protocols, sizes):
+        """Suma un lote al tramo de su último timestamp, agregando por clave"""
+        self.add_totals(max(timestamps), *aggregate_talkers(
+            src_ips, dst_ips, src_ports, dst_ports, protocols, sizes))
+
+    def add_totals(self, timestamp, hosts, ports, protocols):
+        """Suma bytes ya agregados por host, puerto y protocolo"""
+        with self.lock:
+            current = self._slice_for(timestamp)
+            if current is None:
+                return
+            for host, total in hosts.items():
+                current['hosts'].add(host, total)
+            for port, total in ports.items():
+                current['ports'].add(port, total)
+            totals = current['protocols']
+            for protocol, total in protocols.items():
+                totals[protocol] += total
+
+    def top(self, dimension, limit=20, now=None):
+        """Devuelve las `limit` claves con más bytes en la ventana"""
+        merged = defaultdict(lambda: [0, 0])
+        newest = self.current if now is None else int(now // self.slice_seconds)
+        if newest is None:
+            return []
+        for number in range(newest - self.slices + 1, newest + 1):
+            if self.current is None or number > self.current or number <= self.current - self.slices:
+                continue
+            data = self.ring[number % self.slices][dimension]
+            if dimension == 'protocols':
+                for key, total in list(data.items()):
+                    merged[key][0] += total
+            else:
+                for key, (total, error) in list(data.counts.items()):
+                    entry = merged[key]
+                    entry[0] += total
+                    entry[1] += error
+        best = heapq.nlargest(limit, merged.items(), key=lambda item: item[1][0])
+        return [{'key': key, 'bytes': total, 'error': error} for key, (total, error) in best]
+
+
+class ProtocolHierarchy:
+    """Jerarquía de protocolos con contadores por segundo en cada nodo
+
+    Cada nodo es un prefijo de frame.protocols (eth, eth:ethertype:ip,
+    eth:ethertype:ip:tcp:tls, ...); un paquete suma en todos los nodos de
+    su pila, igual que Statistics > Protocol Hierarchy de Wireshark.
+    """
+
+    def __init__(self, max_nodes=1024):
+        self.max_nodes = max_nodes
+        self.nodes = {}  # Ruta -> RateBuckets
+        self.overflow = 0  # Paquetes de nodos que no entraron en la tabla
+        self.lock = threading.Lock()  # Varias capturas crean nodos a la vez
+
+    def _node(self, path):
+        rates = self.nodes.get(path)
+        if rates is None:
+            if len(self.nodes) >= self.max_nodes:
+                return None
+            rates = self.nodes[path] = RateBuckets(60)
+        return rates
+
+    def memory_bytes(self):
+        """Memoria aproximada de los contadores de todos los nodos"""
+        return sys.getsizeof(self.nodes) + sum(
+            sys.getsizeof(rates.seconds) + sys.getsizeof(rates.packets) + sys.getsizeof(rates.bytes)
+            for rates in list(self.nodes.values()))
+
+    def add(self, timestamp, stack, size, packets=1):
+        """Suma paquetes de una misma pila en todos los nodos de su jerarquía"""
+        with self.lock:
+            for path in protocol_stack(stack).paths:
+                rates = self._node(path)
+                if rates is None:
+                    self.overflow += packets
+                    continue
+                rates.add(timestamp, size, packets)
+
+    def add_batch(self, timestamps, stacks, sizes, weight=1):
+        """Suma un lote agregando primero por pila (una entrada por pila distinta)"""
+        totals = aggregate_stacks(stacks, sizes)
+        if weight != 1:
+            totals = {stack: [packets * weight, size * weight] for stack, (packets, size) in totals.items()}
+        self.add_totals(max(timestamps), totals)
+
+    def add_totals(self, timestamp, totals):
+        """Suma totales ya agregados (pila -> [paquetes, bytes])"""
+        for stack, (packets, size) in totals.items():
+            self.add(timestamp, stack, size, packets)
+
+    def query(self, now, window=10):
+        """Nodos de la jerarquía ordenados por ruta, con totales y tasas"""
+        nodes = sorted(list(self.nodes.items()))
+        roots = sum(rates.total_bytes for path, rates in nodes if ':' not in path) or 1
+        result = []
+        for path, rates in nodes:
+            packets_per_sec, bytes_per_sec = rates.rate(window, now)
+            result.append({
+                'path': path,
+                'protocol': path.rsplit(':', 1)[-1],
+                'depth': path.count(':'),
+                'packets': rates.total_packets,
+                'bytes': rates.total_bytes,
+                'percent_bytes': round(100.0 * rates.total_bytes / roots, 2),
+                'packets_per_second': round(packets_per_sec, 2),
+                'bytes_per_second': round(bytes_per_sec, 2)
+            })
+        return result
+
+
+def aggregate_stacks(stacks, sizes):
+    """Agrupa un lote por pila de protocolos: pila -> [paquetes, bytes]"""
+    totals = {stack: [count, 0] for stack, count in Counter(stacks).items()}
+    for stack, size in zip(stacks, sizes):
+        totals[stack][1] += size
+    return totals
+
+
+class HistoryStore:
+    """Historial de tráfico en varias resoluciones sobre un archivo mmap de tamaño fijo
+
+    Cada resolución es un anillo de registros (inicio, paquetes, bytes,
+    upload, download): 1 s durante una hora, 1 min durante un día y 1 h
+    durante un mes. El slot de un instante es (inicio // paso) % slots y el
+    inicio guardado permite descartar registros viejos, como en RateBuckets.
+    Las consultas leen solo los registros del rango pedido.
+    """
+
+    MAGIC = b'WSHIST01'
+    TIERS = ((1, 3600), (60, 1440), (3600, 720))  # (segundos por registro, registros)
+    RECORD = struct.Struct('<qQQQQ')
+    HEADER = struct.Struct('<8s6I')
+    FIELDS = ('packets', 'bytes', 'upload_bytes', 'download_bytes')
+
+    def __init__(self, path):
+        self.path = path
+        self.mmap = None
+        self.offsets = []
+        offset = self.HEADER.size
+        for step, slots in self.TIERS:
+            self.offsets.append(offset)
+            offset += slots * self.RECORD.size
+        self.size = offset
+        self.last_second = None  # Último segundo volcado al archivo
+
+    def _open(self):
+        """Abre (o crea) el archivo la primera vez que se usa"""
+        if self.mmap is not None:
+            return self.mmap
+        header = self.HEADER.pack(self.MAGIC, *(value for tier in self.TIERS for value in tier))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a+b') as handle:
+            handle.seek(0)
+            valid = handle.read(self.HEADER.size) == header and os.path.getsize(self.path) == self.size
+            if not valid:
+                # Archivo nuevo o con otro formato: se reinicia en cero
+                handle.truncate(0)
+                handle.truncate(self.size)
+            self.mmap = mmap.mmap(handle.fileno(), self.size)
+        if not valid:
+            self.mmap[:self.HEADER.size] = header
+        return self.mmap
+
+    def _slot(self, tier, start):
+        step, slots = self.TIERS[tier]
+        return self.offsets[tier] + (start // step % slots) * self.RECORD.size
+
+    def record(self, second, packets, size, upload=0, download=0):
+        """Suma un segundo completo en las tres resoluciones"""
+        data = self._open()
+        for tier, (step, slots) in enumerate(self.TIERS):
+            start = second - second % step
+            offset = self._slot(tier, start)
+            stored = self.RECORD.unpack_from(data, offset)
+            if stored[0] == start and tier:
+                packets_, size_, upload_, download_ = stored[1:]
+                values = (packets + packets_, size + size_, upload + upload_, download + download_)
+            else:
+                values = (packets, size, upload, download)
+            self.RECORD.pack_into(data, offset, start, *values)
+
+    def flush_rates(self, now, rates, upload_rates, download_rates, delay=2):
+        """Vuelca los segundos ya cerrados de los RateBuckets (dejando `delay` de margen)"""
+        last = int(now) - delay
+        first = last - rates.slots + 1 if self.last_second is None else self.last_second + 1
+        first = max(first, last - rates.slots + 1)
+        for second in range(first, last + 1):
+            packets, size = rates.window(1, second)
+            if packets:
+                self.record(second, packets, size,
+                            upload_rates.window(1, second)[1], download_rates.window(1, second)[1])
+        self.last_second = max(last, self.last_second or last)
+
+    def query(self, start, end, step=None, max_points=10000):
+        """Devuelve (paso, puntos) del rango [start, end) desde la resolución más fina que lo cubra
+
+        Sin `step` se usa el paso de esa resolución; con `step` se agrupan
+        los registros en intervalos de ese tamaño (múltiplo del paso base).
+        """
+        data = self._open()
+        now = int(time.time())
+        start = int(start)
+        end = min(int(end), now + 1)
+        covering = [index for index, (tier_step, slots) in enumerate(self.TIERS)
+                    if start >= now - tier_step * slots] or [len(self.TIERS) - 1]
+        # Con step se usa la resolución más gruesa que no supere ese paso (menos lecturas)
+        fitting = [index for index in covering if step is not None and self.TIERS[index][0] <= step]
+        tier = fitting[-1] if fitting else covering[0]
+        tier_step = self.TIERS[tier][0]
+        step = max(tier_step, int(step or tier_step) // tier_step * tier_step)
+        start -= start % step
+        if (end - start) // step > max_points:
+            raise ValueError(f'El rango pide más de {max_points} puntos')
+        
+        points = []
+        unpack = self.RECORD.unpack_from
+        for bucket in range(start, end, step):
+            values = [0, 0, 0, 0]
+            for record_start in range(bucket, bucket + step, tier_step):
+                stored = unpack(data, self._slot(tier, record_start))
+                if stored[0] == record_start:
+                    for index in range(4):
+                        values[index] += stored[index + 1]
+            point = dict(zip(self.FIELDS, values))
+            point['timestamp'] = bucket
+            points.append(point)
+        return step, points
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+
+class PcapRingFile:
+    """Un archivo del anillo con su índice segundo -> offset del primer paquete"""
+
+    def __init__(self, path, linktype):
+        self.path = path
+        self.linktype = linktype
+        self.seconds = array('q')
+        self.offsets = array('q')
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.size = 0
+
+
+class PcapRing:
+    """Escribe los paquetes crudos en un anillo de archivos pcap con índice por tiempo
+
+    Cada archivo guarda una entrada (segundo, offset) por cada segundo nuevo,
+    así /api/extract salta con bisect al primer registro del rango y solo lee
+    esa región. Al llenarse un archivo se abre otro y se borra el más viejo.
+    """
+
+    GLOBAL_HEADER = struct.Struct('<IHHiIII')
+    RECORD_HEADER = struct.Struct('<IIII')
+
+    def __init__(self, directory, max_files=10, max_file_bytes=64 << 20, snaplen=262144):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.snaplen = snaplen
+        self.files = deque()
+        self.handle = None
+        self.sequence = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self, linktype):
+        """Cierra el archivo actual y abre uno nuevo (borrando el más viejo si sobra)"""
+        if self.handle:
+            self.handle.close()
+        self.sequence += 1
+        path = os.path.join(self.directory, f'ring_{int(time.time())}_{self.sequence:05d}.pcap')
+        self.handle = open(path, 'wb')
+        self.handle.write(self.GLOBAL_HEADER.pack(0xA1B2C3D4, 2, 4, 0, 0, self.snaplen, linktype))
+        current = PcapRingFile(path, linktype)
+        current.size = self.GLOBAL_HEADER.size
+        self.files.append(current)
+        while len(self.files) > self.max_files:
+            oldest = self.files.popleft()
+            try:
+                os.remove(oldest.path)
+            except OSError:
+                pass
+        return current
+
+    def write(self, timestamp, original_length, linktype, data):
+        """Agrega un paquete al archivo actual (rota por tamaño o por cambio de linktype)"""
+        with self.lock:
+            current = self.files[-1] if self.files and self.handle else None
+            if current is None or current.linktype != linktype or current.size >= self.max_file_bytes:
+                current = self._rotate(linktype)
+            
+            second = int(timestamp)
+            if not current.seconds or second > current.seconds[-1]:
+                current.seconds.append(second)
+                current.offsets.append(current.size)
+            if current.first_timestamp is None:
+                current.first_timestamp = timestamp
+            current.last_timestamp = timestamp
+            
+            microseconds = min(999999, int(round((timestamp - second) * 1e6)))
+            self.handle.write(self.RECORD_HEADER.pack(second, microseconds, len(data), original_length))
+            self.handle.write(data)
+            current.size += self.RECORD_HEADER.size + len(data)
+
+    def extract(self, start, end, output):
+        """Escribe en `output` un pcap con los paquetes de [start, end]; devuelve cuántos
+
+        Solo se leen los archivos que se solapan con el rango y, dentro de
+        cada uno, desde el offset del índice para el segundo `start`.
+        """
+        with self.lock:
+            if self.handle:
+                self.handle.flush()
+            files = [
+                (ring_file.path, ring_file.linktype, ring_file.seconds[:], ring_file.offsets[:], ring_file.size)
+                for ring_file in self.files
+                if ring_file.first_timestamp is not None
+                and ring_file.first_timestamp <= end and ring_file.last_timestamp >= start
+            ]
+        if not files:
+            return 0
+        
+        linktype = files[0][1]
+        output.write(self.GLOBAL_HEADER.pack(0xA1B2C3D4, 2, 4, 0, 0, self.snaplen, linktype))
+        packets = 0
+        record_size = self.RECORD_HEADER.size
+        for path, file_linktype, seconds, offsets, size in files:
+            if file_linktype != linktype:
+                # Un pcap clásico tiene un solo linktype: se omiten los archivos distintos
+                continue
+            index = max(0, bisect.bisect_right(seconds, int(start)) - 1)
+            try:
+                with open(path, 'rb') as handle:
+                    handle.seek(offsets[index])
+                    position = offsets[index]
+                    while position + record_size <= size:
+                        header = handle.read(record_size)
+                        ts_sec, ts_usec, captured, _ = self.RECORD_HEADER.unpack(header)
+                        timestamp = ts_sec + ts_usec / 1e6
+                        if timestamp > end + 1:
+                            break
+                        data = handle.read(captured)
+                        position += record_size + captured
+                        if start <= timestamp <= end:
+                            output.write(header)
+                            output.write(data)
+                            packets += 1
+            except OSError:
+                # El archivo rotó mientras se leía
+                continue
+        return packets
+
+    def close(self):
+        with self.lock:
+            if self.handle:
+                self.handle.close()
+                self.handle = None
+
+
+# Resultado parcial que un worker envía al proceso de la API en cada flush
+ShardResult = namedtuple('ShardResult', [
+    'shard', 'packets', 'rejected', 'second_packets', 'second_bytes',
+    'flows', 'hosts', 'ports', 'protocols', 'tail', 'last_timestamp', 'upload', 'download', 'stacks'
+])
+
+
+class ShardPartial:
+    """Agregados parciales de un worker entre dos envíos al proceso de la API"""
+
+    def __init__(self, tail_rows=2000, directions=None):
+        self.tail_rows = tail_rows
+        self.directions = directions  # LocalAddressIndex heredado del proceso de la API
+        self.reset()
+
+    def reset(self):
+        self.packets = 0
+        self.rejected = 0
+        self.second_packets = Counter()
+        self.second_bytes = defaultdict(int)
+        self.flows = {}
+        self.hosts = defaultdict(int)
+        self.ports = defaultdict(int)
+        self.protocols = defaultdict(int)
+        self.tail = []  # Últimas filas, para el historial de conexiones
+        self.last_timestamp = None
+        self.upload = {}  # Segundo -> [paquetes, bytes]
+        self.download = {}
+        self.stacks = {}  # Pila de protocolos -> [paquetes, bytes]
+
+    def add(self, batch):
+        """Agrega un PacketBatch a los parciales"""
+        timestamps = batch.timestamps
+        sizes = batch.sizes
+        columns = (batch.src_ips, batch.dst_ips, batch.src_ports, batch.dst_ports, batch.protocols)
+        self.packets += len(timestamps)
+        
+        seconds = list(map(int, timestamps))
+        self.second_packets.update(seconds)
+        second_bytes = self.second_bytes
+        for second, size in zip(seconds, sizes):
+            second_bytes[second] += size
+        
+        flows = self.flows
+        for key, (first_seen, last_seen, packets, size) in aggregate_flows(timestamps, *columns, sizes).items():
+            entry = flows.get(key)
+            if entry is None:
+                flows[key] = [first_seen, last_seen, packets, size]
+            else:
+                entry[1] = max(entry[1], last_seen)
+                entry[2] += packets
+                entry[3] += size
+        
+        for total, partial in zip(aggregate_talkers(*columns, sizes), (self.hosts, self.ports, self.protocols)):
+            for key, size in total.items():
+                partial[key] += size
+        
+        if self.directions is not None:
+            for totals, (direction_timestamps, direction_sizes) in zip(
+                    (self.upload, self.download),
+                    self.directions.split(timestamps, batch.src_ips, batch.dst_ips, sizes)):
+                for timestamp, size in zip(direction_timestamps, direction_sizes):
+                    entry = totals.setdefault(int(timestamp), [0, 0])
+                    entry[0] += 1
+                    entry[1] += size
+        
+        for stack, (packets, size) in aggregate_stacks(batch.stacks, sizes).items():
+            entry = self.stacks.setdefault(stack, [0, 0])
+            entry[0] += packets
+            entry[1] += size
+        
+        start = max(0, len(timestamps) - self.tail_rows)
+        self.tail.extend(zip(timestamps[start:], *(column[start:] for column in columns), sizes[start:]))
+        del self.tail[:-self.tail_rows]
+        self.last_timestamp = max(timestamps) if self.last_timestamp is None else max(self.last_timestamp, max(timestamps))
+
+    def drain(self, shard):
+        """Devuelve los parciales acumulados (picklables) y vuelve a empezar"""
+        result = ShardResult(
+            shard, self.packets, self.rejected, dict(self.second_packets), dict(self.second_bytes),
+            self.flows, dict(self.hosts), dict(self.ports), dict(self.protocols),
+            self.tail, self.last_timestamp, self.upload, self.download, self.stacks
+        )
+        self.reset()
+        return result
+
+
+def _shard_worker(shard, inbox, outbox, flush_interval, directions=None):
+    """Proceso worker: parsea los bloques de su shard y envía parciales periódicos"""
+    partial = ShardPartial(directions=directions)
+    last_flush = time.monotonic()
+    while True:
+        try:
+            block = inbox.get(timeout=flush_interval)
+        except queue.Empty:
+            block = b''
+        if block is None:
+            break
+        if block:
+            try:
+                batch, rejected = parse_fields_batch(block)
+                partial.rejected += rejected
+                if batch is not None:
+                    partial.add(batch)
+            except Exception as e:
+                # Un bloque que no se puede parsear se rechaza entero; el worker sigue
+                partial.rejected += _count_lines(block)
+                print(f"❌ Worker {shard}: error parseando un bloque: {e}")
+        if partial.packets and time.monotonic() - last_flush >= flush_interval:
+            outbox.put(partial.drain(shard))
+            last_flush = time.monotonic()
+    outbox.put(partial.drain(shard))
+    outbox.put(None)  # Fin del worker
+
+
+class ShardedPipeline:
+    """Pool de procesos que parsean y agregan el flujo de campos repartido por hash
+
+    Las líneas se reparten por hash simétrico del par de IPs (crc32(src) ^
+    crc32(dst)), así los dos sentidos de un flujo caen en el mismo worker y
+    sus parciales no se solapan al combinarse en el proceso de la API.
+    """
+
+    def __init__(self, workers, flush_interval=0.5, queue_size=64, directions=None):
+        # fork evita reimportar el módulo (y relanzar el monitor) en cada worker
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        self.workers = workers
+        self.outbox = context.Queue()
+        self.inboxes = [context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processes = [
+            context.Process(target=_shard_worker, args=(shard, inbox, self.outbox, flush_interval, directions),
+                            daemon=True)
+            for shard, inbox in enumerate(self.inboxes)
+        ]
+        self.stopped = False
+        self.dead = set()  # Shards cuyo worker terminó antes de tiempo
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def dispatch(self, block):
+        """Reparte un bloque de líneas completas entre los workers
+
+        Devuelve las líneas descartadas porque el worker de su shard murió.
+        """
+        if self.workers == 1:
+            return self._put(0, block)
+        flat = block.replace(b'\n', b'|').split(b'|')
+        lines = block.split(b'\n')
+        if len(flat) != FIELDS_PER_LINE * len(lines):
+            # Líneas irregulares: las resuelve (y rechaza) el primer worker
+            return self._put(0, block)
+        
+        # Shard de cada línea calculado todo en C (map sobre las columnas de IPs)
+        hashes = map(operator.xor, map(zlib.crc32, flat[2::FIELDS_PER_LINE]),
+                     map(zlib.crc32, flat[3::FIELDS_PER_LINE]))
+        shards = list(map(operator.mod, hashes, itertools.repeat(self.workers)))
+        lost = 0
+        for shard in range(self.workers):
+            selected = list(itertools.compress(lines, map(operator.eq, shards, itertools.repeat(shard))))
+            if selected:
+                lost += self._put(shard, b'\n'.join(selected))
+        return lost
+
+    def _put(self, shard, block, timeout=1):
+        """Encola en el inbox del shard; si el worker murió descarta y devuelve las líneas"""
+        process = self.processes[shard]
+        while process.is_alive():
+            try:
+                self.inboxes[shard].put(block, timeout=timeout)
+                return 0
+            except queue.Full:
+                continue
+        if shard not in self.dead:
+            self.dead.add(shard)
+            print(f"❌ El worker {shard} terminó (código {process.exitcode}): se descartan sus líneas")
+        return _count_lines(block) if block else 0
+
+    def results(self, timeout=1):
+        """Itera los parciales hasta que terminan todos los workers
+
+        Un worker que muere no manda su fin: cuando ya no queda ninguno vivo
+        y la cola está vacía no llega nada más.
+        """
+        finished = 0
+        while finished < self.workers:
+            try:
+                result = self.outbox.get(timeout=timeout)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    print(f"⚠️ {self.workers - finished} worker(s) terminaron sin enviar sus parciales")
+                    return
+                continue
+            if result is None:
+                finished += 1
+                continue
+            yield result
+
+    def stop(self):
+        """Pide a los workers que vacíen sus parciales y terminen"""
+        if self.stopped:
+            return
+        self.stopped = True
+        for shard in range(self.workers):
+            self._put(shard, None)
+
+
+def _escape_label(value):
+    """Escapa un valor de etiqueta (\\, \" y \n): los nombres de interfaz vienen del usuario"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    """Etiquetas en formato de exposición: {nombre="valor",...}"""
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape_label(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricCounter:
+    """Contador monótono con etiquetas, sin dependencias externas
+
+    labels() devuelve (y cachea) la celda de una combinación de etiquetas;
+    el código caliente se guarda esa celda y solo hace inc().
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield self.name + '_total', _format_labels(self.labelnames, values), child.value
+
+
+class MetricHistogram(MetricCounter):
+    """Histograma con buckets fijos (le = límite superior inclusivo)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), list(child.counts)):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, (('le', _format_value(float(bound))),))
+                yield self.name + '_bucket', labels, cumulative
+            labels = _format_labels(self.labelnames, values)
+            yield self.name + '_count', labels, cumulative
+            yield self.name + '_sum', labels, child.sum
+
+
+class MetricsRegistry:
+    """Métricas internas del monitor expuestas en /metrics (OpenMetrics o Prometheus)"""
+
+    def __init__(self, prefix='wireshark_monitor'):
+        self.prefix = prefix
+        self.metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = MetricCounter(f'{self.prefix}_{name}', help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets, labelnames=()):
+        metric = MetricHistogram(f'{self.prefix}_{name}', help_text, buckets, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, collected=(), openmetrics=True):
+        """Texto de exposición de /metrics
+
+        collected son familias calculadas al momento del scrape:
+        (nombre, 'counter' o 'gauge', ayuda, [(etiquetas, valor)]).
+        """
+        families = [(metric.name, metric.kind, metric.help, metric.samples()) for metric in self.metrics]
+        for name, kind, help_text, values in collected:
+            name = f'{self.prefix}_{name}'
+            sample = name + '_total' if kind == 'counter' else name
+            families.append((name, kind, help_text, [
+                (sample, _format_labels(labels.keys(), labels.values()), value) for labels, value in values
+            ]))
+        
+        lines = []
+        for name, kind, help_text, samples in families:
+            # Prometheus 0.0.4 declara los contadores con el sufijo _total; OpenMetrics sin él
+            family = name + '_total' if kind == 'counter' and not openmetrics else name
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            for sample, labels, value in samples:
+                lines.append(f'{sample}{labels} {_format_value(value)}')
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+# Buckets (segundos) de los histogramas de /metrics
+PARSE_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+TICK_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class HandoffQueue:
+    """Cola acotada entre el thread que lee el proceso de captura y el que agrega
+
+    Si el procesamiento se atrasa, `policy` decide qué pasa con lo que llega:
+    block espera (el atraso vuelve al pipe y termina en drops del kernel),
+    drop descarta lo nuevo con la cola llena (drop-newest) y sample, desde
+    la mitad de la cola, deja pasar 1 de cada sample_rate paquetes y con la
+    cola llena descarta. Cada paquete perdido queda contado.
+    """
+
+    POLICIES = ('block', 'drop', 'sample')
+
+    def __init__(self, maxsize=256, policy='block', sample_rate=10, totals=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f'Política de cola desconocida: {policy}')
+        self.queue = queue.Queue(maxsize)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.sample_rate = max(1, int(sample_rate))
+        self.totals = totals if totals is not None else Counter()  # Acumulados del monitor
+        self.enqueued = 0     # Paquetes entregados al procesamiento
+        self.dropped = 0      # Paquetes descartados con la cola llena
+        self.sampled_out = 0  # Paquetes salteados por el muestreo
+        self.peak = 0         # Mayor ocupación observada (items)
+        self.closed = False   # El consumidor dejó de leer
+        self._skipped = 0
+
+    def put(self, item, packets=1, thin=None):
+        """Entrega un item con `packets` paquetes; devuelve False si se descartó entero
+
+        thin(item, rate) -> (item, paquetes) reduce un bloque a 1 de cada
+        rate paquetes; sin thin, el muestreo deja pasar 1 de cada rate items.
+        """
+        pending = self.queue.qsize()
+        if pending > self.peak:
+            self.peak = pending
+        if self.policy == 'sample' and pending * 2 >= self.maxsize:
+            if thin is not None:
+                item, kept = thin(item, self.sample_rate)
+            else:
+                self._skipped += 1
+                kept = packets if self._skipped % self.sample_rate == 0 else 0
+            self.sampled_out += packets - kept
+            self.totals['sampled'] += packets - kept
+            if not kept:
+                return False
+            packets = kept
+        
+        if self.policy == 'block':
+            if not self._put_blocking(item):
+                return False
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += packets
+                self.totals['queue'] += packets
+                return False
+        self.enqueued += packets
+        return True
+
+    def _put_blocking(self, item):
+        """Espera lugar en la cola mientras el consumidor siga activo"""
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        """Marca el fin del flujo (lo llama el lector)"""
+        self._put_blocking(None)
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            # Si el consumidor corta antes, el lector no debe quedar esperando lugar
+            self.closed = True
+
+
+def _count_lines(block):
+    return block.count(b'\n') + 1
+
+
+def _thin_items(items, rate):
+    """Deja 1 de cada `rate` elementos de una lista (registros pcap)"""
+    kept = items[::rate]
+    return kept, len(kept)
+
+
+def _thin_lines(block, rate):
+    """Deja 1 de cada `rate` líneas de un bloque del formato de campos"""
+    lines = block.split(b'\n')[::rate]
+    return b'\n'.join(lines), len(lines)
+
+
+# Resumen de paquetes perdidos que tshark/dumpcap escriben en stderr al terminar
+_DROP_SUMMARY = re.compile(r"(\d+) packets? dropped|received/dropped on interface '[^']*': \d+/(\d+)")
+
+
+def interface_dropin(interface):
+    """Paquetes entrantes descartados por la interfaz según el sistema (None si no se sabe)"""
+    try:
+        if interface == 'any':
+            return psutil.net_io_counters().dropin
+        counters = psutil.net_io_counters(pernic=True).get(interface)
+    except Exception:
+        return None
+    return counters.dropin if counters else None
+
+
+class PacketSampler:
+    """Muestreo sistemático de 1 cada `rate` paquetes, fijo o adaptado al atraso del lector
+
+    Cada paquete muestreado pesa `rate` en los contadores (estimador de
+    Horvitz-Thompson con probabilidad 1/rate) y suma rate*(rate-1) por
+    paquete (y por byte al cuadrado) a la varianza del estimado. En modo
+    adaptive la tasa se duplica mientras el lector atrase más de high_lag
+    segundos y se divide a la mitad por debajo de low_lag (un cambio por
+    segundo como máximo).
+    """
+
+    MODES = ('off', 'fixed', 'adaptive')
+
+    def __init__(self, mode='off', rate=1, max_rate=1024, high_lag=1.0, low_lag=0.2, totals=None):
+        self.high_lag = high_lag
+        self.low_lag = low_lag
+        self.totals = totals if totals is not None else Counter()  # Acumulados del monitor
+        self.offset = 0  # Paquetes a saltear antes de la próxima muestra
+        self.last_change = 0
+        self.rate = 1
+        self.max_rate = 1
+        self.configure(mode, rate, max_rate)
+
+    def configure(self, mode, rate=None, max_rate=None):
+        """Cambia el modo en caliente (ValueError si no es válido)"""
+        if mode not in self.MODES:
+            raise ValueError(f'Modo de muestreo desconocido: {mode}')
+        if max_rate is not None:
+            self.max_rate = max(1, int(max_rate))
+        self.mode = mode
+        if mode == 'off':
+            self.rate = 1
+        elif rate is not None:
+            self.rate = max(1, min(int(rate), self.max_rate))
+        self.offset = min(self.offset, self.rate - 1)
+
+    def adapt(self, lag, now):
+        """Ajusta la tasa según el atraso del lector (solo en modo adaptive)"""
+        if self.mode != 'adaptive' or lag is None or now - self.last_change < 1:
+            return
+        if lag > self.high_lag and self.rate < self.max_rate:
+            self.rate = min(self.rate * 2, self.max_rate)
+        elif lag < self.low_lag and self.rate > 1:
+            self.rate //= 2
+            self.offset = min(self.offset, self.rate - 1)
+        else:
+            return
+        self.last_change = now
+        print(f"🎲 Muestreo adaptativo: 1 de cada {self.rate} paquetes (atraso {lag:.2f}s)")
+
+    def thin(self, items):
+        """Devuelve (muestra, peso) de una secuencia; el desfase sigue entre llamadas"""
+        rate = self.rate
+        if rate == 1:
+            return items, 1
+        kept = items[self.offset::rate]
+        self.offset = (self.offset - len(items)) % rate
+        return kept, rate
+
+    def take(self):
+        """Para paquetes de a uno: True cada `rate` llamadas"""
+        if self.offset:
+            self.offset -= 1
+            return False
+        self.offset = self.rate - 1
+        return True
+
+    def account(self, weight, sizes):
+        """Suma una muestra de peso `weight` a los estimados y a su varianza"""
+        if weight == 1:
+            return
+        totals = self.totals
+        factor = weight * (weight - 1)
+        totals['sampled'] += len(sizes)
+        totals['estimated'] += len(sizes) * weight
+        totals['variance_packets'] += factor * len(sizes)
+        totals['variance_bytes'] += factor * sum(size * size for size in sizes)
+
+
+class CaptureSession:
+    """Una captura en curso sobre una interfaz: proceso, backend y contadores propios"""
+
+    def __init__(self, interface, backend):
+        self.interface = interface
+        self.backend = backend
+        self.process = None
+        self.running = True
+        self.start_time = time.time()
+        self.rates = RateBuckets(60)
+        self.pipeline = None  # ShardedPipeline cuando se parsea con varios procesos
+        self.ring = None  # PcapRing con los paquetes crudos (backend pcap)
+        self.lag = None  # Reloj menos el timestamp del último paquete leído (segundos)
+        self.queue_policy = 'block'  # Política de la cola lector -> procesamiento
+        self.handoff = None  # HandoffQueue en uso
+        self.sampler = PacketSampler()  # Muestreo de paquetes (desactivado por defecto)
+        self.capture_drops = 0  # Perdidos según tshark/dumpcap (stderr o ISB de pcapng)
+        self.capture_filter = ''  # Filtro BPF (-f) aplicado por el kernel
+        self.interface_drops_base = interface_dropin(interface)
+
+    def stop(self):
+        """Termina el proceso de captura"""
+        self.running = False
+        if self.pipeline:
+            self.pipeline.stop()
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.ring:
+            self.ring.close()
+
+    def drops(self):
+        """Paquetes perdidos en cada etapa: cola interna, muestreo, captura e interfaz"""
+        handoff = self.handoff
+        current = interface_dropin(self.interface)
+        base = self.interface_drops_base
+        return {
+            'queue': handoff.dropped if handoff else 0,
+            'sampled': handoff.sampled_out if handoff else 0,
+            'capture': self.capture_drops,
+            'interface': current - base if current is not None and base is not None else None,
+            'queueDepth': handoff.queue.qsize() if handoff else 0,
+            'queuePeak': handoff.peak if handoff else 0,
+            'queuePolicy': self.queue_policy
+        }
+
+    def sampling_payload(self, packets_per_sec):
+        """Modo y tasa de muestreo, con el error relativo (95%) de la tasa de 10 s"""
+        rate = self.sampler.rate
+        estimated = packets_per_sec * 10
+        return {
+            'mode': self.sampler.mode,
+            'rate': rate,
+            'relativeError': round(1.96 * ((rate - 1) / estimated) ** 0.5, 4) if estimated and rate > 1 else 0
+        }
+
+    def payload(self, now):
+        """Estadísticas propias de la interfaz, con el formato de /api/stats"""
+        rates = self.rates
+        pps_1, bps_1 = rates.rate(1, now)
+        packets_per_sec, bytes_per_sec = rates.rate(10, now)
+        pps_60, bps_60 = rates.rate(60, now)
+        return {
+            'interface': self.interface,
+            'backend': self.backend,
+            'captureFilter': self.capture_filter,
+            'isCapturing': self.running,
+            'totalData': round(rates.total_bytes / (1024 * 1024), 2),  # MB
+            'packetsPerSec': round(packets_per_sec, 2),
+            'totalPackets': rates.total_packets,
+            'bytesPerSecond': bytes_per_sec,
+            'monitoringTime': time.time() - self.start_time,
+            'drops': self.drops(),
+            'sampling': self.sampling_payload(packets_per_sec),
+            'rates': {
+                '1s': {'packets_per_second': pps_1, 'bytes_per_second': bps_1},
+                '10s': {'packets_per_second': packets_per_sec, 'bytes_per_second': bytes_per_sec},
+                '60s': {'packets_per_second': pps_60, 'bytes_per_second': bps_60}
+            }
+        }
+
+
+# Resultado de compilar un filtro de captura: instrucciones BPF o el error de dumpcap
+CompiledFilter = namedtuple('CompiledFilter', ['expression', 'interface', 'valid', 'program', 'error'])
+
+
+class CaptureFilterCompiler:
+    """Valida filtros de captura BPF (-f) compilándolos con `dumpcap -d`, con caché LRU
+
+    El código BPF depende del linktype de la interfaz, así que la clave es
+    (interfaz, filtro). Solo se cachean los resultados definitivos: si
+    dumpcap no se pudo ejecutar o no pudo abrir la interfaz se vuelve a
+    intentar en la próxima consulta.
+    """
+
+    def __init__(self, max_entries=256, timeout=10):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.cache = OrderedDict()  # (interfaz, filtro) -> CompiledFilter
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, expression, interface='any'):
+        """Devuelve (CompiledFilter, si salió de la caché)"""
+        key = (interface, expression)
+        with self.lock:
+            compiled = self.cache.get(key)
+            if compiled is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return compiled, True
+            self.misses += 1
+        
+        compiled, definitive = self._run(expression, interface)
+        if definitive:
+            with self.lock:
+                self.cache[key] = compiled
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        return compiled, False
+
+    def _run(self, expression, interface):
+        """Ejecuta dumpcap -d; devuelve (CompiledFilter, es definitivo)"""
+        try:
+            result = subprocess.run([DUMPCAP_PATH, '-i', interface, '-f', expression, '-d'],
+                                    capture_output=True, text=True, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return CompiledFilter(expression, interface, False, [], f'No se pudo validar el filtro: {e}'), False
+        
+        program = [line for line in result.stdout.splitlines() if line.startswith('(')]
+        if result.returncode == 0 and program:
+            return CompiledFilter(expression, interface, True, program, None), True
+        error = ' '.join(line.strip() for line in result.stderr.splitlines() if line.strip())
+        # Permisos o interfaz inexistente no dicen nada del filtro: no se cachea
+        definitive = 'capture filter' in error
+        return CompiledFilter(expression, interface, False, [], error or 'dumpcap -d falló'), definitive
+
+
+def parse_interfaces(interface):
+    """Una interfaz, una lista o varias separadas por coma -> lista de nombres"""
+    if isinstance(interface, str):
+        return [name.strip() for name in interface.split(',') if name.strip()]
+    return list(interface)
+
+
+# Interfaces por defecto si ninguna fuente responde
+DEFAULT_INTERFACES = (
+    {'id': 1, 'name': 'eth0', 'description': 'Ethernet'},
+    {'id': 2, 'name': 'wlan0', 'description': 'WiFi'}
+)
+ARPHRD_LOOPBACK = 772  # /sys/class/net/<interfaz>/type de loopback
+
+
+class InterfaceCatalog:
+    """Interfaces de captura con caché y TTL
+
+    Se leen de /sys/class/net, que responde en milisegundos; `tshark -D` solo
+    se ejecuta cuando sysfs no alcanza (otro sistema operativo o ninguna
+    interfaz) y siempre en segundo plano: mientras tanto se usa psutil. Con la
+    caché vencida se devuelve la lista anterior y se renueva en un thread.
+    """
+
+    SYSFS = '/sys/class/net'
+
+    def __init__(self, ttl=60, timeout=10):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.interfaces = None
+        self.source = None  # sysfs, psutil, tshark o default
+        self.loaded = 0
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def get(self, refresh=False):
+        """Interfaces en caché; la primera vez (o con refresh) se leen en el momento"""
+        if refresh or self.interfaces is None:
+            self.refresh()
+        elif time.monotonic() - self.loaded > self.ttl:
+            self.refresh_in_background()
+        return self.interfaces
+
+    def refresh(self):
+        """Relee las fuentes rápidas; si hace falta tshark -D queda en segundo plano"""
+        interfaces, source = self._load(use_tshark=False)
+        self._store(interfaces, source)
+        if source != 'sysfs':
+            self.refresh_in_background(use_tshark=True)
+        return interfaces
+
+    def refresh_in_background(self, use_tshark=False):
+        """Renueva la caché en un thread (uno a la vez)"""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        
+        def run():
+            try:
+                self._store(*self._load(use_tshark or self.source != 'sysfs'))
+            finally:
+                self.refreshing = False
+        
+        threading.Thread(target=run, daemon=True).start()
+
+    def _store(self, interfaces, source):
+        # Un resultado de tshark no se pisa con el de psutil (sus nombres son los que acepta -i)
+        if source == 'psutil' and self.source == 'tshark' and self.interfaces:
+            interfaces, source = self.interfaces, self.source
+        self.interfaces = interfaces
+        self.source = source
+        self.loaded = time.monotonic()
+
+    def _load(self, use_tshark):
+        """(interfaces, fuente) desde la fuente más barata que sirva"""
+        interfaces = self._sysfs_interfaces()
+        if interfaces:
+            return interfaces, 'sysfs'
+        if use_tshark:
+            interfaces = self._tshark_interfaces()
+            if interfaces:
+                return interfaces, 'tshark'
+        interfaces = self._psutil_interfaces()
+        if interfaces:
+            return interfaces, 'psutil'
+        return [dict(interface) for interface in DEFAULT_INTERFACES], 'default'
+
+    def _sysfs_interfaces(self):
+        """Interfaces de Linux ordenadas por ifindex, más la pseudo-interfaz any"""
+        try:
+            names = os.listdir(self.SYSFS)
+        except OSError:
+            return []
+        interfaces = []
+        for name in names:
+            path = os.path.join(self.SYSFS, name)
+            try:
+                with open(os.path.join(path, 'ifindex')) as handle:
+                    index = int(handle.read())
+                with open(os.path.join(path, 'type')) as handle:
+                    link_type = int(handle.read())
+                with open(os.path.join(path, 'operstate')) as handle:
+                    state = handle.read().strip()
+            except (OSError, ValueError):
+                continue
+            if link_type == ARPHRD_LOOPBACK:
+                kind = 'Loopback'
+            elif os.path.isdir(os.path.join(path, 'wireless')):
+                kind = 'WiFi'
+            elif '/virtual/' in os.path.realpath(path):
+                kind = 'Virtual'
+            else:
+                kind = 'Ethernet'
+            interfaces.append({'id': index, 'name': name, 'description': f'{index}. {name} ({kind}, {state})'})
+        if not interfaces:
+            return []
+        interfaces.sort(key=operator.itemgetter('id'))
+        any_id = interfaces[-1]['id'] + 1
+        interfaces.append({'id': any_id, 'name': 'any',
+                           'description': f'{any_id}. any (Pseudo-interfaz: todas las interfaces)'})
+        return interfaces
+
+    def _psutil_interfaces(self):
+        try:
+            stats = psutil.net_if_stats()
+        except Exception as e:
+            print(f"❌ Error leyendo interfaces con psutil: {e}")
+            return []
+        return [{'id': number, 'name': name,
+                 'description': f"{number}. {name} ({'up' if stats[name].isup else 'down'})"}
+                for number, name in enumerate(sorted(stats), 1)]
+
+    def _tshark_interfaces(self):
+        """Lista de tshark -D (formato: "1. eth0 (Ethernet)")"""
+        try:
+            result = subprocess.run([TSHARK_PATH, '-D'], capture_output=True, text=True, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"❌ Error detectando interfaces con tshark: {e}")
+            return []
+        if result.returncode != 0:
+            return []
+        interfaces = []
+        for line in result.stdout.strip().split('\n'):
+            match = re.match(r'(\d+)\.\s+([^\s]+)', line.strip())
+            if match:
+                interfaces.append({
+                    'id': int(match.group(1)),
+                    'name': match.group(2),
+                    'description': line.strip()
+                })
+        return interfaces
+
+
+# Archivo del historial en disco (se puede cambiar con --history): en el
+# directorio de estado del usuario, no junto al script
+HISTORY_PATH = os.path.join(
+    os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state'),
+    'wireshark-monitor', 'wireshark_history.bin')
+
+# Snapshot publicado por el thread de estadísticas: cuerpo de /api/stats (global y
+# por interfaz) y evento SSE
+StatsSnapshot = namedtuple('StatsSnapshot', ['version', 'etag', 'body', 'event', 'interfaces'])
+
+
 class WiresharkMonitor:
-    def __init__(self):
+    def __init__(self, connection_capacity=100000, flow_capacity=65536, flow_idle_timeout=120):
         self.is_monitoring = False
-        self.process = None
+        self.captures = {}  # Interfaz -> CaptureSession
         self.stats = {
             'upload_speed': 0,
             'download_speed': 0,
             'total_packets': 0,
             'total_bytes': 0,
-            'packets_per_second': 0,
-            'interfaces': []
+            'packets_per_second': 0
         }
-        self.packet_history = deque(maxlen=60)  # Últimos 60 segundos
-        self.byte_history = deque(maxlen=60)
-        self.connections = deque(maxlen=1000)  # Historial de conexiones
+        self.rates = RateBuckets(60)  # Un contador por segundo, últimos 60 segundos
+        self.directions = LocalAddressIndex()  # Direcciones locales para upload/download
+        self.upload_rates = RateBuckets(60)
+        self.download_rates = RateBuckets(60)
+        self.connections = ConnectionStore(connection_capacity)  # Historial de conexiones
+        self.flows = FlowTable(flow_capacity, flow_idle_timeout)  # Conversaciones por 5-tupla
+        self.top_talkers = TopTalkers(window=60)  # Top hosts/puertos del último minuto
+        self.protocol_stats = ProtocolHierarchy()  # Jerarquía de frame.protocols
+        self.history = HistoryStore(HISTORY_PATH)  # Historial en disco (se abre al usarse)
+        self.ring_options = None  # Directorio y tamaños del anillo pcap (None = desactivado)
+        self.rings = {}  # Interfaz -> PcapRing, se conservan tras detener la captura
         self.start_time = None
+        self.clock = time.time  # Reloj de las ventanas de tasas (grabado en replay)
+        self.replay_report = None
+        self.replaying = False
+        self.workers = 0  # Procesos de parseo por defecto para el backend fields
+        self.queue_size = 256  # Items de la cola lector -> procesamiento
+        self.queue_policy = 'block'  # block, drop o sample (ver HandoffQueue)
+        self.sample_rate = 10  # 1 de cada N paquetes con la política sample
+        self.drop_totals = Counter()  # Perdidos por etapa (queue, sampled, capture)
+        self.filters = CaptureFilterCompiler()  # Filtros BPF ya validados con dumpcap -d
+        self.interface_catalog = InterfaceCatalog()  # Se lee al pedirla, no al importar el módulo
+        # Muestreo de paquetes (off, fixed o adaptive); se cambia en caliente con set_sampling
+        self.sampling = {'mode': 'off', 'rate': 1, 'max_rate': 1024}
+        self.sampling_totals = Counter()  # Muestreados, estimados y varianzas acumuladas
+        self.subscribers = set()  # Colas de los clientes de /api/stream
+        # Snapshot inmutable ya serializado; el thread de estadísticas lo reemplaza entero
+        self.boot_id = int(time.time())
+        self.snapshot = StatsSnapshot(0, None, b'', '', {})
+        self.snapshot_lock = threading.Lock()  # Serializa las publicaciones (versión y ETag)
         
-        # Detectar interfaces de red disponibles
-        self.detect_interfaces()
+        # Métricas internas para /metrics
+        self.metrics = MetricsRegistry()
+        self.lines_read = self.metrics.counter(
+            'lines_read', 'Líneas (o registros pcap) leídas del proceso de captura', ('interface',))
+        self.lines_parsed = self.metrics.counter(
+            'lines_parsed', 'Líneas convertidas en paquetes', ('interface',))
+        self.lines_rejected = self.metrics.counter(
+            'lines_rejected', 'Líneas descartadas por el parser de campos', ('interface',))
+        self.json_errors = self.metrics.counter(
+            'json_decode_errors', 'Líneas JSON de tshark que no se pudieron decodificar', ('interface',))
+        self.parse_seconds = self.metrics.histogram(
+            'parse_seconds', 'Latencia de parseo: por bloque (fields, json_decode) o por paquete (json_packet)',
+            PARSE_BUCKETS, ('interface', 'stage'))
+        self.reader_lag = self.metrics.histogram(
+            'reader_lag_seconds', 'Reloj de pared menos frame.time_epoch del último paquete del lote',
+            LAG_BUCKETS, ('interface',))
+        self.tick_seconds = self.metrics.histogram(
+            'stats_tick_seconds', 'Duración de cada tick del thread de estadísticas', TICK_BUCKETS)
+        
+        self._publish_snapshot()
         
     def detect_interfaces(self):
-        """Detecta las interfaces de red disponibles"""
-        try:
-            # Usar tshark para listar interfaces
-            result = subprocess.run(['tshark', '-D'], 
-                                  capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                interfaces = []
-                for line in result.stdout.strip().split('\n'):
-                    if line.strip():
-                        # Formato: "1. eth0 (Ethernet)"
-                        match = re.match(r'(\d+)\.\s+([^\s]+)', line)
-                        if match:
-                            interfaces.append({
-                                'id': int(match.group(1)),
-                                'name': match.group(2),
-                                'description': line
-                            })
-                self.stats['interfaces'] = interfaces
-                print(f"✅ Interfaces detectadas: {[i['name'] for i in interfaces]}")
-        except Exception as e:
-            print(f"❌ Error detectando interfaces: {e}")
-            # Interfaces por defecto
-            self.stats['interfaces'] = [
-                {'id': 1, 'name': 'eth0', 'description': 'Ethernet'},
-                {'id': 2, 'name': 'wlan0', 'description': 'WiFi'}
-            ]
+        """Detecta las interfaces de red disponibles (renueva la caché)"""
+        interfaces = self.interface_catalog.get(refresh=True)
+        print(f"✅ Interfaces detectadas ({self.interface_catalog.source}): {[i['name'] for i in interfaces]}")
+        return interfaces
 
-    def start_monitoring(self, interface='any', filter_expr=''):
-        """Inicia el monitoreo de tráfico con tshark"""
-        if self.is_monitoring:
+    def start_monitoring(self, interface='any', filter_expr='', backend='fields', workers=None,
+                         queue_policy=None, capture_filter=''):
+        """Inicia el monitoreo de tráfico con tshark (o dumpcap para pcap crudo)
+
+        `interface` puede ser una interfaz, una lista o varias separadas por
+        coma: cada una tiene su propio proceso de captura y thread lector.
+        Con workers > 0 (backend fields) el parseo se reparte en procesos.
+        queue_policy elige qué hacer cuando el procesamiento se atrasa
+        (block, drop o sample; por defecto self.queue_policy).
+        filter_expr es un filtro de visualización (-Y, después de disecar);
+        capture_filter es BPF (-f): el kernel descarta lo que no coincide.
+        """
+        if workers is None:
+            workers = self.workers
+        if queue_policy is None:
+            queue_policy = self.queue_policy
+        interfaces = parse_interfaces(interface)
+        
+        if backend not in CAPTURE_BACKENDS:
+            print(f"❌ Backend de captura desconocido: {backend}")
             return False
-            
+        if queue_policy not in HandoffQueue.POLICIES:
+            print(f"❌ Política de cola desconocida: {queue_policy}")
+            return False
+        if not interfaces or any(name in self.captures for name in interfaces):
+            return False
+        if capture_filter:
+            error = self.check_capture_filter(capture_filter, interfaces)
+            if error:
+                print(f"❌ {error}")
+                return False
+        
+        # Los lectores arrancan con is_monitoring ya activo
+        first_start = not self.is_monitoring
+        if first_start:
+            self.is_monitoring = True
+            self.start_time = time.time()
+        
+        started = [name for name in interfaces
+                   if self._start_capture(name, filter_expr, backend, workers, queue_policy, capture_filter)]
+        if not started:
+            self.is_monitoring = bool(self.captures)
+            return False
+        
+        if first_start:
+            self._start_stats_ticker()
+        
+        print("✅ Monitoreo iniciado correctamente")
+        return len(started) == len(interfaces)
+
+    def _start_capture(self, interface, filter_expr, backend, workers=0, queue_policy='block', capture_filter=''):
+        """Lanza el proceso de captura y los threads de una interfaz"""
         try:
-            print(f"🔄 Iniciando monitoreo en interfaz: {interface}")
-            
-            # Comando tshark para capturar paquetes
-            cmd = [
-                'tshark',
-                '-i', interface,  # Interfaz (any para todas)
-                '-T', 'json',     # Salida en formato JSON
-                '-e', 'frame.time_epoch',
-                '-e', 'frame.len',
-                '-e', 'ip.src',
-                '-e', 'ip.dst',
-                '-e', 'tcp.srcport',
-                '-e', 'tcp.dstport',
-                '-e', 'frame.protocols',
-                '-l'  # Flush de salida línea por línea
-            ]
-            
-            if filter_expr:
-                cmd.extend(['-Y', filter_expr])
-                print(f"🔍 Filtro aplicado: {filter_expr}")
+            print(f"🔄 Iniciando monitoreo en interfaz: {interface} (backend: {backend})")
             
+            cmd = self._build_capture_command(interface, filter_expr, backend, capture_filter=capture_filter)
             print(f"🚀 Ejecutando comando: {' '.join(cmd)}")
             
-            # Iniciar proceso tshark
-            self.process = subprocess.Popen(
+            capture = self._new_capture(interface, backend, workers, queue_policy, capture_filter)
+            # Salida binaria: se lee en bloques grandes, no línea por línea
+            capture.process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+                stderr=subprocess.PIPE
             )
+            self.captures[interface] = capture
             
-            self.is_monitoring = True
-            self.start_time = time.time()
+            readers = {
+                'json': self._process_packets,
+                'fields': self._process_packets_fields,
+                'pcap': self._process_packets_pcap
+            }
+            reader = readers[backend]
+            if workers and backend == 'fields':
+                print(f"🧩 Parseo repartido en {workers} procesos")
+                capture.pipeline = ShardedPipeline(workers, directions=self.directions)
+                capture.pipeline.start()
+                reader = self._process_packets_sharded
+                threading.Thread(target=self._merge_partials, args=(capture,), daemon=True).start()
+            elif workers:
+                print(f"⚠️ El parseo en procesos solo está disponible con el backend fields")
             
             # Iniciar threads para procesar datos
-            threading.Thread(target=self._process_packets, daemon=True).start()
-            threading.Thread(target=self._calculate_stats, daemon=True).start()
-            threading.Thread(target=self._check_tshark_errors, daemon=True).start()
-            
-            print("✅ Monitoreo iniciado correctamente")
+            threading.Thread(target=reader, args=(capture,), daemon=True).start()
+            threading.Thread(target=self._check_tshark_errors, args=(capture,), daemon=True).start()
             return True
             
         except Exception as e:
-            print(f"❌ Error iniciando monitoreo: {e}")
+            print(f"❌ Error iniciando monitoreo en {interface}: {e}")
             return False
 
-    def _check_tshark_errors(self):
+    def _new_capture(self, interface, backend, workers=0, queue_policy='block', capture_filter=''):
+        """Arma la CaptureSession de una interfaz: muestreo y anillo pcap según la configuración"""
+        capture = CaptureSession(interface, backend)
+        capture.queue_policy = queue_policy
+        capture.capture_filter = capture_filter
+        if not (workers and backend == 'fields'):
+            capture.sampler = PacketSampler(totals=self.sampling_totals, **self.sampling)
+        elif self.sampling['mode'] != 'off':
+            print(f"⚠️ El muestreo no se aplica al parseo en procesos")
+        if self.ring_options and backend == 'pcap':
+            options = dict(self.ring_options)
+            directory = os.path.join(options.pop('directory'), re.sub(r'[^\w.-]', '_', interface))
+            capture.ring = self.rings[interface] = PcapRing(directory, **options)
+            print(f"💾 Guardando paquetes crudos en {directory}")
+        elif self.ring_options:
+            print(f"⚠️ El anillo pcap solo está disponible con el backend pcap")
+        return capture
+
+    def _build_capture_command(self, interface, filter_expr, backend, read_file=None, capture_filter=''):
+        """Arma la línea de comandos de captura según el backend"""
+        # Interfaz en vivo (any para todas) o archivo de captura en replay
+        source = ['-r', read_file] if read_file else ['-i', interface]
+        if capture_filter and not read_file:
+            # Filtro BPF: lo aplica el kernel antes de copiar el paquete al pipe
+            source.extend(['-f', capture_filter])
+            print(f"🧱 Filtro de captura: {capture_filter}")
+        
+        if backend == 'pcap':
+            # dumpcap escribe pcapng crudo por stdout, sin disección
+            cmd = [DUMPCAP_PATH] + source + ['-w', '-']
+            if filter_expr:
+                print(f"⚠️ El backend pcap no aplica filtros de visualización: {filter_expr}")
+            return cmd
+        
+        # Comando tshark para capturar paquetes
+        cmd = [TSHARK_PATH] + source
+        if backend == 'json':
+            cmd.extend(['-T', 'json'])     # Salida en formato JSON
+        else:
+            cmd.extend(['-T', 'fields'])   # Campos separados por |
+        cmd.extend([
+            '-e', 'frame.time_epoch',
+            '-e', 'frame.len',
+            '-e', 'ip.src',
+            '-e', 'ip.dst',
+            '-e', 'tcp.srcport',
+            '-e', 'tcp.dstport',
+            '-e', 'frame.protocols'
+        ])
+        if backend == 'fields':
+            cmd.extend(['-E', 'header=y', '-E', 'separator=|'])
+        cmd.append('-l')  # Flush de salida línea por línea
+        
+        if filter_expr:
+            cmd.extend(['-Y', filter_expr])
+            print(f"🔍 Filtro aplicado: {filter_expr}")
+        return cmd
+
+    def check_capture_filter(self, expression, interface='any'):
+        """Compila el filtro BPF para cada interfaz; devuelve el primer error o None"""
+        for name in parse_interfaces(interface):
+            compiled, _ = self.filters.compile(expression, name)
+            if not compiled.valid:
+                return compiled.error
+        return None
+
+    def _check_tshark_errors(self, capture):
         """Verifica errores de tshark"""
-        if not self.process:
+        process = capture.process
+        if not process:
             return
             
-        while self.is_monitoring and self.process:
+        # Se lee hasta EOF aunque el lector ya haya terminado: los errores de
+        # arranque (permisos, interfaz) llegan justo cuando el proceso sale
+        while True:
             try:
-                error_line = self.process.stderr.readline()
+                error_line = process.stderr.readline()
+                if isinstance(error_line, bytes):
+                    error_line = error_line.decode(errors='replace')
                 if error_line:
-                    print(f"⚠️ tshark error: {error_line.strip()}")
-                if not error_line and self.process.poll() is not None:
+                    self._handle_error_line(capture, error_line)
+                if not error_line and process.poll() is not None:
                     break
             except Exception as e:
                 print(f"❌ Error leyendo stderr: {e}")
                 break
 
-    def stop_monitoring(self):
-        """Detiene el monitoreo"""
+    def _handle_error_line(self, capture, error_line):
+        """Muestra una línea de stderr y toma el resumen de perdidos si lo trae"""
+        print(f"⚠️ tshark error [{capture.interface}]: {error_line.strip()}")
+        summary = _DROP_SUMMARY.search(error_line)
+        if summary:
+            self._report_capture_drops(capture, int(summary.group(1) or summary.group(2)))
+
+    def set_sampling(self, mode, rate=None, max_rate=None):
+        """Cambia el muestreo de las capturas en curso sin reiniciar tshark (ValueError si no es válido)"""
+        if mode not in PacketSampler.MODES:
+            raise ValueError(f'Modo de muestreo desconocido: {mode}')
+        if mode == 'fixed' and rate is None:
+            raise ValueError('El modo fixed necesita rate')
+        for value in (rate, max_rate):
+            if value is not None and int(value) < 1:
+                raise ValueError('rate y max_rate deben ser >= 1')
+        
+        sampling = dict(self.sampling, mode=mode)
+        if max_rate is not None:
+            sampling['max_rate'] = int(max_rate)
+        sampling['rate'] = 1 if mode == 'off' else int(rate) if rate is not None else sampling['rate']
+        self.sampling = sampling
+        for capture in list(self.captures.values()):
+            if not capture.pipeline:
+                capture.sampler.configure(mode, sampling['rate'], sampling['max_rate'])
+        print(f"🎲 Muestreo: {mode} (1 de cada {sampling['rate']})")
+        return sampling
+
+    def _report_capture_drops(self, capture, dropped):
+        """Registra el total de perdidos que informó el proceso de captura (es acumulado)"""
+        delta = dropped - capture.capture_drops
+        if delta > 0:
+            capture.capture_drops = dropped
+            self.drop_totals['capture'] += delta
+            print(f"⚠️ {dropped} paquetes perdidos por la captura en {capture.interface}")
+
+    def stop_monitoring(self, interface=None):
+        """Detiene el monitoreo (todas las interfaces o solo `interface`)"""
         print("🛑 Deteniendo monitoreo...")
-        self.is_monitoring = False
-        if self.process:
-            self.process.terminate()
-            try:
-                self.process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.process.kill()
-            self.process = None
+        names = list(self.captures) if interface is None else [interface]
+        for name in names:
+            capture = self.captures.pop(name, None)
+            if capture:
+                capture.stop()
+        if not self.captures:
+            self.is_monitoring = False
+        self._publish_snapshot()
         print("✅ Monitoreo detenido")
 
-    def _process_packets(self):
-        """Procesa los paquetes capturados por tshark"""
-        packet_count = 0
+    def replay_pcap(self, path, speed=0, parser='pcap'):
+        """Reproduce un archivo pcap por todo el pipeline y mide el rendimiento
+
+        speed=0 procesa lo más rápido posible; speed>0 respeta los timestamps
+        grabados escalados por ese factor (1 = tiempo real). parser elige
+        quién decodifica: 'pcap' (nativo), 'fields' o 'json' (tshark -r).
+        """
+        if self.is_monitoring:
+            return None
+        if parser not in CAPTURE_BACKENDS:
+            print(f"❌ Parser de replay desconocido: {parser}")
+            return None
         
-        while self.is_monitoring and self.process:
-            try:
-                # Leer línea por línea
-                line = self.process.stdout.readline()
-                if not line:
-                    if self.process.poll() is not None:
-                        print("⚠️ Proceso tshark terminado")
-                        break
-                    continue
+        print(f"⏪ Reproduciendo {path} (parser: {parser}, velocidad: {speed or 'máxima'})")
+        packets_before = self.rates.total_packets
+        bytes_before = self.rates.total_bytes
+        first_timestamp = None
+        
+        # Las ventanas de tasas siguen el tiempo grabado, no el reloj de pared
+        self.clock = lambda: self.rates.last_timestamp or time.time()
+        capture = CaptureSession(f"replay:{os.path.basename(path)}", parser)
+        self.captures[capture.interface] = capture
+        self.replaying = True
+        self.is_monitoring = True
+        self.start_time = time.time()
+        wall_start = time.perf_counter()
+        
+        try:
+            threading.Thread(target=self._calculate_stats, daemon=True).start()
+            
+            if parser == 'pcap':
+                first_timestamp = self._replay_native(path, speed, capture)
+            else:
+                if speed:
+                    print("⚠️ Los parsers de tshark no respetan la velocidad: se procesa al máximo")
+                cmd = self._build_capture_command(None, '', parser, read_file=path)
+                capture.process = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                )
+                if parser == 'json':
+                    self._process_packets(capture)
+                else:
+                    self._process_packets_fields(capture)
+                capture.process.wait()
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            capture.running = False
+            self.captures.pop(capture.interface, None)
+            self.is_monitoring = bool(self.captures)
+            self._update_stats(self.clock())
+            self.clock = time.time
+            self.replaying = False
+        
+        packets = self.rates.total_packets - packets_before
+        total_bytes = self.rates.total_bytes - bytes_before
+        last_timestamp = self.rates.last_timestamp
+        self.replay_report = {
+            'file': path,
+            'parser': parser,
+            'speed': speed,
+            'packets': packets,
+            'bytes': total_bytes,
+            'wall_time': wall_time,
+            'capture_duration': (last_timestamp - first_timestamp) if first_timestamp and last_timestamp else None,
+            'packets_per_second': packets / wall_time if wall_time else 0,
+            'bytes_per_second': total_bytes / wall_time if wall_time else 0,
+            'stats': dict(self.stats)
+        }
+        print(f"🏁 Replay terminado: {packets} paquetes en {wall_time:.2f}s "
+              f"({self.replay_report['packets_per_second']:.0f} paquetes/s)")
+        return self.replay_report
+
+    def _replay_native(self, path, speed, capture):
+        """Alimenta _process_packet_simple desde un archivo con el decodificador nativo"""
+        first_timestamp = None
+        last_second = None
+        wall_start = time.perf_counter()
+        
+        with open(path, 'rb') as capture_file:
+            for timestamp, packet_size, linktype, data in PcapStreamReader(capture_file, 1 << 20):
+                if not self.is_monitoring:
+                    break
+                if first_timestamp is None:
+                    first_timestamp = timestamp
                 
-                # Intentar parsear JSON
-                line = line.strip()
-                if line and (line.startswith('{') or line.startswith('[')):
-                    try:
-                        packet_data = json.loads(line)
-                        self._process_packet(packet_data)
-                        packet_count += 1
-                        if packet_count % 10 == 0:
-                            print(f"📦 Procesados {packet_count} paquetes")
-                    except json.JSONDecodeError as e:
-                        print(f"⚠️ Error JSON: {e} - Línea: {line[:100]}")
-                        
+                # Esperar hasta el instante grabado (escalado por speed)
+                if speed:
+                    delay = (timestamp - first_timestamp) / speed - (time.perf_counter() - wall_start)
+                    if delay > 0:
+                        time.sleep(delay)
+                
+                ip_src, ip_dst, src_port, dst_port, protocol, protocols = decode_frame(linktype, data)
+                self._process_packet_simple({
+                    'timestamp': timestamp,
+                    'size': packet_size,
+                    'src_ip': ip_src,
+                    'dst_ip': ip_dst,
+                    'src_port': src_port,
+                    'dst_port': dst_port,
+                    'protocol': protocol,
+                    'protocols': protocols
+                }, capture)
+                
+                # Un tick de estadísticas por cada segundo grabado
+                second = int(timestamp)
+                if second != last_second:
+                    if last_second is not None:
+                        self._update_stats(timestamp)
+                    last_second = second
+        return first_timestamp
+
+    def _handoff(self, capture, items, count=None, thin=None):
+        """Lee `items` en un thread aparte y los entrega por una HandoffQueue
+
+        Devuelve la cola para iterarla en el thread de procesamiento; count(item)
+        da los paquetes de cada item (1 si no se indica) y thin se usa con la
+        política sample.
+        """
+        handoff = capture.handoff = HandoffQueue(self.queue_size, capture.queue_policy,
+                                                 self.sample_rate, self.drop_totals)
+        lines_read = self.lines_read.labels(capture.interface)
+        
+        def read():
+            try:
+                for item in items:
+                    packets = count(item) if count else 1
+                    lines_read.inc(packets)
+                    handoff.put(item, packets, thin)
             except Exception as e:
-                print(f"❌ Error procesando paquetes: {e}")
-                break
+                print(f"❌ Error leyendo la captura [{capture.interface}]: {e}")
+            finally:
+                handoff.close()
+        
+        threading.Thread(target=read, daemon=True).start()
+        return handoff
+
+    def _read_json_packets(self, capture, chunk_size=65536):
+        """Itera listas de objetos JSON (texto sin decodificar) del stdout binario de tshark"""
+        splitter = JsonPacketSplitter()
+        process = capture.process
+        read = getattr(process.stdout, 'read1', process.stdout.read)
+        
+        while self.is_monitoring and capture.running:
+            chunk = read(chunk_size)
+            if not chunk:
+                if process.poll() is not None:
+                    print("⚠️ Proceso tshark terminado")
+                    break
+                continue
+            
+            spans = self._split_json(capture, splitter, chunk)
+            if spans:
+                yield spans
+        
+        spans = self._split_json(capture, splitter, b'', final=True)
+        if spans:
+            yield spans
+
+    def _split_json(self, capture, splitter, chunk, final=False):
+        """Pasa un bloque por el JsonPacketSplitter y cuenta lo que no es un objeto"""
+        spans, errors = splitter.feed(chunk, final)
+        self._report_json_errors(capture, errors)
+        return spans
+
+    def _report_json_errors(self, capture, errors):
+        for error in errors:
+            self.json_errors.labels(capture.interface).inc()
+            print(f"⚠️ Error JSON: {error}")
+
+    def _process_packets(self, capture):
+        """Procesa los paquetes capturados por tshark"""
+        packet_count = 0
+        try:
+            for spans in self._handoff(capture, self._read_json_packets(capture), len, _thin_items):
+                previous = packet_count
+                packet_count += self._consume_json_packets(capture, spans)
+                if packet_count // 1000 != previous // 1000:
+                    print(f"📦 Procesados {packet_count} paquetes (json)")
+        except Exception as e:
+            print(f"❌ Error procesando paquetes: {e}")
         
+        capture.running = False
         print(f"🏁 Finalizando procesamiento. Total paquetes: {packet_count}")
 
-    def _process_packets_fields(self):
-        """Procesa los paquetes cuando tshark usa formato de campos"""
+    def _consume_json_packets(self, capture, spans):
+        """Muestrea, decodifica y agrega objetos JSON; devuelve los paquetes procesados"""
+        # Con muestreo activo solo se decodifica 1 de cada N objetos
+        spans, weight = capture.sampler.thin(spans)
+        if not spans:
+            return 0
+        started = time.perf_counter()
+        packets, errors = JsonPacketSplitter.decode(spans)
+        self.parse_seconds.labels(capture.interface, 'json_decode').observe(time.perf_counter() - started)
+        self._report_json_errors(capture, errors)
+        parse_seconds = self.parse_seconds.labels(capture.interface, 'json_packet')
+        timestamp = None
+        for packet_data in packets:
+            started = time.perf_counter()
+            timestamp = self._process_packet(packet_data, capture, weight)
+            parse_seconds.observe(time.perf_counter() - started)
+        self.lines_parsed.labels(capture.interface).inc(len(packets))
+        if timestamp is not None:
+            self._observe_lag(capture, timestamp, self.reader_lag.labels(capture.interface))
+        return len(packets)
+
+    def _read_fields_blocks(self, capture, chunk_size=1 << 20):
+        """Itera bloques de líneas completas (sin header) del stdout binario de tshark"""
+        splitter = FieldsSplitter()
+        process = capture.process
+        read = getattr(process.stdout, 'read1', process.stdout.read)
+        
+        while self.is_monitoring and capture.running:
+            chunk = read(chunk_size)
+            if not chunk:
+                if process.poll() is not None:
+                    print("⚠️ Proceso tshark terminado")
+                    break
+                continue
+            
+            block = splitter.feed(chunk)
+            if block:
+                yield block
+
+    def _process_packets_fields(self, capture, chunk_size=1 << 20):
+        """Procesa los paquetes cuando tshark usa formato de campos
+
+        Un thread lector corta stdout en bloques de líneas completas y los pasa
+        por la cola; acá se parsean y se entregan como lotes a _process_batch.
+        """
         packet_count = 0
-        header_processed = False
+        rejected_count = 0
+        blocks = self._handoff(capture, self._read_fields_blocks(capture, chunk_size),
+                               _count_lines, _thin_lines)
         
-        while self.is_monitoring and self.process:
-            try:
-                line = self.process.stdout.readline()
-                if not line:
-                    if self.process.poll() is not None:
-                        print("⚠️ Proceso tshark terminado")
-                        break
-                    continue
-                
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # Saltar el header
-                if not header_processed:
-                    if line.startswith('frame.time_epoch'):
-                        header_processed = True
-                        print("📋 Header procesado, iniciando captura de datos...")
-                        continue
-                
-                if header_processed:
-                    # Procesar línea de datos (separada por |)
-                    fields = line.split('|')
-                    if len(fields) >= 7:
-                        try:
-                            timestamp = float(fields[0]) if fields[0] else time.time()
-                            packet_size = int(fields[1]) if fields[1] else 0
-                            ip_src = fields[2] if fields[2] else None
-                            ip_dst = fields[3] if fields[3] else None
-                            src_port = int(fields[4]) if fields[4].isdigit() else None
-                            dst_port = int(fields[5]) if fields[5].isdigit() else None
-                            protocols = fields[6] if fields[6] else ""
-                            
-                            # Determinar protocolo
-                            protocol = "UNKNOWN"
-                            if 'tcp' in protocols.lower():
-                                protocol = 'TCP'
-                            elif 'udp' in protocols.lower():
-                                protocol = 'UDP'
-                            elif 'icmp' in protocols.lower():
-                                protocol = 'ICMP'
-                            
-                            # Crear estructura de datos similar al JSON
-                            packet_data = {
-                                'timestamp': timestamp,
-                                'size': packet_size,
-                                'src_ip': ip_src,
-                                'dst_ip': ip_dst,
-                                'src_port': src_port,
-                                'dst_port': dst_port,
-                                'protocol': protocol
-                            }
-                            
-                            self._process_packet_simple(packet_data)
-                            packet_count += 1
-                            if packet_count % 10 == 0:
-                                print(f"📦 Procesados {packet_count} paquetes (formato campos)")
-                                
-                        except (ValueError, IndexError) as e:
-                            print(f"⚠️ Error procesando línea: {e} - {line}")
+        try:
+            for block in blocks:
+                packets, rejected = self._consume_fields_block(capture, block)
+                rejected_count += rejected
+                previous = packet_count
+                packet_count += packets
+                if packet_count // 10000 != previous // 10000:
+                    print(f"📦 Procesados {packet_count} paquetes (formato campos)")
                         
+        except Exception as e:
+            print(f"❌ Error procesando paquetes (campos): {e}")
+        
+        capture.running = False
+        print(f"🏁 Finalizando procesamiento (campos). Total paquetes: {packet_count}, "
+              f"líneas rechazadas: {rejected_count}")
+
+    def _consume_fields_block(self, capture, block):
+        """Muestrea, parsea y agrega un bloque de líneas; devuelve (paquetes, rechazadas)"""
+        interface = capture.interface
+        # Con muestreo activo solo se parsea 1 de cada N líneas
+        weight = 1
+        if capture.sampler.rate > 1:
+            lines, weight = capture.sampler.thin(block.split(b'\n'))
+            if not lines:
+                return 0, 0
+            block = b'\n'.join(lines)
+        
+        # Procesar líneas de datos (separadas por |) en lote
+        started = time.perf_counter()
+        batch, rejected = parse_fields_batch(block)
+        parsed = time.perf_counter()
+        self.parse_seconds.labels(interface, 'fields_parse').observe(parsed - started)
+        self.lines_rejected.labels(interface).inc(rejected)
+        if batch is None:
+            return 0, rejected
+        
+        self._process_batch(batch, capture, weight)
+        self.parse_seconds.labels(interface, 'fields_batch').observe(time.perf_counter() - parsed)
+        self.lines_parsed.labels(interface).inc(len(batch.timestamps))
+        self._observe_lag(capture, batch.timestamps[-1], self.reader_lag.labels(interface))
+        return len(batch.timestamps), rejected
+
+    def _process_packets_sharded(self, capture, chunk_size=1 << 20):
+        """Lee el formato de campos y reparte los bloques entre los workers"""
+        lines_read = self.lines_read.labels(capture.interface)
+        lines_rejected = self.lines_rejected.labels(capture.interface)
+        try:
+            for block in self._read_fields_blocks(capture, chunk_size):
+                lines_read.inc(block.count(b'\n') + 1)
+                lost = capture.pipeline.dispatch(block)
+                if lost:
+                    lines_rejected.inc(lost)
+        except Exception as e:
+            print(f"❌ Error repartiendo paquetes (campos): {e}")
+        
+        capture.running = False
+        capture.pipeline.stop()
+
+    def _merge_partials(self, capture):
+        """Combina en los agregados globales los parciales enviados por los workers"""
+        packet_count = 0
+        rejected_count = 0
+        lines_parsed = self.lines_parsed.labels(capture.interface)
+        lines_rejected = self.lines_rejected.labels(capture.interface)
+        reader_lag = self.reader_lag.labels(capture.interface)
+        for result in capture.pipeline.results():
+            lines_rejected.inc(result.rejected)
+            if not result.packets:
+                continue
+            try:
+                for second, packets in result.second_packets.items():
+                    size = result.second_bytes.get(second, 0)
+                    self.rates.add(second, size, packets)
+                    capture.rates.add(second, size, packets)
+                for rates, totals in ((self.upload_rates, result.upload), (self.download_rates, result.download)):
+                    for second, (packets, size) in totals.items():
+                        rates.add(second, size, packets)
+                self.flows.merge(result.flows)
+                self.top_talkers.add_totals(result.last_timestamp, result.hosts,
+                                            result.ports, result.protocols)
+                self.protocol_stats.add_totals(result.last_timestamp, result.stacks)
+                if result.tail:
+                    timestamps, src_ips, dst_ips, src_ports, dst_ports, protocols, sizes = zip(*result.tail)
+                    self.connections.extend(timestamps, src_ips, dst_ips, src_ports,
+                                            dst_ports, protocols, sizes)
+                lines_parsed.inc(result.packets)
+                self._observe_lag(capture, result.last_timestamp, reader_lag)
+                packet_count += result.packets
+                rejected_count += result.rejected
             except Exception as e:
-                print(f"❌ Error procesando paquetes (campos): {e}")
-                break
+                print(f"❌ Error combinando parciales del worker {result.shard}: {e}")
+        
+        print(f"🏁 Finalizando procesamiento en procesos. Total paquetes: {packet_count}, "
+              f"líneas rechazadas: {rejected_count}")
+
+    def _read_pcap_records(self, capture, batch_size=256):
+        """Itera listas de registros pcap/pcapng de dumpcap; al final toma los drops de la ISB
+
+        Una lista se entrega al llenarse o cuando el buffer del lector se vació
+        (el próximo registro todavía no llegó), así no se paga la cola por paquete.
+        """
+        reader = PcapStreamReader(capture.process.stdout)
+        records = []
+        for record in reader:
+            # Detenida la captura se sigue leyendo hasta EOF: la ISB llega al final
+            if not (self.is_monitoring and capture.running):
+                continue
+            records.append(record)
+            if len(records) >= batch_size or not reader.buffered():
+                yield records
+                records = []
+        if records:
+            yield records
+        print("⚠️ Flujo pcap terminado")
+        if reader.interface_drops:
+            self._report_capture_drops(capture, sum(reader.interface_drops.values()))
+
+    def _process_packets_pcap(self, capture):
+        """Procesa los paquetes leyendo pcap/pcapng crudo desde dumpcap"""
+        packet_count = 0
+        try:
+            for records in self._handoff(capture, self._read_pcap_records(capture), len, _thin_items):
+                previous = packet_count
+                packet_count += self._consume_pcap_records(capture, records)
+                if packet_count // 1000 != previous // 1000:
+                    print(f"📦 Procesados {packet_count} paquetes (pcap)")
+        except Exception as e:
+            print(f"❌ Error procesando paquetes (pcap): {e}")
         
-        print(f"🏁 Finalizando procesamiento (campos). Total paquetes: {packet_count}")
+        capture.running = False
+        print(f"🏁 Finalizando procesamiento (pcap). Total paquetes: {packet_count}")
+
+    def _consume_pcap_records(self, capture, records):
+        """Guarda en el anillo, muestrea y decodifica registros pcap; devuelve los procesados"""
+        # El anillo pcap guarda todo; solo la muestra se decodifica
+        if capture.ring:
+            for timestamp, packet_size, linktype, data in records:
+                capture.ring.write(timestamp, packet_size, linktype, data)
+        records, weight = capture.sampler.thin(records)
+        if not records:
+            return 0
+        for timestamp, packet_size, linktype, data in records:
+            ip_src, ip_dst, src_port, dst_port, protocol, protocols = decode_frame(linktype, data)
+            self._process_packet_simple({
+                'timestamp': timestamp,
+                'size': packet_size,
+                'src_ip': ip_src,
+                'dst_ip': ip_dst,
+                'src_port': src_port,
+                'dst_port': dst_port,
+                'protocol': protocol,
+                'protocols': protocols
+            }, capture, weight)
+        self.lines_parsed.labels(capture.interface).inc(len(records))
+        self._observe_lag(capture, records[-1][0], self.reader_lag.labels(capture.interface))
+        return len(records)
+
+    def _observe_lag(self, capture, timestamp, histogram):
+        """Registra cuánto atrasa el lector respecto del reloj (en replay, el grabado)"""
+        lag = self.clock() - timestamp
+        capture.lag = lag
+        histogram.observe(lag)
+        capture.sampler.adapt(lag, time.monotonic())
 
-    def _process_packet_simple(self, packet_data):
+    def _process_batch(self, batch, capture=None, weight=1):
+        """Agrega un lote de paquetes en columnas (PacketBatch)
+
+        Con weight > 1 el lote es una muestra de 1 cada `weight` paquetes: los
+        contadores se escalan y conexiones/flujos guardan solo lo muestreado.
+        """
+        try:
+            timestamps = batch.timestamps
+            sizes = batch.sizes
+            
+            self.rates.add_batch(timestamps, sizes, weight)
+            if capture is not None:
+                capture.rates.add_batch(timestamps, sizes, weight)
+                capture.sampler.account(weight, sizes)
+            upload, download = self.directions.split(timestamps, batch.src_ips, batch.dst_ips, sizes)
+            self.upload_rates.add_batch(*upload, weight)
+            self.download_rates.add_batch(*download, weight)
+            
+            self.connections.extend(timestamps, batch.src_ips, batch.dst_ips, batch.src_ports,
+                                    batch.dst_ports, batch.protocols, sizes)
+            
+            self.flows.update_batch(timestamps, batch.src_ips, batch.dst_ips, batch.src_ports,
+                                    batch.dst_ports, batch.protocols, sizes)
+            scaled = sizes if weight == 1 else [size * weight for size in sizes]
+            self.top_talkers.add_batch(timestamps, batch.src_ips, batch.dst_ips, batch.src_ports,
+                                       batch.dst_ports, batch.protocols, scaled)
+            self.protocol_stats.add_batch(timestamps, batch.stacks, sizes, weight)
+            
+        except Exception as e:
+            print(f"❌ Error procesando lote: {e}")
+
+    def _process_packet_simple(self, packet_data, capture=None, weight=1):
         """Procesa un paquete en formato simple (no JSON)"""
         try:
             current_time = time.time()
@@ -256,35 +3286,53 @@ class WiresharkMonitor:
             timestamp = packet_data.get('timestamp', current_time)
             packet_size = packet_data.get('size', 0)
             
-            # Agregar a historial de paquetes
-            self.packet_history.append({
-                'timestamp': timestamp,
-                'size': packet_size,
-                'packet_data': packet_data
-            })
-            
-            self.byte_history.append({
-                'timestamp': current_time,
-                'bytes': packet_size
-            })
+            # Sumar al segundo correspondiente (global y de la interfaz)
+            self.rates.add(timestamp, packet_size * weight, weight)
+            if capture is not None:
+                capture.rates.add(timestamp, packet_size * weight, weight)
+                if weight != 1:
+                    capture.sampler.account(weight, (packet_size,))
             
-            # Agregar a historial de conexiones si tenemos IPs
-            if packet_data.get('src_ip') and packet_data.get('dst_ip'):
-                self.connections.append({
-                    'timestamp': current_time,
-                    'src_ip': packet_data['src_ip'],
-                    'dst_ip': packet_data['dst_ip'],
-                    'src_port': packet_data.get('src_port'),
-                    'dst_port': packet_data.get('dst_port'),
-                    'protocol': packet_data.get('protocol', 'UNKNOWN'),
-                    'size': packet_size
-                })
+            self._record_packet_details(
+                timestamp,
+                packet_size,
+                packet_data.get('src_ip'),
+                packet_data.get('dst_ip'),
+                packet_data.get('src_port'),
+                packet_data.get('dst_port'),
+                packet_data.get('protocol', 'UNKNOWN'),
+                packet_data.get('protocols'),
+                weight
+            )
             
         except Exception as e:
             print(f"❌ Error procesando paquete simple: {e}")
 
-    def _process_packet(self, packet_data):
-        """Procesa un paquete individual"""
+    def _record_packet_details(self, timestamp, packet_size, ip_src, ip_dst,
+                               src_port, dst_port, protocol, stack=None, weight=1):
+        """Registra un paquete en los almacenes por fila (los contadores van aparte)
+
+        weight > 1 escala los contadores; conexiones y flujos guardan el paquete tal cual.
+        """
+        scaled = packet_size * weight
+        if stack:
+            self.protocol_stats.add(timestamp, stack, scaled, weight)
+        direction = self.directions.direction(ip_src, ip_dst)
+        if direction == LocalAddressIndex.UPLOAD:
+            self.upload_rates.add(timestamp, scaled, weight)
+        elif direction == LocalAddressIndex.DOWNLOAD:
+            self.download_rates.add(timestamp, scaled, weight)
+        self.top_talkers.add(timestamp, ip_src, ip_dst, src_port, dst_port, protocol, scaled)
+        
+        # Agregar a historial de conexiones si tenemos IPs
+        if ip_src and ip_dst:
+            self.connections.append(timestamp, ip_src, ip_dst, src_port,
+                                    dst_port, protocol, packet_size)
+            self.flows.update(timestamp, ip_src, ip_dst, src_port,
+                              dst_port, protocol, packet_size)
+
+    def _process_packet(self, packet_data, capture=None, weight=1):
+        """Procesa un paquete individual y devuelve su timestamp (None si falló)"""
         try:
             current_time = time.time()
             
@@ -293,7 +3341,8 @@ class WiresharkMonitor:
                 packet_data = packet_data[0]
             
             layers = packet_data.get('_source', {}).get('layers', {})
-            frame = layers.get('frame', {})
+            # Con -e tshark deja las capas planas ({"frame.len": ["60"], ...})
+            frame = layers.get('frame', layers)
             
             # Obtener datos del frame
             packet_size = 0
@@ -314,10 +3363,9 @@ class WiresharkMonitor:
             ip_dst = None
             src_port = None
             dst_port = None
-            protocol = "UNKNOWN"
             
-            ip = layers.get('ip', {})
-            tcp = layers.get('tcp', {})
+            ip = layers.get('ip', layers)
+            tcp = layers.get('tcp', layers)
             
             if isinstance(ip.get('ip.src'), list):
                 ip_src = ip['ip.src'][0] if ip['ip.src'] else None
@@ -345,37 +3393,18 @@ class WiresharkMonitor:
                 protocol_str = ':'.join(protocols)
             else:
                 protocol_str = str(protocols)
+            protocol = protocol_stack(protocol_str).transport
             
-            if 'tcp' in protocol_str.lower():
-                protocol = 'TCP'
-            elif 'udp' in protocol_str.lower():
-                protocol = 'UDP'
-            elif 'icmp' in protocol_str.lower():
-                protocol = 'ICMP'
-            
-            # Agregar a historial de paquetes
-            self.packet_history.append({
-                'timestamp': timestamp,
-                'size': packet_size,
-                'packet_data': packet_data
-            })
-            
-            self.byte_history.append({
-                'timestamp': current_time,
-                'bytes': packet_size
-            })
+            # Sumar al segundo correspondiente (global y de la interfaz)
+            self.rates.add(timestamp, packet_size * weight, weight)
+            if capture is not None:
+                capture.rates.add(timestamp, packet_size * weight, weight)
+                if weight != 1:
+                    capture.sampler.account(weight, (packet_size,))
             
-            # Agregar a historial de conexiones
-            if ip_src and ip_dst:
-                self.connections.append({
-                    'timestamp': current_time,
-                    'src_ip': ip_src,
-                    'dst_ip': ip_dst,
-                    'src_port': src_port,
-                    'dst_port': dst_port,
-                    'protocol': protocol,
-                    'size': packet_size
-                })
+            self._record_packet_details(timestamp, packet_size, ip_src, ip_dst,
+                                        src_port, dst_port, protocol, protocol_str, weight)
+            return timestamp
             
         except Exception as e:
             print(f"❌ Error procesando paquete individual: {e}")
@@ -383,72 +3412,247 @@ class WiresharkMonitor:
     def get_recent_connections(self, limit=50):
         """Obtiene las conexiones recientes"""
         try:
-            # Convertir deque a lista y tomar los últimos elementos
-            recent_connections = list(self.connections)[-limit:] if self.connections else []
-            return recent_connections
+            # Solo se materializan como dicts las filas devueltas
+            return self.connections.recent(limit)
         except Exception as e:
             print(f"❌ Error obteniendo conexiones: {e}")
             return []
 
+    def _start_stats_ticker(self):
+        """Arranca el tick de estadísticas (un thread; el modo asyncio usa una tarea)"""
+        threading.Thread(target=self._calculate_stats, daemon=True).start()
+
     def _calculate_stats(self):
         """Calcula estadísticas en tiempo real"""
         while self.is_monitoring:
             try:
-                current_time = time.time()
-                
-                # Filtrar datos del último minuto
-                recent_packets = [p for p in self.packet_history 
-                                if current_time - p['timestamp'] <= 60]
-                recent_bytes = [b for b in self.byte_history 
-                              if current_time - b['timestamp'] <= 60]
-                
-                # Calcular paquetes por segundo (últimos 10 segundos)
-                last_10_sec_packets = [p for p in recent_packets 
-                                     if current_time - p['timestamp'] <= 10]
-                packets_per_sec = len(last_10_sec_packets) / 10 if last_10_sec_packets else 0
-                
-                # Calcular bytes por segundo (velocidad)
-                last_10_sec_bytes = [b for b in recent_bytes 
-                                   if current_time - b['timestamp'] <= 10]
-                bytes_per_sec = sum(b['bytes'] for b in last_10_sec_bytes) / 10 if last_10_sec_bytes else 0
-                
-                # Actualizar estadísticas
-                self.stats.update({
-                    'upload_speed': bytes_per_sec / 2048,  # Aproximación upload (KB/s)
-                    'download_speed': bytes_per_sec / 1024,  # Aproximación download (KB/s)
-                    'total_packets': len(self.packet_history),
-                    'total_bytes': sum(p['size'] for p in self.packet_history),
-                    'packets_per_second': packets_per_sec,
-                    'bytes_per_second': bytes_per_sec,
-                    'monitoring_time': current_time - (self.start_time or current_time)
-                })
-                
+                started = time.perf_counter()
+                self._update_stats(self.clock())
+                self.tick_seconds.observe(time.perf_counter() - started)
                 time.sleep(1)  # Actualizar cada segundo
                 
             except Exception as e:
                 print(f"❌ Error calculando estadísticas: {e}")
                 time.sleep(1)
 
+    def _update_stats(self, current_time):
+        """Actualiza self.stats a partir de los contadores por segundo"""
+        rates = self.rates
+        self.flows.expire(current_time)
+        self.directions.maybe_refresh()
+        # Índices de /api/connections al día: una consulta filtrada no indexa más de un tick
+        self.connections.catch_up()
+        # Un replay trae timestamps grabados: no se mezclan con el historial en vivo
+        if not self.replaying:
+            try:
+                self.history.flush_rates(current_time, rates, self.upload_rates, self.download_rates)
+            except (OSError, ValueError) as e:
+                print(f"❌ Error escribiendo historial: {e}")
+        
+        # Tasas sobre ventanas de 1, 10 y 60 segundos (costo fijo)
+        pps_1, bps_1 = rates.rate(1, current_time)
+        packets_per_sec, bytes_per_sec = rates.rate(10, current_time)
+        pps_60, bps_60 = rates.rate(60, current_time)
+        upload_bps = self.upload_rates.rate(10, current_time)[1]
+        download_bps = self.download_rates.rate(10, current_time)[1]
+        
+        # Actualizar estadísticas: se arma un dict nuevo y se reemplaza entero
+        stats = dict(self.stats)
+        stats.update({
+            'upload_speed': upload_bps / 1024,  # Bytes enviados por direcciones locales (KB/s)
+            'download_speed': download_bps / 1024,  # Bytes recibidos por direcciones locales (KB/s)
+            'upload_bytes': self.upload_rates.total_bytes,
+            'download_bytes': self.download_rates.total_bytes,
+            'total_packets': rates.total_packets,
+            'total_bytes': rates.total_bytes,
+            'packets_per_second': packets_per_sec,
+            'bytes_per_second': bytes_per_sec,
+            'rates': {
+                '1s': {'packets_per_second': pps_1, 'bytes_per_second': bps_1},
+                '10s': {'packets_per_second': packets_per_sec, 'bytes_per_second': bytes_per_sec},
+                '60s': {'packets_per_second': pps_60, 'bytes_per_second': bps_60}
+            },
+            'monitoring_time': time.time() - (self.start_time or time.time())
+        })
+        self.stats = stats
+        self._publish_snapshot()
+
+    def _publish_snapshot(self):
+        """Serializa una vez el snapshot de /api/stats y lo publica con un solo swap"""
+        # El tick y las capturas con ?interface pueden publicar a la vez: versión,
+        # cuerpo y ETag se arman juntos para que dos cuerpos no compartan ETag
+        with self.snapshot_lock:
+            data = json.dumps(self.stats_payload())
+            now = self.clock()
+            interfaces = {
+                name: json.dumps({'status': 'success', 'data': capture.payload(now)}).encode()
+                for name, capture in list(self.captures.items())
+            }
+            version = self.snapshot.version + 1
+            snapshot = self.snapshot = StatsSnapshot(
+                version,
+                f'"{self.boot_id:x}-{version}"',
+                ('{"status": "success", "data": ' + data + '}').encode(),
+                'data: ' + data + '\n\n',
+                interfaces
+            )
+        
+        # El mismo evento serializado para todos los suscriptores
+        if self.subscribers:
+            self._publish(snapshot.event)
+
+    def stats_payload(self):
+        """Arma el bloque 'data' que devuelve /api/stats"""
+        return {
+            'uploadSpeed': round(self.stats['upload_speed'], 2),
+            'downloadSpeed': round(self.stats['download_speed'], 2),
+            'totalData': round(self.stats['total_bytes'] / (1024 * 1024), 2),  # MB
+            'packetsPerSec': round(self.stats['packets_per_second'], 2),
+            'totalPackets': self.stats['total_packets'],
+            'bytesPerSecond': self.stats.get('bytes_per_second', 0),
+            'totalUpload': round(self.stats.get('upload_bytes', 0) / (1024 * 1024), 2),  # MB
+            'totalDownload': round(self.stats.get('download_bytes', 0) / (1024 * 1024), 2),  # MB
+            'monitoringTime': self.stats.get('monitoring_time', 0),
+            'rates': self.stats.get('rates', {}),
+            'drops': self.drops(),
+            'sampling': self.sampling_payload(),
+            'isMonitoring': self.is_monitoring,
+            'interfaces': sorted(self.captures),
+            'connections': self.get_recent_connections(30)  # Últimas 30 conexiones
+        }
+
+    def metrics_text(self, openmetrics=True):
+        """Cuerpo de /metrics: contadores de tráfico, métricas internas y memoria por buffer"""
+        captures = list(self.captures.values())
+        history = self.history.size if self.history.mmap is not None else 0
+        rings = list(self.rings.items())
+        collected = [
+            ('packets', 'counter', 'Paquetes contados (todas las capturas)', [({}, self.rates.total_packets)]),
+            ('bytes', 'counter', 'Bytes contados (todas las capturas)', [({}, self.rates.total_bytes)]),
+            ('interface_packets', 'counter', 'Paquetes contados por cada captura en curso', [
+                ({'interface': capture.interface}, capture.rates.total_packets) for capture in captures]),
+            ('interface_bytes', 'counter', 'Bytes contados por cada captura en curso', [
+                ({'interface': capture.interface}, capture.rates.total_bytes) for capture in captures]),
+            ('direction_bytes', 'counter', 'Bytes enviados (upload) y recibidos (download) por direcciones locales', [
+                ({'direction': 'upload'}, self.upload_rates.total_bytes),
+                ({'direction': 'download'}, self.download_rates.total_bytes)]),
+            ('flows_removed', 'counter', 'Flujos quitados de la tabla', [
+                ({'reason': 'evicted'}, self.flows.evicted), ({'reason': 'expired'}, self.flows.expired)]),
+            ('dropped_packets', 'counter', 'Paquetes perdidos por etapa (cola interna, muestreo, captura)', [
+                ({'stage': stage}, self.drop_totals[stage]) for stage in ('queue', 'sampled', 'capture')]),
+            ('queue_depth', 'gauge', 'Items esperando en la cola lector -> procesamiento', [
+                ({'interface': capture.interface}, capture.handoff.queue.qsize())
+                for capture in captures if capture.handoff]),
+            ('protocol_overflow_packets', 'counter', 'Paquetes de nodos que no entraron en la jerarquía',
+             [({}, self.protocol_stats.overflow)]),
+            ('flows', 'gauge', 'Flujos activos en la tabla', [({}, len(self.flows))]),
+            ('connections', 'gauge', 'Filas guardadas en el historial de conexiones', [({}, len(self.connections))]),
+            ('reader_lag_current_seconds', 'gauge', 'Atraso del lector en el último lote de cada captura', [
+                ({'interface': capture.interface}, capture.lag) for capture in captures if capture.lag is not None]),
+            ('buffer_bytes', 'gauge', 'Memoria aproximada de cada buffer del monitor', [
+                ({'buffer': 'connections'}, self.connections.memory_bytes()),
+                ({'buffer': 'flows'}, self.flows.memory_bytes()),
+                ({'buffer': 'top_talkers'}, self.top_talkers.memory_bytes()),
+                ({'buffer': 'protocols'}, self.protocol_stats.memory_bytes()),
+                ({'buffer': 'history_mmap'}, history)]),
+            ('pcap_ring_bytes', 'gauge', 'Bytes en disco del anillo pcap de cada interfaz', [
+                ({'interface': interface}, sum(ring_file.size for ring_file in list(ring.files)))
+                for interface, ring in rings]),
+            ('sampling_rate', 'gauge', 'Se procesa 1 de cada N paquetes en cada captura', [
+                ({'interface': capture.interface}, capture.sampler.rate) for capture in captures]),
+            ('sampled_packets', 'counter', 'Paquetes procesados como muestra (cada uno pesa N)',
+             [({}, self.sampling_totals['sampled'])]),
+            ('capture_filter_lookups', 'counter', 'Validaciones de filtros BPF resueltas por la caché o por dumpcap -d', [
+                ({'result': 'hit'}, self.filters.hits), ({'result': 'miss'}, self.filters.misses)]),
+            ('stream_subscribers', 'gauge', 'Clientes conectados a /api/stream', [({}, len(self.subscribers))]),
+            ('monitoring', 'gauge', '1 si hay alguna captura en curso', [({}, int(self.is_monitoring))])
+        ]
+        return self.metrics.render(collected, openmetrics)
+
+    def sampling_payload(self):
+        """Configuración del muestreo y cota de error (95%) de los totales estimados"""
+        totals = self.sampling_totals
+        return {
+            'mode': self.sampling['mode'],
+            'rate': self.sampling['rate'],
+            'sampledPackets': totals['sampled'],
+            'estimatedPackets': totals['estimated'],
+            'packetsError': round(1.96 * totals['variance_packets'] ** 0.5),
+            'bytesError': round(1.96 * totals['variance_bytes'] ** 0.5 / (1024 * 1024), 2)  # MB
+        }
+
+    def drops(self):
+        """Paquetes perdidos desde el arranque; 'interface' suma las capturas en curso"""
+        interface_drops = [capture.drops()['interface'] for capture in list(self.captures.values())]
+        return {
+            'queue': self.drop_totals['queue'],
+            'sampled': self.drop_totals['sampled'],
+            'capture': self.drop_totals['capture'],
+            'interface': sum(value for value in interface_drops if value is not None),
+            'queuePolicy': self.queue_policy
+        }
+
+    def subscribe(self):
+        """Registra un cliente de streaming y devuelve su cola de eventos"""
+        events = queue.Queue(maxsize=1)
+        self.subscribers.add(events)
+        return events
+
+    def unsubscribe(self, events):
+        self.subscribers.discard(events)
+
+    def _publish(self, event):
+        """Reparte un evento ya serializado a todos los suscriptores"""
+        for events in list(self.subscribers):
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # Cliente lento: el snapshot pendiente se reemplaza por el nuevo
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    events.put_nowait(event)
+                except queue.Full:
+                    pass
+
 # Instancia global del monitor
 monitor = WiresharkMonitor()
 
 # Rutas de la API REST
 @app.route('/api/interfaces', methods=['GET'])
 def get_interfaces():
-    """Obtiene las interfaces de red disponibles"""
+    """Obtiene las interfaces de red disponibles (en caché; ?refresh=1 las relee)"""
+    now = monitor.clock()
+    catalog = monitor.interface_catalog
+    interfaces = catalog.get(refresh=request.args.get('refresh') == '1')
     return jsonify({
         'status': 'success',
-        'interfaces': monitor.stats['interfaces']
+        'interfaces': interfaces,
+        'source': catalog.source,
+        'captures': [capture.payload(now) for capture in list(monitor.captures.values())]
     })
 
 @app.route('/api/start', methods=['POST'])
 def start_monitoring():
     """Inicia el monitoreo de red"""
     data = request.get_json() or {}
-    interface = data.get('interface', 'any')
+    # Una interfaz, una lista en 'interfaces' o varias separadas por coma
+    interface = data.get('interfaces') or data.get('interface', 'any')
     filter_expr = data.get('filter', '')
-    self.use_json_format = False  # Forzar formato de campos
-    success = monitor.start_monitoring(interface, filter_expr)
+    backend = data.get('backend', 'fields')  # json, fields o pcap
+    workers = data.get('workers')  # Procesos de parseo (solo fields)
+    if workers is not None and (type(workers) is not int or workers < 0):
+        return jsonify({'status': 'error', 'message': 'workers debe ser un entero no negativo',
+                        'monitoring': monitor.is_monitoring}), 400
+    queue_policy = data.get('queue_policy')  # block, drop o sample
+    capture_filter = data.get('capture_filter', '')  # BPF (-f), validado con dumpcap -d
+    if capture_filter:
+        error = monitor.check_capture_filter(capture_filter, interface)
+        if error:
+            return jsonify({'status': 'error', 'message': error, 'monitoring': monitor.is_monitoring}), 400
+    success = monitor.start_monitoring(interface, filter_expr, backend, workers, queue_policy, capture_filter)
     
     return jsonify({
         'status': 'success' if success else 'error',
@@ -458,49 +3662,295 @@ def start_monitoring():
 
 @app.route('/api/stop', methods=['POST'])
 def stop_monitoring():
-    """Detiene el monitoreo de red"""
-    monitor.stop_monitoring()
+    """Detiene el monitoreo de red (todas las interfaces o la indicada)"""
+    data = request.get_json(silent=True) or {}
+    monitor.stop_monitoring(data.get('interface'))
     return jsonify({
         'status': 'success',
         'message': 'Monitoreo detenido',
         'monitoring': monitor.is_monitoring
     })
 
+@app.route('/api/replay', methods=['GET', 'POST'])
+def replay_capture():
+    """Reproduce un archivo pcap (POST) o consulta el último reporte (GET)"""
+    if request.method == 'GET':
+        return jsonify({
+            'status': 'success',
+            'running': monitor.replaying,
+            'report': monitor.replay_report
+        })
+    
+    data = request.get_json() or {}
+    path = data.get('file')
+    if not path:
+        return jsonify({'status': 'error', 'message': 'Falta el archivo a reproducir'}), 400
+    parser = data.get('parser', 'pcap')
+    if parser not in CAPTURE_BACKENDS:
+        return jsonify({'status': 'error', 'message': f'Parser de replay desconocido: {parser} '
+                                                      f'(opciones: {", ".join(CAPTURE_BACKENDS)})'}), 400
+    # El replay corre en un thread: los parámetros se validan antes de arrancarlo
+    speed = data.get('speed', 0)
+    try:
+        speed = math.nan if isinstance(speed, bool) else float(speed)
+    except (TypeError, ValueError):
+        speed = math.nan
+    if not math.isfinite(speed) or speed < 0:
+        return jsonify({'status': 'error', 'message': 'speed debe ser un número mayor o igual a 0'}), 400
+    if monitor.is_monitoring:
+        return jsonify({'status': 'error', 'message': 'El monitor ya está en ejecución'}), 409
+    
+    monitor.replay_report = None
+    threading.Thread(
+        target=monitor.replay_pcap,
+        args=(path, speed, parser),
+        daemon=True
+    ).start()
+    return jsonify({
+        'status': 'success',
+        'message': 'Replay iniciado',
+        'file': path
+    })
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    """Obtiene las estadísticas actuales"""
+    """Obtiene las estadísticas actuales (snapshot ya serializado, con ETag)
+
+    Con ?interface= devuelve solo los contadores de esa captura.
+    """
+    snapshot = monitor.snapshot
+    body = snapshot.body
+    interface = request.args.get('interface')
+    if interface:
+        body = snapshot.interfaces.get(interface)
+        if body is None:
+            return jsonify({'status': 'error', 'message': f'Interfaz sin captura: {interface}'}), 404
+    
+    headers = {'ETag': snapshot.etag, 'Cache-Control': 'no-cache'}
+    if snapshot.etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
+
+@app.route('/api/stream', methods=['GET'])
+def stream_stats():
+    """Envía las estadísticas por Server-Sent Events, un snapshot por segundo"""
+    events = monitor.subscribe()
+    
+    def generate():
+        try:
+            yield monitor.snapshot.event
+            while True:
+                try:
+                    yield events.get(timeout=15)
+                except queue.Empty:
+                    yield ': keepalive\n\n'  # Mantener viva la conexión sin tráfico
+        finally:
+            monitor.unsubscribe(events)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/connections', methods=['GET'])
+def get_connections():
+    """Obtiene las últimas conexiones que cumplen los filtros (protocol, ip, port, from, to)"""
+    try:
+        limit = max(0, int(request.args.get('limit', 50)))
+        protocol_filter = request.args.get('protocol', '').upper() or None
+        port = request.args.get('port')
+        port = int(port) if port else None
+        start = request.args.get('from')
+        end = request.args.get('to')
+        start = float(start) if start else None
+        end = float(end) if end else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit, port, from y to deben ser numéricos'}), 400
+    if protocol_filter and protocol_filter not in PROTOCOL_CODES:
+        return jsonify({'status': 'error', 'message': f'Protocolo no soportado: {protocol_filter}'}), 400
+    
+    # Filtrar primero con los índices y recién después limitar
+    connections = monitor.connections.query(limit, protocol_filter, request.args.get('ip') or None,
+                                            port, start, end)
+    
+    return jsonify({
+        'status': 'success',
+        'connections': connections,
+        'total': len(connections)
+    })
+
+@app.route('/api/flows', methods=['GET'])
+def get_flows():
+    """Obtiene los flujos (5-tupla) ordenados y paginados"""
+    sort = request.args.get('sort', 'bytes')
+    if sort not in FlowTable.SORT_KEYS:
+        return jsonify({'status': 'error', 'message': f'Orden no soportado: {sort}'}), 400
+    descending = request.args.get('order', 'desc').lower() != 'asc'
+    try:
+        limit = max(0, int(request.args.get('limit', 50)))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit y offset deben ser enteros'}), 400
+    protocol_filter = request.args.get('protocol', '').upper()
+    
+    flows, total = monitor.flows.query(sort, descending, limit, offset, protocol_filter)
+    
+    return jsonify({
+        'status': 'success',
+        'flows': flows,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'evicted': monitor.flows.evicted,
+        'expired': monitor.flows.expired
+    })
+
+@app.route('/api/top', methods=['GET'])
+def get_top():
+    """Obtiene los hosts, puertos y protocolos con más bytes del último minuto"""
+    try:
+        limit = max(0, int(request.args.get('limit', 20)))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit debe ser un entero'}), 400
+    dimension = request.args.get('dimension')
+    if dimension and dimension not in TopTalkers.DIMENSIONS:
+        return jsonify({'status': 'error', 'message': f'Dimensión no soportada: {dimension}'}), 400
+    
+    dimensions = [dimension] if dimension else TopTalkers.DIMENSIONS
+    now = monitor.clock()
+    return jsonify({
+        'status': 'success',
+        'window': monitor.top_talkers.window,
+        'top': {name: monitor.top_talkers.top(name, limit, now) for name in dimensions}
+    })
+
+@app.route('/api/protocols', methods=['GET'])
+def get_protocols():
+    """Obtiene la jerarquía de protocolos con bytes/paquetes totales y tasas"""
+    try:
+        window = min(60, max(1, int(request.args.get('window', 10))))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'window debe ser un entero'}), 400
+    return jsonify({
+        'status': 'success',
+        'window': window,
+        'protocols': monitor.protocol_stats.query(monitor.clock(), window)
+    })
+
+@app.route('/api/capture-filter', methods=['GET', 'POST'])
+def validate_capture_filter():
+    """Valida un filtro de captura BPF (?filter=&interface=) y devuelve su programa compilado"""
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    expression = data.get('filter', '')
+    if not expression:
+        return jsonify({'status': 'error', 'message': 'Falta el parámetro filter'}), 400
+    compiled, cached = monitor.filters.compile(expression, data.get('interface', 'any'))
     return jsonify({
         'status': 'success',
         'data': {
-            'uploadSpeed': round(monitor.stats['upload_speed'], 2),
-            'downloadSpeed': round(monitor.stats['download_speed'], 2),
-            'totalData': round(monitor.stats['total_bytes'] / (1024 * 1024), 2),  # MB
-            'packetsPerSec': round(monitor.stats['packets_per_second'], 2),
-            'totalPackets': monitor.stats['total_packets'],
-            'bytesPerSecond': monitor.stats.get('bytes_per_second', 0),
-            'monitoringTime': monitor.stats.get('monitoring_time', 0),
-            'isMonitoring': monitor.is_monitoring,
-            'connections': monitor.get_recent_connections(30)  # Últimas 30 conexiones
+            'filter': compiled.expression,
+            'interface': compiled.interface,
+            'valid': compiled.valid,
+            'instructions': len(compiled.program),
+            'program': compiled.program,
+            'error': compiled.error,
+            'cached': cached
         }
     })
 
-@app.route('/api/connections', methods=['GET'])
-def get_connections():
-    """Obtiene solo las conexiones activas"""
-    limit = int(request.args.get('limit', 50))
-    protocol_filter = request.args.get('protocol', '').upper()
+@app.route('/api/sampling', methods=['GET', 'POST'])
+def sampling():
+    """Consulta o cambia el muestreo de paquetes (mode: off, fixed o adaptive; rate; max_rate)"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            monitor.set_sampling(data.get('mode', 'fixed'), data.get('rate'), data.get('max_rate'))
+        except (TypeError, ValueError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
     
-    connections = monitor.get_recent_connections(limit)
+    payload = monitor.sampling_payload()
+    payload['captures'] = {name: {'mode': capture.sampler.mode, 'rate': capture.sampler.rate}
+                           for name, capture in list(monitor.captures.items())}
+    return jsonify({'status': 'success', 'data': payload})
+
+@app.route('/api/extract', methods=['GET'])
+def extract_packets():
+    """Descarga en pcap los paquetes guardados en el anillo (?from=&to=&filter=&interface=)"""
+    interface = request.args.get('interface')
+    rings = monitor.rings
+    if not rings:
+        return jsonify({'status': 'error', 'message': 'El anillo pcap no está activo (--ring)'}), 404
+    if interface is None and len(rings) == 1:
+        interface = next(iter(rings))
+    ring = rings.get(interface)
+    if ring is None:
+        return jsonify({'status': 'error', 'message': f'Interfaz sin anillo pcap: {interface}',
+                        'interfaces': sorted(rings)}), 400
+    try:
+        end = float(request.args.get('to', time.time()))
+        start = float(request.args.get('from', end - 300))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'from/to deben ser epoch en segundos'}), 400
+    
+    output = tempfile.SpooledTemporaryFile(max_size=16 << 20)
+    packets = ring.extract(start, end, output)
+    if not packets:
+        return jsonify({'status': 'error', 'message': 'No hay paquetes en el rango pedido'}), 404
+    output.seek(0)
+    
+    filter_expr = request.args.get('filter', '')
+    if filter_expr:
+        # El filtro de visualización se aplica con tshark solo sobre la región extraída
+        try:
+            result = subprocess.run([TSHARK_PATH, '-r', '-', '-Y', filter_expr, '-F', 'pcap', '-w', '-'],
+                                    stdin=output, capture_output=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return jsonify({'status': 'error', 'message': f'No se pudo aplicar el filtro: {e}'}), 500
+        if result.returncode != 0:
+            return jsonify({'status': 'error', 'message': result.stderr.decode(errors='replace').strip()}), 400
+        body = result.stdout
+    else:
+        body = output.read()
     
-    if protocol_filter:
-        connections = [c for c in connections if c['protocol'] == protocol_filter]
+    return Response(body, mimetype='application/vnd.tcpdump.pcap', headers={
+        'Content-Disposition': f'attachment; filename="extract_{int(start)}_{int(end)}.pcap"',
+        'X-Packets': str(packets)
+    })
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Obtiene el historial de tráfico (?from=&to= en epoch, step en segundos)"""
+    now = time.time()
+    try:
+        end = float(request.args.get('to', now))
+        start = float(request.args.get('from', end - 3600))
+        step = request.args.get('step')
+        step = int(step) if step else None
+        if end <= start or (step is not None and step <= 0):
+            raise ValueError('Rango o paso inválido')
+        step, points = monitor.history.query(start, end, step)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except OSError as e:
+        return jsonify({'status': 'error', 'message': f'Historial no disponible: {e}'}), 503
     
     return jsonify({
         'status': 'success',
-        'connections': connections,
-        'total': len(connections)
+        'from': int(start),
+        'to': int(end),
+        'step': step,
+        'points': points
     })
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas en formato OpenMetrics (o Prometheus 0.0.4 si el cliente no lo pide)"""
+    if 'application/openmetrics-text' in request.headers.get('Accept', ''):
+        return Response(monitor.metrics_text(openmetrics=True),
+                        content_type='application/openmetrics-text; version=1.0.0; charset=utf-8')
+    return Response(monitor.metrics_text(openmetrics=False),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Obtiene el estado del monitor"""
@@ -523,14 +3973,85 @@ def get_system_info():
     })
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor API REST para Wireshark')
+    parser.add_argument('--replay', metavar='PCAP', help='Reproduce un archivo pcap y muestra el reporte')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='Factor de velocidad del replay (0 = máximo, 1 = tiempo real)')
+    parser.add_argument('--parser', choices=CAPTURE_BACKENDS, default='pcap',
+                        help='Decodificador usado en el replay')
+    parser.add_argument('--connections', type=int, default=100000,
+                        help='Capacidad del historial de conexiones (filas)')
+    parser.add_argument('--flows', type=int, default=65536,
+                        help='Cantidad máxima de flujos en la tabla')
+    parser.add_argument('--flow-timeout', type=float, default=120,
+                        help='Segundos de inactividad antes de expirar un flujo')
+    parser.add_argument('--history', default=HISTORY_PATH,
+                        help='Archivo mmap del historial de tráfico')
+    parser.add_argument('--ring', metavar='DIR',
+                        help='Guarda los paquetes crudos en un anillo de pcaps (backend pcap)')
+    parser.add_argument('--ring-files', type=int, default=10,
+                        help='Cantidad de archivos del anillo pcap')
+    parser.add_argument('--ring-size', type=int, default=64,
+                        help='Tamaño máximo de cada archivo del anillo (MB)')
+    parser.add_argument('--tshark', default=TSHARK_PATH, help='Ejecutable de tshark (o fake_tshark.py)')
+    parser.add_argument('--dumpcap', default=DUMPCAP_PATH, help='Ejecutable de dumpcap (o fake_tshark.py)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Procesos de parseo para el backend fields (0 = en el thread lector)')
+    parser.add_argument('--sampling', choices=PacketSampler.MODES, default='off',
+                        help='Muestreo de paquetes: fijo 1 de cada N o adaptado al atraso del lector')
+    parser.add_argument('--sampling-rate', type=int, default=None,
+                        help='N del muestreo fijo (o tasa inicial del adaptativo)')
+    parser.add_argument('--queue-size', type=int, default=256,
+                        help='Items de la cola entre el lector y el procesamiento')
+    parser.add_argument('--queue-policy', choices=HandoffQueue.POLICIES, default='block',
+                        help='Con la cola llena: esperar, descartar lo nuevo o muestrear')
+    parser.add_argument('--sample-rate', type=int, default=10,
+                        help='Con --queue-policy sample, 1 de cada N paquetes')
+    args = parser.parse_args()
+    TSHARK_PATH = args.tshark
+    DUMPCAP_PATH = args.dumpcap
+    
+    if args.connections != monitor.connections.capacity:
+        monitor.connections = ConnectionStore(args.connections)
+    monitor.flows = FlowTable(args.flows, args.flow_timeout)
+    monitor.workers = args.workers
+    monitor.queue_size = args.queue_size
+    monitor.queue_policy = args.queue_policy
+    monitor.sample_rate = args.sample_rate
+    try:
+        monitor.set_sampling(args.sampling, args.sampling_rate)
+    except ValueError as e:
+        parser.error(str(e))
+    monitor.history = HistoryStore(args.history)
+    if args.ring:
+        monitor.ring_options = {'directory': args.ring, 'max_files': args.ring_files,
+                                'max_file_bytes': args.ring_size << 20}
+    
+    if args.replay:
+        report = monitor.replay_pcap(args.replay, args.speed, args.parser)
+        print(json.dumps(report, indent=2, default=str))
+        raise SystemExit(0 if report else 1)
+    
     print("🚀 Iniciando servidor API REST para Wireshark...")
+    # Las interfaces se leen en segundo plano: no demoran el arranque
+    threading.Thread(target=monitor.detect_interfaces, daemon=True).start()
     print("🔡 Endpoints disponibles:")
-    print("   GET  /api/interfaces - Listar interfaces")
-    print("   POST /api/start - Iniciar monitoreo") 
+    print("   GET  /api/interfaces - Listar interfaces (en caché, ?refresh=1) y capturas activas")
+    print("   POST /api/start - Iniciar monitoreo (backend: json, fields o pcap; queue_policy; capture_filter BPF)")
+    print("   GET  /api/capture-filter - Validar un filtro BPF con dumpcap -d (?filter=&interface=)")
     print("   POST /api/stop - Detener monitoreo")
-    print("   GET  /api/stats - Obtener estadísticas")
+    print("   GET  /api/stats - Obtener estadísticas (?interface= para una captura)")
+    print("   GET  /api/stream - Estadísticas en vivo (Server-Sent Events)")
     print("   GET  /api/status - Estado del monitor")
     print("   GET  /api/system-info - Info del sistema")
+    print("   GET  /api/flows - Flujos por 5-tupla (sort, order, limit, offset)")
+    print("   GET  /api/top - Top hosts/puertos/protocolos del último minuto")
+    print("   GET  /api/extract - Paquetes del anillo pcap (?from=&to=&filter=)")
+    print("   GET  /api/history - Historial 1s/1m/1h (?from=&to=&step=)")
+    print("   GET  /api/protocols - Jerarquía de protocolos (?window= segundos)")
+    print("   POST /api/sampling - Muestreo en caliente (mode: off, fixed, adaptive; rate)")
+    print("   POST /api/replay - Reproducir un archivo pcap")
+    print("   GET  /metrics - Métricas internas (OpenMetrics / Prometheus)")
     print("\n🔗 Ejemplo de uso:")
     print("   curl http://localhost:5000/api/stats")
     print("\n⚠️  Asegúrate de tener tshark instalado y permisos de administrador")
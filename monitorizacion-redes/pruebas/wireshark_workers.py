@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Monitor de Wireshark con la API repartida en varios procesos
+
+El motor (captura, agregación y tick de estadísticas) corre en su propio
+proceso y en cada tick publica el snapshot de /api/stats, las estadísticas
+por interfaz y las últimas conexiones en un segmento de memoria compartida
+(archivo mmap en /dev/shm) protegido con un seqlock. Se publican los
+cuerpos ya serializados (una vez por tick, con su ETag) y no los contadores
+y buckets de tasas crudos: así un worker no repite stats_payload() ni
+necesita el resto del estado del motor (drops, muestreo, capturas).
+
+Varios workers HTTP comparten el mismo socket ya abierto y sirven
+/api/stats, /api/connections y /api/stream leyendo el segmento, sin pasar
+por el GIL del motor; el resto de las rutas (start, stop, flows, metrics,
+...) se reenvían al motor por un socket unix local. /api/connections
+también va al motor cuando la respuesta puede necesitar conexiones más
+viejas que las publicadas.
+
+    python3 wireshark_workers.py --api-workers 4 --port 5000
+"""
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.connection import Client, Listener
+
+from flask import Flask, Response, jsonify, request
+from flask_cors import CORS
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import wireshark_server_fix2 as server
+
+# Conexiones recientes publicadas en el segmento (las que filtra /api/connections
+# en el worker; si no alcanzan, la consulta va al motor)
+SHARED_CONNECTIONS = 2000
+SHARED_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                           f'wireshark_stats_{os.getpid()}.shm')
+
+# Lo que un worker lee del segmento: etag, cuerpos ya serializados y conexiones
+# (JSON; None si el motor no las pudo publicar)
+SharedView = namedtuple('SharedView', ['sequence', 'etag', 'body', 'event', 'connections', 'interfaces'])
+
+
+class SharedSnapshot:
+    """Snapshot de estadísticas en un archivo mmap con un seqlock (un escritor, varios lectores)
+
+    El escritor deja la secuencia impar mientras copia y par al terminar; el
+    lector copia los datos y los descarta si la secuencia cambió en el medio.
+    Los datos son secciones de bytes con su largo delante.
+    """
+
+    MAGIC = b'WSSTAT01'
+    HEADER = struct.Struct('<8sQI')  # magic, secuencia, bytes de datos
+    LENGTH = struct.Struct('<I')
+
+    def __init__(self, path, size=8 << 20, create=False):
+        self.path = path
+        with open(path, 'w+b' if create else 'r+b') as handle:
+            if create:
+                handle.truncate(size)
+            self.mmap = mmap.mmap(handle.fileno(), 0)
+        self.size = len(self.mmap)
+        if create:
+            self.HEADER.pack_into(self.mmap, 0, self.MAGIC, 0, 0)
+        elif self.mmap[:8] != self.MAGIC:
+            raise ValueError(f'{path} no es un segmento de estadísticas')
+        self.lock = threading.Lock()  # Serializa a los escritores del proceso motor
+        self.cached = None
+        self.view = None
+
+    def publish(self, sections):
+        """Escribe las secciones; devuelve False si no entran en el segmento"""
+        data = b''.join(self.LENGTH.pack(len(section)) + section for section in sections)
+        if self.HEADER.size + len(data) > self.size:
+            return False
+        with self.lock:
+            sequence = self.HEADER.unpack_from(self.mmap, 0)[1]
+            struct.pack_into('<Q', self.mmap, 8, sequence + 1)  # Impar: escritura en curso
+            self.mmap[self.HEADER.size:self.HEADER.size + len(data)] = data
+            struct.pack_into('<I', self.mmap, 16, len(data))
+            struct.pack_into('<Q', self.mmap, 8, sequence + 2)
+        return True
+
+    def read(self, retries=1000):
+        """Devuelve (secuencia, secciones); sin cambios desde la última lectura no copia nada"""
+        for _ in range(retries):
+            sequence = struct.unpack_from('<Q', self.mmap, 8)[0]
+            if self.cached and self.cached[0] == sequence:
+                return self.cached
+            if sequence & 1:
+                time.sleep(0)  # El motor está escribiendo
+                continue
+            length = struct.unpack_from('<I', self.mmap, 16)[0]
+            data = self.mmap[self.HEADER.size:self.HEADER.size + length]
+            if struct.unpack_from('<Q', self.mmap, 8)[0] != sequence:
+                continue
+            sections = []
+            offset = 0
+            while offset < length:
+                size = self.LENGTH.unpack_from(data, offset)[0]
+                sections.append(data[offset + 4:offset + 4 + size])
+                offset += 4 + size
+            self.cached = (sequence, sections)
+            return self.cached
+        # Escritor demasiado activo: se sirve la última copia consistente
+        return self.cached or (0, [])
+
+    def read_view(self):
+        """Lee el segmento y lo arma como SharedView (se decodifica una vez por secuencia)"""
+        sequence, sections = self.read()
+        view = self.view
+        if view is not None and view.sequence == sequence:
+            return view
+        if len(sections) < 4:
+            view = SharedView(sequence, None, b'', '', None, {})
+        else:
+            # Secciones: etag, /api/stats, evento SSE, conexiones y pares interfaz/cuerpo
+            etag, body, event, connections = sections[:4]
+            interfaces = {sections[i].decode(): sections[i + 1] for i in range(4, len(sections) - 1, 2)}
+            view = SharedView(sequence, etag.decode(), body, event.decode(), json.loads(connections), interfaces)
+        self.view = view
+        return view
+
+    def close(self):
+        self.mmap.close()
+
+
+class EngineMonitor(server.WiresharkMonitor):
+    """WiresharkMonitor que además publica cada snapshot en la memoria compartida"""
+
+    def __init__(self, shared, *args, **kwargs):
+        self.shared = shared
+        # El tick y las capturas publican a la vez: el snapshot que se copia al
+        # segmento es el recién armado y el segmento no vuelve a uno más viejo
+        self.publish_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _publish_snapshot(self):
+        with self.publish_lock:
+            super()._publish_snapshot()
+            snapshot = self.snapshot
+            sections = [snapshot.etag.encode(), snapshot.body, snapshot.event.encode(),
+                        json.dumps(self.get_recent_connections(SHARED_CONNECTIONS)).encode()]
+            for name, body in snapshot.interfaces.items():
+                sections.extend((name.encode(), body))
+            if not self.shared.publish(sections):
+                # Sin lugar para las conexiones: se publican las estadísticas solas
+                sections[3] = b'null'
+                if not self.shared.publish(sections):
+                    print("❌ El snapshot no entra en la memoria compartida")
+
+
+def filter_connections(rows, limit=50, protocol=None, ip=None, port=None, start=None, end=None,
+                       window=SHARED_CONNECTIONS):
+    """Las `limit` conexiones más nuevas que cumplen los filtros (como ConnectionStore.query)
+
+    Devuelve (conexiones, completo). `rows` son solo las últimas `window`
+    conexiones del motor: si la ventana está llena y no se juntaron `limit`
+    ni se llegó a `start`, completo es False porque puede haber más entre
+    las conexiones viejas que solo tiene el motor.
+    """
+    selected = []
+    complete = len(rows) < window
+    for row in reversed(rows):
+        if len(selected) >= limit:
+            break
+        if end is not None and row['timestamp'] > end:
+            continue
+        if start is not None and row['timestamp'] < start:
+            complete = True
+            break
+        if protocol and row['protocol'] != protocol:
+            continue
+        if ip and ip != row['src_ip'] and ip != row['dst_ip']:
+            continue
+        if port is not None and port != row['src_port'] and port != row['dst_port']:
+            continue
+        selected.append(row)
+    selected.reverse()
+    return selected, complete or len(selected) >= limit
+
+
+def run_engine(shared_path, address, authkey, options):
+    """Proceso motor: captura y agregación; atiende las rutas reenviadas por los workers"""
+    # Ctrl+C llega a todo el grupo de procesos: solo el principal lo atiende
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.TSHARK_PATH = options['tshark']
+    server.DUMPCAP_PATH = options['dumpcap']
+    monitor = server.monitor = EngineMonitor(SharedSnapshot(shared_path))
+    monitor.history = server.HistoryStore(options['history'])
+    monitor.workers = options['workers']
+    try:
+        monitor.set_sampling(options['sampling'], options['sampling_rate'])
+    except ValueError as e:
+        print(f"❌ {e}")
+    if options['ring']:
+        monitor.ring_options = {'directory': options['ring'], 'max_files': 10, 'max_file_bytes': 64 << 20}
+
+    def serve(connection):
+        with connection:
+            try:
+                method, path, query_string, headers, body = connection.recv()
+            except EOFError:
+                return
+            try:
+                response = server.app.test_client().open(path, method=method, query_string=query_string,
+                                                         headers=headers, data=body)
+                connection.send((response.status_code, response.headers.to_wsgi_list(), response.get_data()))
+            except Exception as e:
+                print(f"❌ Error atendiendo {method} {path} en el motor: {e}")
+                message = json.dumps({'status': 'error', 'message': str(e)}).encode()
+                connection.send((500, [('Content-Type', 'application/json')], message))
+
+    def shutdown(signum, frame):
+        # El proceso principal termina al motor con SIGTERM: primero se cierran las capturas
+        if monitor.is_monitoring:
+            monitor.stop_monitoring()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    with Listener(address, 'AF_UNIX', authkey=authkey) as listener:
+        print(f"⚙️ Motor de captura listo (pid {os.getpid()})")
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError) as e:
+                print(f"⚠️ Conexión rechazada al motor: {e}")
+                continue
+            threading.Thread(target=serve, args=(connection,), daemon=True).start()
+
+
+def create_api(shared, address, authkey, keepalive=15, poll_interval=0.2):
+    """App Flask de un worker: lecturas desde la memoria compartida, el resto al motor"""
+    api = Flask(__name__)
+    CORS(api)
+
+    @api.route('/api/stats', methods=['GET'])
+    def get_stats():
+        """Snapshot publicado por el motor (con ETag); ?interface= para una captura"""
+        view = shared.read_view()
+        body = view.body
+        interface = request.args.get('interface')
+        if interface:
+            body = view.interfaces.get(interface)
+            if body is None:
+                return jsonify({'status': 'error', 'message': f'Interfaz sin captura: {interface}'}), 404
+
+        headers = {'ETag': view.etag or '', 'Cache-Control': 'no-cache'}
+        if view.etag and view.etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype='application/json', headers=headers)
+
+    @api.route('/api/connections', methods=['GET'])
+    def get_connections():
+        """Últimas conexiones que cumplen los filtros (protocol, ip, port, from, to)
+
+        Se filtran las últimas SHARED_CONNECTIONS publicadas en el segmento;
+        si con ellas no se llega a `limit` (y el rango pedido puede seguir en
+        conexiones más viejas) o no se publicaron, la consulta se reenvía al
+        motor, que filtra el historial completo.
+        """
+        try:
+            limit = max(0, int(request.args.get('limit', 50)))
+            protocol_filter = request.args.get('protocol', '').upper() or None
+            port = request.args.get('port')
+            port = int(port) if port else None
+            start = request.args.get('from')
+            end = request.args.get('to')
+            start = float(start) if start else None
+            end = float(end) if end else None
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'limit, port, from y to deben ser numéricos'}), 400
+        if protocol_filter and protocol_filter not in server.PROTOCOL_CODES:
+            return jsonify({'status': 'error', 'message': f'Protocolo no soportado: {protocol_filter}'}), 400
+
+        rows = shared.read_view().connections
+        if rows is None:
+            return forward('api/connections')
+        connections, complete = filter_connections(rows, limit, protocol_filter,
+                                                   request.args.get('ip') or None, port, start, end)
+        if not complete:
+            return forward('api/connections')
+        return jsonify({
+            'status': 'success',
+            'connections': connections,
+            'total': len(connections)
+        })
+
+    @api.route('/api/stream', methods=['GET'])
+    def stream_stats():
+        """Server-Sent Events: cada snapshot nuevo del segmento"""
+        def generate():
+            sequence = None
+            last_sent = 0
+            while True:
+                view = shared.read_view()
+                now = time.monotonic()
+                if view.sequence != sequence:
+                    sequence = view.sequence
+                    last_sent = now
+                    yield view.event
+                elif now - last_sent >= keepalive:
+                    last_sent = now
+                    yield ': keepalive\n\n'  # Mantener viva la conexión sin tráfico
+                time.sleep(poll_interval)
+
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+
+    @api.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE'])
+    @api.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+    def forward(path):
+        """Reenvía la request al proceso motor y devuelve su respuesta"""
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in ('host', 'content-length')]
+        try:
+            with Client(address, 'AF_UNIX', authkey=authkey) as connection:
+                connection.send((request.method, '/' + path, request.query_string.decode('latin-1'),
+                                 headers, request.get_data()))
+                status, response_headers, body = connection.recv()
+        except (OSError, EOFError) as e:
+            return jsonify({'status': 'error', 'message': f'Motor de captura no disponible: {e}'}), 503
+        response_headers = [(name, value) for name, value in response_headers
+                            if name.lower() not in ('content-length', 'access-control-allow-origin')]
+        return Response(body, status=status, headers=response_headers)
+
+    return api
+
+
+def run_worker(listener, shared_path, address, authkey, host, port):
+    """Proceso worker: sirve la API sobre el socket abierto por el proceso principal"""
+    from werkzeug.serving import make_server
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    api = create_api(SharedSnapshot(shared_path), address, authkey)
+    http = make_server(host, port, api, threaded=True, fd=listener.fileno())
+    print(f"🧵 Worker API listo (pid {os.getpid()})")
+    http.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor API REST para Wireshark con varios workers')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--api-workers', type=int, default=max(2, min(8, os.cpu_count() or 1)),
+                        help='Procesos que atienden la API')
+    parser.add_argument('--shared-size', type=int, default=8,
+                        help='Tamaño del segmento de memoria compartida (MB)')
+    parser.add_argument('--tshark', default=server.TSHARK_PATH, help='Ejecutable de tshark (o fake_tshark.py)')
+    parser.add_argument('--dumpcap', default=server.DUMPCAP_PATH, help='Ejecutable de dumpcap (o fake_tshark.py)')
+    parser.add_argument('--history', default=server.HISTORY_PATH, help='Archivo mmap del historial de tráfico')
+    parser.add_argument('--ring', metavar='DIR',
+                        help='Guarda los paquetes crudos en un anillo de pcaps (backend pcap)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Procesos de parseo del motor para el backend fields')
+    parser.add_argument('--sampling', choices=server.PacketSampler.MODES, default='off',
+                        help='Muestreo de paquetes: fijo 1 de cada N o adaptado al atraso del lector')
+    parser.add_argument('--sampling-rate', type=int, default=None,
+                        help='N del muestreo fijo (o tasa inicial del adaptativo)')
+    args = parser.parse_args()
+
+    # Los workers heredan el socket y el segmento: se usa fork
+    context = multiprocessing.get_context('fork')
+    shared = SharedSnapshot(SHARED_PATH, args.shared_size << 20, create=True)
+    address = os.path.join(tempfile.mkdtemp(prefix='wireshark_engine_'), 'engine.sock')
+    authkey = os.urandom(16)
+    listener = socket.create_server((args.host, args.port), backlog=1024)
+
+    engine = context.Process(target=run_engine, args=(SHARED_PATH, address, authkey, vars(args)),
+                             name='engine')  # No daemon: el parseo en procesos crea hijos
+    engine.start()
+    workers = [context.Process(target=run_worker,
+                               args=(listener, SHARED_PATH, address, authkey, args.host, args.port),
+                               name=f'api-{i}', daemon=True)
+               for i in range(args.api_workers)]
+    for worker in workers:
+        worker.start()
+
+    print(f"🚀 API en http://{args.host}:{args.port} con {args.api_workers} workers "
+          f"(segmento compartido: {SHARED_PATH})")
+    # SIGTERM (systemd, kill) limpia igual que Ctrl+C; se instala después del fork
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        engine.join()
+        print("❌ El motor de captura terminó")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in [engine] + workers:
+            process.terminate()
+        engine.join(10)
+        shared.close()
+        os.unlink(SHARED_PATH)
+        shutil.rmtree(os.path.dirname(address), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()